@@ -1,5 +1,11 @@
 from django.apps import AppConfig
+from django.core import checks
 
 
 class ApiConfig(AppConfig):
     name = "api"
+
+    def ready(self):
+        from core.writers import check_pdf_font
+
+        checks.register(check_pdf_font)
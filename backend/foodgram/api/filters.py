@@ -0,0 +1,23 @@
+"""Фильтры и сортировки представлений.
+   Объекты модуля:
+        RecipeOrderingFilter:
+            Сортировка рецептов по полям ordering_fields
+            и по популярности (ordering=popular).
+"""
+from rest_framework import filters
+
+
+class RecipeOrderingFilter(filters.OrderingFilter):
+    """Параметр ordering с именованными сортировками.
+    Именованная сортировка задаётся целиком и не сочетается
+    с другими полями в параметре.
+    """
+    named_orderings = {
+        "popular": ("-popularity", "-id"),
+    }
+
+    def get_ordering(self, request, queryset, view):
+        name = request.query_params.get(self.ordering_param, "").strip()
+        if name in self.named_orderings:
+            return list(self.named_orderings[name])
+        return super().get_ordering(request, queryset, view)
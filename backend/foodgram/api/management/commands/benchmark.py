@@ -0,0 +1,517 @@
+"""Менеджмент команда для замера производительности API.
+Команда создаёт тестовую БД (test_<имя БД> для PostgreSQL, в памяти
+для SQLite), заполняет её данными заданного объёма и проходит по всем
+маршрутам api/urls.py через тестовый клиент Django.
+Для каждого запроса считаются p50/p95 времени ответа, количество
+SQL-запросов и размер ответа в байтах. Результат сравнивается
+с базовым JSON-файлом, при регрессии команда завершается с ошибкой.
+Для применения команды в консоли прописываем:
+  python manage.py benchmark --save-baseline      - записать базу;
+  python manage.py benchmark                      - сравнить с базой;
+  python manage.py benchmark --recipes 100000 --iterations 50
+"""
+import base64
+import json
+import math
+import os
+import random
+import tempfile
+from io import BytesIO, StringIO
+from time import perf_counter
+from typing import Callable
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import (
+    CaptureQueriesContext,
+    override_settings,
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+    teardown_test_environment,
+)
+from PIL import Image
+from rest_framework.authtoken.models import Token
+
+from core.enums import DataVersions
+from core.services import bump_data_version
+from recipes.models import (
+    AmountIngredient, Cart, Favorit, Ingredient, Recipe, Tag
+)
+from users.models import CustomUser, Follow
+
+BENCHMARK_PASSWORD = "benchmark-password"
+
+# Шаг замера: (название, функция запроса). Функция получает клиент
+# и словарь состояния сценария, возвращает ответ
+Step = tuple[str, Callable[[Client, dict], object]]
+
+
+class DisableMigrations:
+    """MIGRATION_MODULES, при котором схема тестовой БД строится
+    прямо по моделям: миграции в репозитории не хранятся.
+    """
+
+    def __contains__(self, app_label: str) -> bool:
+        return True
+
+    def __getitem__(self, app_label: str) -> None:
+        return None
+
+
+def png_data_uri() -> str:
+    buffer = BytesIO()
+    Image.new("RGB", (64, 48), "orange").save(buffer, "PNG")
+    return "data:image/png;base64," + base64.b64encode(
+        buffer.getvalue()
+    ).decode()
+
+
+def percentile(values: list[float], share: float) -> float:
+    """Процентиль методом ближайшего ранга."""
+    ordered = sorted(values)
+    return ordered[max(math.ceil(share * len(ordered)) - 1, 0)]
+
+
+def response_size(response) -> int:
+    if response.streaming:
+        return sum(len(chunk) for chunk in response.streaming_content)
+    return len(response.content)
+
+
+def batch_size() -> int | None:
+    """Размер пакета bulk_create.
+    На SQLite размер выбирает Django по ограничению числа параметров.
+    """
+    return None if connection.vendor == "sqlite" else 1000
+
+
+def bulk_ids(model, objects: list) -> list[int]:
+    """Создаёт объекты и возвращает их pk.
+    SQLite не возвращает pk из bulk_create, поэтому новые pk
+    выбираются по возрастанию после последнего существующего.
+    """
+    last = model.objects.order_by("-pk").values_list("pk", flat=True).first()
+    model.objects.bulk_create(objects, batch_size=batch_size())
+    return list(model.objects.filter(pk__gt=last or 0).order_by(
+        "pk"
+    ).values_list("pk", flat=True))
+
+
+def seed(scale: dict, rnd: random.Random) -> None:
+    """Заполняет БД данными объёма scale.
+    Данные пишутся пакетно, производные данные (счётчики, списки
+    покупок, поисковый индекс) пересчитываются командами.
+    """
+    password = make_password(BENCHMARK_PASSWORD)
+    users = bulk_ids(CustomUser, [
+        CustomUser(
+            username=f"bench{number}",
+            email=f"bench{number}@example.com",
+            first_name="Бенч",
+            last_name="Марк",
+            password=password,
+        )
+        for number in range(scale["users"])
+    ])
+    Tag.objects.bulk_create([
+        Tag(name=name, slug=slug, color=color)
+        for name, slug, color in (
+            ("Завтрак", "breakfast", "#E26C2D"),
+            ("Обед", "lunch", "#49B64E"),
+            ("Ужин", "dinner", "#8775D2"),
+        )
+    ], ignore_conflicts=True)
+    tags = list(Tag.objects.values_list("pk", flat=True))
+    ingredients = list(Ingredient.objects.values_list("pk", flat=True))
+    if len(ingredients) < scale["ingredients"]:
+        ingredients += bulk_ids(Ingredient, [
+            Ingredient(name=f"Ингредиент {number}", measurement_unit="г")
+            for number in range(scale["ingredients"] - len(ingredients))
+        ])
+
+    recipes = bulk_ids(Recipe, [
+        Recipe(
+            author_id=rnd.choice(users),
+            name=f"Рецепт {number}",
+            text=f"Описание рецепта {number} " * 5,
+            cooking_time=rnd.randint(5, 120),
+            image="recipes/images/benchmark.png",
+        )
+        for number in range(scale["recipes"])
+    ])
+    AmountIngredient.objects.bulk_create((
+        AmountIngredient(
+            recipe_id=recipe, ingredients_id=ingredient,
+            amount=rnd.randint(1, 500),
+        )
+        for recipe in recipes
+        for ingredient in rnd.sample(ingredients, min(5, len(ingredients)))
+    ), batch_size=batch_size())
+    Recipe.tags.through.objects.bulk_create((
+        Recipe.tags.through(recipe_id=recipe, tag_id=tag)
+        for recipe in recipes
+        for tag in rnd.sample(tags, rnd.randint(1, min(2, len(tags))))
+    ), batch_size=batch_size())
+
+    for model, per_user in (
+        (Favorit, scale["favorites"]), (Cart, scale["carts"])
+    ):
+        model.objects.bulk_create((
+            model(user_id=user, recipe_id=recipe)
+            for user in users
+            for recipe in rnd.sample(recipes, min(per_user, len(recipes)))
+        ), batch_size=batch_size())
+    Follow.objects.bulk_create((
+        Follow(user_id=user, author_id=author)
+        for user in users
+        for author in rnd.sample(users, min(scale["follows"] + 1, len(users)))
+        if author != user
+    ), batch_size=batch_size())
+
+    for command in (
+        "counters", "shoppinglist", "searchindex", "feed", "similar",
+        "popularity",
+    ):
+        call_command(command, stdout=StringIO())
+    bump_data_version(DataVersions.INGREDIENTS.value)
+    bump_data_version(DataVersions.TAGS.value)
+
+
+def scenarios(user: CustomUser) -> list[list[Step]]:
+    """Сценарии по всем маршрутам api/urls.py.
+    Изменяющие запросы идут парами (создание и удаление),
+    чтобы данные не менялись от повтора к повтору.
+    """
+    # Рецепт не отмечен пользователем, а автор не в его подписках,
+    # иначе добавление отметки или подписки вернёт 400
+    recipe = Recipe.objects.exclude(author=user).exclude(
+        in_favorites__user=user
+    ).exclude(in_shopping_cart__user=user).exclude(
+        author__subscribers__user=user
+    ).order_by("-pub_date").first()
+    author = recipe.author_id
+    author_email = recipe.author.email
+    tag = Tag.objects.order_by("pk").first()
+    ingredient = Ingredient.objects.order_by("pk").first()
+    week_menu = {"recipes": list(Recipe.objects.exclude(
+        in_shopping_cart__user=user
+    ).order_by("-pub_date").values_list("pk", flat=True)[:7])}
+    image = png_data_uri()
+    recipe_data = {
+        "name": "Тестовый рецепт",
+        "text": "Описание",
+        "cooking_time": 10,
+        "image": image,
+        "tags": [tag.pk],
+        "ingredients": [{"id": ingredient.pk, "amount": 10}],
+    }
+
+    def get(url: str) -> Callable:
+        return lambda client, state: client.get(url)
+
+    def create_recipe(client, state):
+        response = client.post(
+            "/api/recipes/", recipe_data, content_type="application/json"
+        )
+        state["recipe"] = response.json()["id"]
+        return response
+
+    def register(client, state):
+        state["number"] = state.get("number", 0) + 1
+        return anonymous.post("/api/users/", {
+            "email": f"new{state['number']}-{os.getpid()}@example.com",
+            "username": f"new{state['number']}{os.getpid()}",
+            "first_name": "Новый",
+            "last_name": "Пользователь",
+            "password": BENCHMARK_PASSWORD,
+        })
+
+    # Выход удаляет токен пользователя, поэтому вход и выход
+    # проверяются другим пользователем без токена основного клиента
+    anonymous = Client()
+
+    def login(client, state):
+        return anonymous.post("/api/auth/token/login/", {
+            "email": author_email, "password": BENCHMARK_PASSWORD,
+        })
+
+    def logout(client, state):
+        token = login(client, state).json()["auth_token"]
+        return anonymous.post(
+            "/api/auth/token/logout/", HTTP_AUTHORIZATION=f"Token {token}"
+        )
+
+    return [
+        [("api root", get("/api/"))],
+        [("tags list", get("/api/tags/"))],
+        [("tags detail", get(f"/api/tags/{tag.pk}/"))],
+        [("ingredients list", get("/api/ingredients/"))],
+        [("ingredients search", get("/api/ingredients/?name=ингр"))],
+        [("ingredients detail", get(f"/api/ingredients/{ingredient.pk}/"))],
+        [("users list", get("/api/users/?page=1&limit=6"))],
+        [("users detail", get(f"/api/users/{author}/"))],
+        [("users me", get("/api/users/me/"))],
+        [("users subscriptions", get(
+            "/api/users/subscriptions/?page=1&limit=6&recipes_limit=3"
+        ))],
+        [
+            ("users subscribe", lambda client, state: client.post(
+                f"/api/users/{author}/subscribe/"
+            )),
+            ("users unsubscribe", lambda client, state: client.delete(
+                f"/api/users/{author}/subscribe/"
+            )),
+        ],
+        [("users register", register)],
+        [("auth token login", login)],
+        [("auth token logout", logout)],
+        [("recipes list", get("/api/recipes/?page=1&limit=6"))],
+        [("recipes list deep page", get("/api/recipes/?page=50&limit=6"))],
+        [("recipes list cursor", get("/api/recipes/?cursor=&limit=6"))],
+        [("recipes filtered", get(
+            f"/api/recipes/?page=1&limit=6&tags={tag.slug}"
+            "&is_favorited=0&is_in_shopping_cart=0"
+        ))],
+        [("recipes search", get("/api/recipes/?search=рецепт&limit=6"))],
+        [("recipes feed", get("/api/recipes/feed/?limit=6"))],
+        [("recipes detail", get(f"/api/recipes/{recipe.pk}/"))],
+        [("recipes similar", get(f"/api/recipes/{recipe.pk}/similar/"))],
+        [("recipes popular", get("/api/recipes/popular/?limit=6"))],
+        [("recipes ordering popular", get(
+            "/api/recipes/?ordering=popular&limit=6"
+        ))],
+        [
+            ("recipes favorite add", lambda client, state: client.post(
+                f"/api/recipes/{recipe.pk}/favorite/"
+            )),
+            ("recipes favorite remove", lambda client, state: client.delete(
+                f"/api/recipes/{recipe.pk}/favorite/"
+            )),
+        ],
+        [
+            ("recipes cart add", lambda client, state: client.post(
+                f"/api/recipes/{recipe.pk}/shopping_cart/"
+            )),
+            ("recipes cart remove", lambda client, state: client.delete(
+                f"/api/recipes/{recipe.pk}/shopping_cart/"
+            )),
+        ],
+        [
+            ("recipes cart batch add", lambda client, state: client.post(
+                "/api/recipes/shopping_cart/",
+                week_menu,
+                content_type="application/json",
+            )),
+            ("recipes cart batch remove", lambda client, state: client.delete(
+                "/api/recipes/shopping_cart/",
+                week_menu,
+                content_type="application/json",
+            )),
+        ],
+        [("shopping list txt", get(
+            "/api/recipes/download_shopping_cart/?format=txt"
+        ))],
+        [("shopping list csv", get(
+            "/api/recipes/download_shopping_cart/?format=csv"
+        ))],
+        [("shopping list pdf", get(
+            "/api/recipes/download_shopping_cart/?format=pdf"
+        ))],
+        [
+            ("recipes create", create_recipe),
+            ("recipes update", lambda client, state: client.patch(
+                f"/api/recipes/{state['recipe']}/",
+                {**recipe_data, "cooking_time": 20},
+                content_type="application/json",
+            )),
+            ("recipes delete", lambda client, state: client.delete(
+                f"/api/recipes/{state['recipe']}/"
+            )),
+        ],
+    ]
+
+
+class Command(BaseCommand):
+    help = "Замер времени ответа и числа SQL-запросов по маршрутам API"
+
+    def add_arguments(self, parser):
+        for name, default, help_text in (
+            ("users", 1000, "Количество пользователей"),
+            ("recipes", 10000, "Количество рецептов"),
+            ("ingredients", 500, "Минимальное количество ингредиентов"),
+            ("favorites", 20, "Избранных рецептов у пользователя"),
+            ("carts", 5, "Рецептов в корзине у пользователя"),
+            ("follows", 10, "Подписок у пользователя"),
+            ("iterations", 20, "Повторов каждого запроса"),
+            ("warmup", 2, "Повторов без замера перед замером"),
+            ("seed", 0, "Начальное значение генератора данных"),
+        ):
+            parser.add_argument(
+                f"--{name}", type=int, default=default, help=help_text
+            )
+        parser.add_argument(
+            "--baseline",
+            default="benchmark.json",
+            help="Путь к базовому JSON-файлу",
+        )
+        parser.add_argument(
+            "--save-baseline",
+            action="store_true",
+            help="Записать результат как базовый",
+        )
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=0.25,
+            help="Допустимый относительный рост p95",
+        )
+        parser.add_argument(
+            "--min-delta-ms",
+            type=float,
+            default=5.0,
+            help="Рост p95 меньше этого значения не считается регрессией",
+        )
+        parser.add_argument(
+            "--keepdb",
+            action="store_true",
+            help="Не удалять тестовую БД, повторно использовать данные",
+        )
+
+    def handle(self, *args, **options):
+        if options["iterations"] < 1:
+            raise CommandError("--iterations должен быть больше нуля")
+        scale = {
+            name: options[name]
+            for name in (
+                "users", "recipes", "ingredients",
+                "favorites", "carts", "follows",
+            )
+        }
+        setup_test_environment()
+        with override_settings(MIGRATION_MODULES=DisableMigrations()):
+            old_config = setup_databases(
+                verbosity=0, interactive=False, keepdb=options["keepdb"]
+            )
+        try:
+            with tempfile.TemporaryDirectory() as media, override_settings(
+                MEDIA_ROOT=media,
+                IMAGE_RENDITION_WORKERS=0,
+                FEED_FANOUT_WORKERS=0,
+            ):
+                if not Recipe.objects.exists():
+                    started = perf_counter()
+                    seed(scale, random.Random(options["seed"]))
+                    self.stdout.write(
+                        f"Данные созданы за {perf_counter() - started:.1f} с"
+                    )
+                results = self.run(options["iterations"], options["warmup"])
+        finally:
+            teardown_databases(
+                old_config, verbosity=0, keepdb=options["keepdb"]
+            )
+            teardown_test_environment()
+
+        self.report(results)
+        report = {"scale": scale, "endpoints": results}
+        if options["save_baseline"]:
+            with open(options["baseline"], "w", encoding="utf-8") as output:
+                json.dump(report, output, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(
+                f"Базовый результат записан в {options['baseline']}"
+            ))
+            return
+        if not os.path.exists(options["baseline"]):
+            self.stdout.write(
+                "Базовый файл не найден, запустите с --save-baseline"
+            )
+            return
+        with open(options["baseline"], encoding="utf-8") as source:
+            baseline = json.load(source)
+        if baseline.get("scale") != scale:
+            self.stderr.write(
+                "Объём данных отличается от базового, сравнение неточно"
+            )
+        regressions = self.compare(
+            baseline["endpoints"], results,
+            options["threshold"], options["min_delta_ms"],
+        )
+        if regressions:
+            raise CommandError(
+                "Регрессии производительности:\n" + "\n".join(regressions)
+            )
+        self.stdout.write(self.style.SUCCESS("Регрессий нет"))
+
+    def run(self, iterations: int, warmup: int) -> dict[str, dict]:
+        user = CustomUser.objects.order_by("pk").first()
+        token, _ = Token.objects.get_or_create(user=user)
+        client = Client(HTTP_AUTHORIZATION=f"Token {token.key}")
+        timings: dict[str, list[float]] = {}
+        results: dict[str, dict] = {}
+        for steps in scenarios(user):
+            state: dict = {}
+            for iteration in range(warmup + iterations):
+                for name, request in steps:
+                    with CaptureQueriesContext(connection) as queries:
+                        started = perf_counter()
+                        response = request(client, state)
+                        size = response_size(response)
+                        elapsed = (perf_counter() - started) * 1000
+                    if response.status_code >= 400:
+                        raise CommandError(
+                            f"{name}: ответ {response.status_code}"
+                        )
+                    if iteration < warmup:
+                        continue
+                    timings.setdefault(name, []).append(elapsed)
+                    result = results.setdefault(
+                        name, {"queries": 0, "bytes": 0}
+                    )
+                    result["queries"] = max(result["queries"], len(queries))
+                    result["bytes"] = max(result["bytes"], size)
+        for name, values in timings.items():
+            results[name]["p50_ms"] = round(percentile(values, 0.5), 2)
+            results[name]["p95_ms"] = round(percentile(values, 0.95), 2)
+        return results
+
+    def report(self, results: dict[str, dict]) -> None:
+        self.stdout.write(
+            f"{'Запрос':<28}{'p50, мс':>10}{'p95, мс':>10}"
+            f"{'SQL':>6}{'Байт':>10}"
+        )
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name:<28}{result['p50_ms']:>10.2f}"
+                f"{result['p95_ms']:>10.2f}{result['queries']:>6}"
+                f"{result['bytes']:>10}"
+            )
+
+    @staticmethod
+    def compare(
+        baseline: dict, results: dict, threshold: float, min_delta: float
+    ) -> list[str]:
+        """Регрессии относительно baseline.
+        Регрессия - рост числа SQL-запросов или рост p95 больше чем
+        в (1 + threshold) раз и больше чем на min_delta мс.
+        """
+        regressions = []
+        for name, result in results.items():
+            base = baseline.get(name)
+            if base is None:
+                continue
+            if result["queries"] > base["queries"]:
+                regressions.append(
+                    f"{name}: SQL-запросов {base['queries']} -> "
+                    f"{result['queries']}"
+                )
+            if (
+                result["p95_ms"] > base["p95_ms"] * (1 + threshold)
+                and result["p95_ms"] - base["p95_ms"] > min_delta
+            ):
+                regressions.append(
+                    f"{name}: p95 {base['p95_ms']} -> {result['p95_ms']} мс"
+                )
+        return regressions
@@ -1,10 +1,29 @@
-from core.enums import Tuples
+from api.serializers import RecipeIdsSerializer
+from core.enums import DataVersions, Limits, Tuples
+from core.services import (
+    get_data_version, get_user_state_stamp, toggle_recipe_marks
+)
+
+from hashlib import md5
+from typing import Callable
 
-from django.db.models import Model, Q
+from django.core.cache import cache
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import transaction
+from django.db.models import Model
+from django.http import Http404, HttpResponse, HttpResponseNotModified
 from django.shortcuts import get_object_or_404
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    patch_vary_headers,
+)
+from django.utils.http import http_date, parse_etags, quote_etag
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.serializers import ModelSerializer
 from rest_framework.status import (
+    HTTP_200_OK,
     HTTP_201_CREATED,
     HTTP_204_NO_CONTENT,
     HTTP_400_BAD_REQUEST,
@@ -13,20 +32,150 @@ from rest_framework.status import (
 
 class CreateDelViewMixin:
     """Добавление дополнительных методов в ViewSet.
-    Добавляет и удаляет объект Many-to-Many.
-    Метод create_del_obj проверяет тип запроса
-    и добавляет или удаляет объект.
+    Добавляет и удаляет отметки пользователя на рецептах
+    (избранное, корзина). Метод create_del_obj меняет отметку
+    одного рецепта, create_del_list - списка рецептов. Тип запроса
+    определяет, добавляется отметка или удаляется.
     """
     add_serializer: ModelSerializer | None = None
 
-    def create_del_obj(self, object, model: Model, q: Q) -> Response:
-        obj = get_object_or_404(self.queryset, id=object)
-        serializer: ModelSerializer = self.add_serializer(obj)
-        m2m_object = model.objects.filter(q & Q(user=self.request.user))
-        if (self.request.method in Tuples.ADD_METHODS) and not m2m_object:
-            model(None, obj.id, self.request.user.id).save()
-            return Response(serializer.data, status=HTTP_201_CREATED)
-        if (self.request.method in Tuples.DEL_METHODS) and m2m_object:
-            m2m_object[0].delete()
+    def create_del_obj(self, pk: int | str, model: type[Model]) -> Response:
+        try:
+            recipe_id = int(pk)
+        except ValueError:
+            raise Http404
+        add = self.request.method in Tuples.ADD_METHODS
+        changed = self.toggle_marks(model, [recipe_id], add)
+        if not changed:
+            get_object_or_404(self.queryset, id=recipe_id)
+            return Response(status=HTTP_400_BAD_REQUEST)
+        if not add:
             return Response(status=HTTP_204_NO_CONTENT)
-        return Response(status=HTTP_400_BAD_REQUEST)
+        serializer: ModelSerializer = self.add_serializer(
+            self.queryset.get(id=recipe_id)
+        )
+        return Response(serializer.data, status=HTTP_201_CREATED)
+
+    def create_del_list(self, model: type[Model]) -> Response:
+        """Отметки списка рецептов из тела запроса {"recipes": [id]}.
+        Возвращает id рецептов, отметка которых изменилась: уже
+        отмеченные и несуществующие рецепты пропускаются.
+        """
+        serializer = RecipeIdsSerializer(data=self.request.data)
+        serializer.is_valid(raise_exception=True)
+        add = self.request.method in Tuples.ADD_METHODS
+        changed = self.toggle_marks(
+            model, serializer.validated_data["recipes"], add
+        )
+        return Response(
+            {"recipes": sorted(changed)},
+            status=HTTP_201_CREATED if add and changed else HTTP_200_OK,
+        )
+
+    def toggle_marks(
+        self, model: type[Model], recipe_ids: list[int], add: bool
+    ) -> list[int]:
+        with transaction.atomic():
+            changed = toggle_recipe_marks(
+                model, self.request.user.id, recipe_ids, add
+            )
+            if changed:
+                self.m2m_changed(model, changed, added=add)
+        return changed
+
+    def m2m_changed(
+        self, model: type[Model], recipe_ids: list[int], added: bool
+    ) -> None:
+        """Вызывается в той же транзакции после добавления
+        или удаления отметок. Переопределяется в ViewSet.
+        """
+
+
+class VersionedCacheMixin:
+    """Кэширование списка справочника в ViewSet.
+    Готовый JSON хранится в кэше под ключом версии справочника
+    (см. core.services.get_data_version). Версия меняется при
+    изменении данных, поэтому старые записи больше не читаются.
+    В кэше хранится только список без параметров запроса:
+    отфильтрованные списки (например, поиск ингредиентов по name)
+    собираются при каждом запросе и не занимают кэш.
+    Ответ содержит ETag и Cache-Control, запрос с совпадающим
+    If-None-Match получает 304 без обращения к БД.
+    """
+    data_version: DataVersions | None = None
+
+    def list(self, request: WSGIRequest, *args, **kwargs) -> HttpResponse:
+        version = get_data_version(self.data_version.value)
+        etag = quote_etag(md5(
+            f"{version}:{request.get_full_path()}".encode()
+        ).hexdigest())
+        if_none_match = request.META.get("HTTP_IF_NONE_MATCH", "")
+        if etag in parse_etags(if_none_match) or if_none_match == "*":
+            response = HttpResponseNotModified()
+        else:
+            key = f"rendered:{self.data_version.value}:{version}"
+            cached = not request.query_params
+            content = cache.get(key) if cached else None
+            if content is None:
+                content = JSONRenderer().render(
+                    self.get_list_data(request, *args, **kwargs)
+                )
+                if cached:
+                    cache.set(key, content)
+            response = HttpResponse(content, content_type="application/json")
+        response["ETag"] = etag
+        patch_cache_control(
+            response,
+            public=True,
+            max_age=Limits.REFERENCE_CACHE_MAX_AGE.value,
+        )
+        return response
+
+    def get_list_data(self, request: WSGIRequest, *args, **kwargs):
+        """Данные списка для сериализации в JSON."""
+        return super().list(request, *args, **kwargs).data
+
+
+class ConditionalGetMixin:
+    """Условные GET-запросы (ETag и Last-Modified) в ViewSet.
+    Валидаторы строятся из времени изменения данных, версий
+    справочников, которые выводятся в ответе (ингредиенты, тэги),
+    и отметки состояния пользователя (избранное, корзина, подписки).
+    Если валидаторы совпадают с If-None-Match или If-Modified-Since,
+    ответ 304 возвращается без сериализации данных.
+    """
+    reference_versions: tuple[DataVersions, ...] = (
+        DataVersions.INGREDIENTS, DataVersions.TAGS
+    )
+
+    def conditional_response(
+        self,
+        request: WSGIRequest,
+        modified: float,
+        get_response: Callable[[], Response],
+    ) -> HttpResponse:
+        """modified - время изменения данных ответа (timestamp)."""
+        user = request.user
+        stamp = 0.0
+        if not user.is_anonymous:
+            stamp = get_user_state_stamp(user.id)
+        versions = ":".join(
+            get_data_version(version.value)
+            for version in self.reference_versions
+        )
+        etag = quote_etag(md5(
+            f"{request.get_full_path()}:{user.id}:{modified}:{stamp}:"
+            f"{versions}".encode()
+        ).hexdigest())
+        modified = max(modified, stamp)
+        response = get_conditional_response(
+            request, etag=etag, last_modified=int(modified)
+        )
+        if response is None:
+            response = get_response()
+        if response.status_code in (200, 304):
+            response["ETag"] = etag
+            response["Last-Modified"] = http_date(modified)
+            patch_cache_control(response, private=True, no_cache=True)
+            patch_vary_headers(response, ("Authorization",))
+        return response
@@ -0,0 +1,11 @@
+from rest_framework.negotiation import DefaultContentNegotiation
+
+
+class IgnoreFormatNegotiation(DefaultContentNegotiation):
+    """Согласование без учёта параметра ?format=.
+    Для выгрузки файлов параметр format выбирает формат файла,
+    а ответы с ошибками отдаются первым рендерером (JSON).
+    """
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
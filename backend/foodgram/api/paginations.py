@@ -1,8 +1,276 @@
-from rest_framework.pagination import PageNumberPagination
+"""Постраничный вывод.
+   По умолчанию страницы выбираются параметрами page и limit.
+   Если в запросе есть параметр cursor, страница выбирается по ключу
+   сортировки (keyset): без COUNT(*) и без OFFSET, поэтому скорость
+   не зависит от глубины прокрутки. Первая страница запрашивается
+   с пустым курсором (?cursor=), следующие - по ссылкам next/previous.
+   Ключ курсора берётся из сортировки выборки (в том числе из параметра
+   ordering) и дополняется id. Сортировку не по полю модели, например
+   по релевантности поиска, курсор не поддерживает: ответ 400.
+"""
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+
+from django.core.exceptions import (
+    FieldDoesNotExist, ValidationError as DjangoValidationError
+)
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from core import feed
+from core.enums import Limits, UrlRequests
+from recipes.models import FeedEntry
+
+
+class KeysetPagination(BasePagination):
+    """Постраничный вывод по ключу сортировки.
+    Ключ - поля order_by выборки, а если выборка не упорядочена
+    явно - keys. Последнее поле ключа должно быть уникальным,
+    иначе к ключу добавляется первичный ключ.
+    Курсор хранит значения ключа крайнего объекта страницы
+    и направление прокрутки.
+    """
+    keys: tuple[str, ...] = ("-pub_date", "-id")
+    cursor_query_param = UrlRequests.CURSOR.value
+    page_size_query_param = 'limit'
+    page_size = Limits.DEFAULT_PAGE_SIZE.value
+    max_page_size = Limits.MAX_PAGE_SIZE.value
+    invalid_cursor_message = 'Неверный курсор.'
+    invalid_ordering_message = 'Курсор не поддерживает эту сортировку.'
+
+    def get_page_size(self, request) -> int:
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size < 1:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def paginate_queryset(self, queryset, request, view=None) -> list:
+        self.request = request
+        self.model = queryset.model
+        self.keys = self.get_keys(queryset)
+        page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+        reverse = cursor is not None and cursor[1]
+
+        page = self.fetch(
+            queryset, cursor and cursor[0], reverse, page_size + 1
+        )
+        has_more = len(page) > page_size
+        page = page[:page_size]
+        if reverse:
+            page.reverse()
+            has_previous, has_next = has_more, True
+        else:
+            has_previous, has_next = cursor is not None, has_more
+
+        self.next_cursor = self.previous_cursor = None
+        if page and has_next:
+            self.next_cursor = self.encode_cursor(page[-1], False)
+        if page and has_previous:
+            self.previous_cursor = self.encode_cursor(page[0], True)
+        return page
+
+    def get_keys(self, queryset) -> tuple[str, ...]:
+        """Ключ курсора по сортировке queryset."""
+        ordering = queryset.query.order_by
+        if not ordering:
+            return self.keys
+        opts = queryset.model._meta
+        keys = []
+        for key in ordering:
+            field = self.order_field(opts, key)
+            if field is None:
+                raise ValidationError(
+                    {self.cursor_query_param: self.invalid_ordering_message}
+                )
+            keys.append(key.replace(key.lstrip('-'), field.name))
+        if not field.unique:
+            keys.append(
+                f'-{opts.pk.name}' if keys[-1].startswith('-') else opts.pk.name
+            )
+        return tuple(keys)
+
+    @staticmethod
+    def order_field(opts, key):
+        """Поле модели из элемента order_by или None,
+        если сортировка идёт не по собственному полю модели.
+        """
+        if not isinstance(key, str):
+            return None
+        name = key.lstrip('-')
+        try:
+            field = opts.pk if name == 'pk' else opts.get_field(name)
+        except FieldDoesNotExist:
+            return None
+        if not field.concrete or field.is_relation:
+            return None
+        return field
+
+    def fetch(
+        self, queryset, values: list | None, reverse: bool, limit: int
+    ) -> list:
+        """Первые limit объектов после курсора values."""
+        return list(self.order(queryset, self.keys, values, reverse)[:limit])
+
+    def order(self, queryset, keys: tuple, values: list | None, reverse: bool):
+        """queryset в порядке keys, начиная после values."""
+        if reverse:
+            keys = tuple(self.invert(key) for key in keys)
+        queryset = queryset.order_by(*keys)
+        if values is None:
+            return queryset
+        return queryset.filter(self.after(values, keys))
+
+    def get_paginated_response(self, data) -> Response:
+        return Response({
+            'next': self.get_link(self.next_cursor),
+            'previous': self.get_link(self.previous_cursor),
+            'results': data,
+        })
+
+    def get_link(self, cursor: str | None) -> str | None:
+        if cursor is None:
+            return None
+        url = remove_query_param(
+            self.request.build_absolute_uri(), 'page'
+        )
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    @staticmethod
+    def invert(key: str) -> str:
+        return key[1:] if key.startswith('-') else f'-{key}'
+
+    @staticmethod
+    def after(values: list, keys: tuple) -> Q:
+        """Условие "строго после курсора" в порядке keys.
+        Для ключа (a, b): a < x OR (a = x AND b < y).
+        При обратной прокрутке передаются развёрнутые keys.
+        """
+        condition = Q()
+        for position, key in enumerate(keys):
+            name = key.lstrip('-')
+            lookup = 'lt' if key.startswith('-') else 'gt'
+            equal = {
+                previous.lstrip('-'): value
+                for previous, value in zip(keys[:position], values)
+            }
+            condition |= Q(**equal, **{f'{name}__{lookup}': values[position]})
+        return condition
+
+    def encode_cursor(self, obj, reverse: bool) -> str:
+        # value_to_string сохраняет дату с микросекундами,
+        # иначе объекты с одинаковой до миллисекунд датой теряются
+        values = [
+            obj._meta.get_field(key.lstrip('-')).value_to_string(obj)
+            for key in self.keys
+        ]
+        data = json.dumps([values, reverse])
+        return urlsafe_b64encode(data.encode()).decode()
+
+    def decode_cursor(self, request) -> tuple[list, bool] | None:
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            values, reverse = json.loads(urlsafe_b64decode(encoded.encode()))
+            if len(values) != len(self.keys):
+                raise ValueError
+            values = [
+                self.model._meta.get_field(key.lstrip('-')).to_python(value)
+                for key, value in zip(self.keys, values)
+            ]
+        except (
+            BinasciiError, DjangoValidationError, TypeError, ValueError
+        ):
+            raise NotFound(self.invalid_cursor_message)
+        return values, bool(reverse)
+
+
+class FeedPagination(KeysetPagination):
+    """Лента подписок по курсору.
+    Страница собирается из двух источников, каждый читается
+    по своему индексу: рецепты из ленты пользователя FeedEntry
+    и рецепты авторов, которые не рассылаются в ленты
+    (см. core.feed). Источники сливаются по ключу (pub_date, id).
+    """
+    entry_keys = ("-pub_date", "-recipe_id")
+
+    def get_keys(self, queryset) -> tuple[str, ...]:
+        return self.keys
+
+    def fetch(
+        self, queryset, values: list | None, reverse: bool, limit: int
+    ) -> list:
+        user_id = self.request.user.id
+        recipe_ids = list(self.order(
+            FeedEntry.objects.filter(user_id=user_id),
+            self.entry_keys, values, reverse,
+        ).values_list("recipe_id", flat=True)[:limit])
+        page = list(queryset.filter(id__in=recipe_ids)) if recipe_ids else []
+        authors = feed.pull_authors(user_id)
+        if authors:
+            page += super().fetch(
+                queryset.filter(author_id__in=authors), values, reverse, limit
+            )
+        # Рецепт может быть в обоих источниках, если автор
+        # перестал рассылаться после записи в ленту
+        page = list({recipe.id: recipe for recipe in page}.values())
+        page.sort(
+            key=lambda recipe: (recipe.pub_date, recipe.id),
+            reverse=not reverse,
+        )
+        return page[:limit]
 
 
 class PageLimitPagination(PageNumberPagination):
+    """Постраничный вывод параметрами page и limit.
+    При параметре cursor в запросе страница выбирается
+    через cursor_pagination_class.
+    """
+    page_size = Limits.DEFAULT_PAGE_SIZE.value
+    page_size_query_param = 'limit'
+    max_page_size = Limits.MAX_PAGE_SIZE.value
+    cursor_pagination_class = KeysetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_paginator = None
+        if UrlRequests.CURSOR.value in request.query_params:
+            self.cursor_paginator = self.cursor_pagination_class()
+            return self.cursor_paginator.paginate_queryset(
+                queryset, request, view
+            )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data) -> Response:
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class ListPagination(PageNumberPagination):
+    """Постраничный вывод готового списка параметрами page и limit.
+    Страница - срез списка, используется для списков из памяти
+    (популярные рецепты).
+    """
+    page_size = Limits.DEFAULT_PAGE_SIZE.value
     page_size_query_param = 'limit'
+    max_page_size = Limits.MAX_PAGE_SIZE.value
+
+
+class UserKeysetPagination(KeysetPagination):
+    keys = ("username", "id")
+
+
+class UserPagination(PageLimitPagination):
+    cursor_pagination_class = UserKeysetPagination
+
 
 class SubPagination(PageNumberPagination):
     page_query_param = 3
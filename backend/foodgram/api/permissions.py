@@ -39,8 +39,8 @@ class AdminOrReadOnly(BanPermission):
     """
 
     def has_object_permission(
-            self,
-            request: WSGIRequest, view: APIRootView) -> bool:
+        self, request: WSGIRequest, view: APIRootView, obj: Model
+    ) -> bool:
         return (
             request.method in SAFE_METHODS
             or request.user.is_authenticated
@@ -1,20 +1,73 @@
-from rest_framework.serializers import ModelSerializer, SerializerMethodField
+from rest_framework.serializers import (
+    IntegerField,
+    ListField,
+    ModelSerializer,
+    Serializer,
+    SerializerMethodField,
+)
 from django.core.exceptions import ValidationError
+from django.db import transaction
 from django.db.models import F, QuerySet
 
-from core.services import recipe_amount_ingredients_set, Base64ImageField
+from core.enums import Limits
+from core.images import image_srcset
+from core.services import (
+    recipe_amount_ingredients_set,
+    shopping_list_apply,
+    Base64ImageField,
+)
 from core.validators import ingredients_validator, tags_validator
 from users.models import CustomUser
 from recipes.models import Ingredient, Recipe, Tag
 
 
+def get_request_user(context: dict) -> CustomUser:
+    """Пользователь текущего запроса из контекста сериализатора."""
+    request = context.get("request") or context.get("view").request
+    return request.user
+
+
+def get_subscribed_ids(context: dict) -> set[int]:
+    """id авторов, на которых подписан пользователь запроса.
+    Множество загружается одним запросом и сохраняется в объекте
+    запроса, поэтому все сериализаторы в рамках запроса
+    используют одну выборку.
+    """
+    request = context.get("request") or context.get("view").request
+    subscribed_ids = getattr(request, "_subscribed_ids", None)
+    if subscribed_ids is None:
+        if request.user.is_anonymous:
+            subscribed_ids = set()
+        else:
+            subscribed_ids = set(request.user.subscriptions.values_list(
+                "author_id", flat=True
+            ))
+        request._subscribed_ids = subscribed_ids
+    return subscribed_ids
+
+
 class CropRecipeSerializer(ModelSerializer):
     """Сериализатор вывода рецептов по подпискам."""
+    image_srcset = SerializerMethodField()
+
     class Meta:
         model = Recipe
-        fields = "id", "name", "image", "cooking_time"
+        fields = "id", "name", "image", "image_srcset", "cooking_time"
         read_only_fields = ("__all__",)
 
+    def get_image_srcset(self, recipe: Recipe) -> dict[str, str]:
+        """Уменьшенные копии изображения в формате srcset."""
+        return image_srcset(recipe, self.context.get("request"))
+
+
+class RecipeIdsSerializer(Serializer):
+    """Список id рецептов для изменения избранного или корзины."""
+    recipes = ListField(
+        child=IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=Limits.MAX_BATCH_RECIPES.value,
+    )
+
 
 class UserSerializer(ModelSerializer):
     """Сериализатор для использования с моделью CustomUser."""
@@ -37,12 +90,12 @@ class UserSerializer(ModelSerializer):
     def get_is_subscribed(self, obj: CustomUser) -> bool:
         """Проверка подписки.
         Метод проверяет авторизацию и подписку.
-        Если запись найдена, возвращает True.
+        Если автор есть среди подписок, возвращает True.
         """
-        user = self.context.get("view").request.user
+        user = get_request_user(self.context)
         if user.is_anonymous or (user == obj):
             return False
-        return user.subscriptions.filter(author=obj).exists()
+        return obj.id in get_subscribed_ids(self.context)
 
     def create(self, validated_data: dict) -> CustomUser:
         """Создание нового пользователя."""
@@ -76,8 +129,17 @@ class UserSubscribeSerializer(UserSerializer):
         )
         read_only_fields = ("__all__",)
 
-    def get_recipes(self, obj):
-        recipes = obj.recipes.all()[:3]
+    def get_recipes(self, obj: CustomUser) -> list[dict]:
+        """Последние рецепты автора.
+        Используется список из limited_recipes_prefetch,
+        иначе рецепты выбираются с учётом recipes_limit.
+        """
+        recipes = getattr(obj, "limited_recipes", None)
+        if recipes is None:
+            limit = self.context.get(
+                "recipes_limit", Limits.DEFAULT_RECIPES_LIMIT.value
+            )
+            recipes = obj.recipes.all()[:limit]
         serializer = CropRecipeSerializer(recipes, many=True, read_only=True)
         return serializer.data
 
@@ -88,8 +150,8 @@ class UserSubscribeSerializer(UserSerializer):
         return True
 
     def get_recipes_count(self, obj: CustomUser) -> int:
-        """Количество рецептов у автора."""
-        return obj.recipes.count()
+        """Количество рецептов у автора из счётчика модели."""
+        return obj.recipes_count
 
 
 class TagSerializer(ModelSerializer):
@@ -118,6 +180,7 @@ class RecipeSerializer(ModelSerializer):
     is_favorited = SerializerMethodField()
     is_in_shopping_cart = SerializerMethodField()
     image = Base64ImageField(required=True)
+    image_srcset = SerializerMethodField()
 
     class Meta:
         model = Recipe
@@ -130,6 +193,7 @@ class RecipeSerializer(ModelSerializer):
             "is_in_shopping_cart",
             "name",
             "image",
+            "image_srcset",
             "text",
             "cooking_time",
         )
@@ -138,21 +202,40 @@ class RecipeSerializer(ModelSerializer):
             "is_in_shopping_cart",
         )
 
-    def get_ingredients(self, recipe: Recipe) -> QuerySet:
-        """Список ингридиентов для рецепта."""
+    def get_ingredients(self, recipe: Recipe) -> list[dict] | QuerySet:
+        """Список ингридиентов для рецепта.
+        Если строки AmountIngredient загружены через prefetch_related,
+        список собирается без обращения к БД.
+        """
+        if "ingredient" in getattr(recipe, "_prefetched_objects_cache", {}):
+            return [
+                {
+                    "id": amount.ingredients.id,
+                    "name": amount.ingredients.name,
+                    "measurement_unit": amount.ingredients.measurement_unit,
+                    "amount": amount.amount,
+                }
+                for amount in recipe.ingredient.all()
+            ]
         ingredients = recipe.ingredients.values(
             "id", "name", "measurement_unit", amount=F("recipe__amount")
         )
         return ingredients
 
+    def get_image_srcset(self, recipe: Recipe) -> dict[str, str]:
+        """Уменьшенные копии изображения в формате srcset."""
+        return image_srcset(recipe, self.context.get("request"))
+
     def get_is_favorited(self, recipe: Recipe) -> bool:
         """Проверка добавления в избранное.
         Метод проверяет авторизацию и наличие объекта.
         Если запись найдена, возвращает True.
         """
-        user = self.context.get("view").request.user
+        user = get_request_user(self.context)
         if user.is_anonymous:
             return False
+        if hasattr(recipe, "is_favorited"):
+            return recipe.is_favorited
         return user.favorites.filter(recipe=recipe).exists()
 
     def get_is_in_shopping_cart(self, recipe: Recipe) -> bool:
@@ -162,9 +245,11 @@ class RecipeSerializer(ModelSerializer):
         """
         if not isinstance(recipe, Recipe):
             return False
-        user = self.context.get("view").request.user
+        user = get_request_user(self.context)
         if user.is_anonymous:
             return False
+        if hasattr(recipe, "is_in_shopping_cart"):
+            return recipe.is_in_shopping_cart
         return user.carts.filter(recipe=recipe).exists()
 
     def validate(self, data: dict) -> dict:
@@ -175,37 +260,62 @@ class RecipeSerializer(ModelSerializer):
         if not tags_obj or not ingredients:
             raise ValidationError("Не введены данные")
 
-        tags_validator(tags_obj, Tag)
-        ingredients = ingredients_validator(ingredients, Ingredient)
+        errors = {}
+        try:
+            tags = tags_validator(tags_obj, Tag)
+        except ValidationError as error:
+            errors.update(error.message_dict)
+        try:
+            ingredients = ingredients_validator(ingredients, Ingredient)
+        except ValidationError as error:
+            errors.update(error.message_dict)
+        if errors:
+            raise ValidationError(errors)
         data.update({
-            "tags": tags_obj,
+            "tags": tags,
             "ingredients": ingredients,
             "author": self.context.get("request").user
         })
         return data
 
+    @transaction.atomic
     def create(self, validated_data: dict) -> Recipe:
         """Создание нового рецепта."""
         tags: list = validated_data.pop("tags")
         ingredients: list = validated_data.pop("ingredients")
         recipe = Recipe.objects.create(**validated_data)
-        recipe_amount_ingredients_set(recipe, ingredients)
+        # Документ поиска пересчитывается при фиксации транзакции
+        # по сигналу сохранения рецепта, уже с ингредиентами
+        recipe_amount_ingredients_set(recipe, ingredients, created=True)
         recipe.tags.set(tags)
         return recipe
 
+    @transaction.atomic
     def update(self, recipe: Recipe, validated_data: dict):
-        """Обновление рецепта."""
+        """Обновление рецепта.
+        Тэги и ингредиенты изменяются только в отличающейся части.
+        Изменение ингредиентов переносится в списки покупок
+        пользователей, у которых рецепт в корзине.
+        """
         tags = validated_data.pop("tags")
         ingredients = validated_data.pop("ingredients")
 
         for key, value in validated_data.items():
             if hasattr(recipe, key):
                 setattr(recipe, key, value)
+        recipe.save()
         if tags:
-            recipe.tags.clear()
             recipe.tags.set(tags)
         if ingredients:
-            recipe.ingredients.clear()
-            recipe_amount_ingredients_set(recipe, ingredients)
-        recipe.save()
+            delta = recipe_amount_ingredients_set(recipe, ingredients)
+            getattr(recipe, "_prefetched_objects_cache", {}).pop(
+                "ingredient", None
+            )
+            if delta:
+                shopping_list_apply(
+                    list(recipe.in_shopping_cart.values_list(
+                        "user_id", flat=True
+                    )),
+                    delta,
+                )
         return recipe
@@ -0,0 +1,347 @@
+"""Тесты API рецептов.
+   Классы модуля:
+        RecipeAPITestCase:
+            Общие данные тестов: рецепты, тэги, ингредиенты,
+            избранное, корзина и подписка.
+        RecipeListQueriesTest:
+            Количество запросов к БД на страницу списка рецептов
+            не зависит от размера страницы, а без постраничного
+            вывода - от числа рецептов.
+        RecipeCursorTest:
+            Курсор следует сортировке из параметра ordering,
+            сортировку по релевантности поиска не принимает.
+        RecipeListPlanTest:
+            Запросы списка с фильтрами по тэгам, избранному и корзине
+            выполняются по индексам, без Seq Scan и Sort.
+            Проверяется только на PostgreSQL.
+        SimilarRecipesTest:
+            Списки похожих рецептов команды similar совпадают
+            с перебором всех пар, в том числе после удаления рецепта.
+        RecipeSearchTest:
+            Слова поиска ищутся как префиксы.
+        ShoppingListPDFTest:
+            Список покупок в PDF записан текстом, без шрифта
+            формат pdf отвечает понятной ошибкой.
+        IngredientListCacheTest:
+            В кэше хранится только полный список ингредиентов,
+            поиск по name кэш не заполняет.
+        IngredientIndexCommitTest:
+            Новый ингредиент находится поиском только после
+            фиксации транзакции.
+"""
+from io import StringIO
+from math import sqrt
+from unittest import skipUnless
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase
+
+from api import mixins
+from api.views import RecipeViewSet
+from core import fulltext, writers
+from core.enums import Limits
+from core.search import ingredient_index
+from recipes.models import (
+    AmountIngredient, Cart, Favorit, Ingredient, Recipe, SimilarRecipe, Tag
+)
+from users.models import CustomUser, Follow
+
+
+def create_user(username: str) -> CustomUser:
+    return CustomUser.objects.create_user(
+        username=username,
+        email=f"{username}@foodgram.ru",
+        password="password",
+        first_name=username,
+        last_name=username,
+    )
+
+
+class RecipeAPITestCase(APITestCase):
+    RECIPES = 25
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user("reader")
+        authors = [create_user(f"author{number}") for number in range(3)]
+        tags = [
+            Tag.objects.create(
+                name=f"Тэг {number}", color=f"#00000{number}",
+                slug=f"tag{number}",
+            )
+            for number in range(3)
+        ]
+        ingredients = [
+            Ingredient.objects.create(
+                name=f"Ингредиент {number}", measurement_unit="г"
+            )
+            for number in range(5)
+        ]
+        for number in range(cls.RECIPES):
+            recipe = Recipe.objects.create(
+                author=authors[number % len(authors)],
+                name=f"Рецепт {number}",
+                text="Описание",
+                cooking_time=10,
+                image="recipes/images/recipe.png",
+                popularity=number % 4,
+            )
+            recipe.tags.set(tags[:1 + number % len(tags)])
+            AmountIngredient.objects.bulk_create(
+                AmountIngredient(
+                    recipe=recipe, ingredients=ingredient, amount=number + 1
+                )
+                for ingredient in ingredients[:1 + number % len(ingredients)]
+            )
+            if number % 2:
+                Favorit.objects.create(user=cls.user, recipe=recipe)
+            if number % 3:
+                Cart.objects.create(user=cls.user, recipe=recipe)
+        Follow.objects.create(user=cls.user, author=authors[0])
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+
+class RecipeListQueriesTest(RecipeAPITestCase):
+
+    def count_queries(self, limit: int | None) -> int:
+        query = "" if limit is None else f"?limit={limit}"
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(f"/api/recipes/{query}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            len(response.data["results"]),
+            Limits.DEFAULT_PAGE_SIZE.value if limit is None else limit,
+        )
+        return len(context)
+
+    def test_queries_do_not_depend_on_page_size(self):
+        self.assertEqual(self.count_queries(5), self.count_queries(20))
+
+    def test_queries_without_limit(self):
+        self.assertEqual(self.count_queries(None), self.count_queries(5))
+
+    def test_queries_without_pagination(self):
+        with patch.object(RecipeViewSet, "pagination_class", None):
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get("/api/recipes/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), self.RECIPES)
+        # Без постраничного вывода нет запроса COUNT(*)
+        self.assertEqual(len(context), self.count_queries(5) - 1)
+
+    def test_user_filters_and_flags(self):
+        response = self.client.get(
+            "/api/recipes/?limit=25&is_favorited=1&is_in_shopping_cart=0"
+        )
+        self.assertEqual(response.status_code, 200)
+        expected = set(Recipe.objects.filter(
+            in_favorites__user=self.user
+        ).exclude(
+            in_shopping_cart__user=self.user
+        ).values_list("id", flat=True))
+        results = response.data["results"]
+        self.assertEqual({recipe["id"] for recipe in results}, expected)
+        for recipe in results:
+            self.assertTrue(recipe["is_favorited"])
+            self.assertFalse(recipe["is_in_shopping_cart"])
+
+
+class RecipeCursorTest(RecipeAPITestCase):
+
+    def walk(self, url: str) -> list[int]:
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids += [recipe["id"] for recipe in response.data["results"]]
+            url = response.data["next"]
+        return ids
+
+    def test_cursor_follows_ordering(self):
+        expected = list(Recipe.objects.order_by(
+            "-popularity", "-id"
+        ).values_list("id", flat=True))
+        self.assertEqual(
+            self.walk("/api/recipes/?ordering=popular&limit=4&cursor="),
+            expected,
+        )
+        expected = list(Recipe.objects.order_by(
+            "pub_date", "id"
+        ).values_list("id", flat=True))
+        self.assertEqual(
+            self.walk("/api/recipes/?ordering=pub_date&limit=4&cursor="),
+            expected,
+        )
+
+    def test_cursor_rejects_search_ranking(self):
+        response = self.client.get("/api/recipes/?search=Рецепт&cursor=")
+        self.assertEqual(response.status_code, 400)
+
+
+@skipUnless(
+    connection.vendor == "postgresql", "Планы запросов проверяются на PostgreSQL"
+)
+class RecipeListPlanTest(RecipeAPITestCase):
+    """Планы строятся с выключенными seqscan и sort: на маленькой
+    тестовой базе они остаются в плане, только если для запроса
+    нет подходящего индекса.
+    """
+
+    def plans(self, query: str) -> list[str]:
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(f"/api/recipes/?{query}")
+        self.assertEqual(response.status_code, 200)
+        statements = [
+            captured["sql"] for captured in context.captured_queries
+            if captured["sql"].startswith("SELECT")
+            and 'FROM "recipes_recipe"' in captured["sql"]
+        ]
+        self.assertTrue(statements)
+        plans = []
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            cursor.execute("SET LOCAL enable_sort = off")
+            for sql in statements:
+                cursor.execute(f"EXPLAIN {sql}")
+                plans.append("\n".join(row[0] for row in cursor.fetchall()))
+        return plans
+
+    def assert_index_plans(self, query: str) -> None:
+        for plan in self.plans(query):
+            self.assertNotIn("Seq Scan", plan)
+            self.assertNotIn("Sort", plan)
+
+    def test_tags_filter(self):
+        self.assert_index_plans("tags=tag1&tags=tag2")
+
+    def test_favorite_filter(self):
+        self.assert_index_plans("is_favorited=1")
+
+    def test_cart_filter(self):
+        self.assert_index_plans("is_in_shopping_cart=1")
+
+
+class SimilarRecipesTest(RecipeAPITestCase):
+    TOP = 5
+
+    def expected(self) -> dict[int, list[tuple[int, float]]]:
+        ingredients = {}
+        for recipe_id, ingredient_id in AmountIngredient.objects.values_list(
+            "recipe_id", "ingredients_id"
+        ):
+            ingredients.setdefault(recipe_id, set()).add(ingredient_id)
+        expected = {}
+        for recipe_id, own in ingredients.items():
+            scores = [
+                (len(own & other) / sqrt(len(own) * len(other)), other_id)
+                for other_id, other in ingredients.items()
+                if other_id != recipe_id and own & other
+            ]
+            scores.sort(reverse=True)
+            expected[recipe_id] = [
+                (other_id, round(score, 9))
+                for score, other_id in scores[:self.TOP]
+            ]
+        return expected
+
+    def stored(self) -> dict[int, list[tuple[int, float]]]:
+        stored = {}
+        for recipe_id, similar_id, score in SimilarRecipe.objects.order_by(
+            "recipe_id", "-score", "-similar_id"
+        ).values_list("recipe_id", "similar_id", "score"):
+            stored.setdefault(recipe_id, []).append(
+                (similar_id, round(score, 9))
+            )
+        return stored
+
+    def test_full_and_incremental(self):
+        call_command("similar", top=self.TOP, stdout=StringIO())
+        self.assertEqual(self.stored(), self.expected())
+        Recipe.objects.filter(
+            pk__in=SimilarRecipe.objects.values("similar_id")[:1]
+        ).delete()
+        call_command(
+            "similar", incremental=True, top=self.TOP, stdout=StringIO()
+        )
+        self.assertEqual(self.stored(), self.expected())
+
+
+class RecipeSearchTest(RecipeAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        # Документы пересчитываются при фиксации транзакции,
+        # а тест выполняется внутри неё
+        fulltext.update_documents(
+            list(Recipe.objects.values_list("pk", flat=True))
+        )
+
+    def search(self, query: str) -> int:
+        response = self.client.get(
+            "/api/recipes/", {"search": query, "limit": 100}
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.data["count"]
+
+    def test_prefix_search(self):
+        self.assertEqual(self.search("Рецеп"), self.RECIPES)
+        self.assertEqual(self.search("рецепт описан"), self.RECIPES)
+        self.assertEqual(self.search("Рецепт 7"), 1)
+        self.assertEqual(self.search("торт"), 0)
+        self.assertEqual(self.search("!&:*"), self.RECIPES)
+
+
+class ShoppingListPDFTest(RecipeAPITestCase):
+    URL = "/api/recipes/download_shopping_cart/?format=pdf"
+
+    def test_pdf_contains_text(self):
+        response = self.client.get(self.URL)
+        self.assertEqual(response.status_code, 200)
+        content = b"".join(response.streaming_content)
+        self.assertTrue(content.startswith(b"%PDF"))
+        self.assertIn(b"/FontFile2", content)
+        self.assertNotIn(b"/Subtype /Image", content)
+
+    @override_settings(PDF_FONT_PATH="/nonexistent/font.ttf")
+    def test_missing_font(self):
+        with patch.object(writers, "PDF_FONT_NAME", "MissingFont"):
+            response = self.client.get(self.URL)
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("PDF_FONT_PATH", response.data["format"])
+
+
+class IngredientListCacheTest(RecipeAPITestCase):
+
+    def test_only_full_list_is_cached(self):
+        with patch.object(mixins.cache, "set") as cache_set:
+            for name in ("Ин", "Ингр", "Ингредиент 3"):
+                response = self.client.get(f"/api/ingredients/?name={name}")
+                self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                [item["name"] for item in response.json()],
+                ["Ингредиент 3"],
+            )
+            cache_set.assert_not_called()
+            response = self.client.get("/api/ingredients/")
+            self.assertEqual(len(response.json()), 5)
+            cache_set.assert_called_once()
+
+
+class IngredientIndexCommitTest(TransactionTestCase):
+
+    def search(self, query: str) -> list[str]:
+        return [row["name"] for row in ingredient_index.search(query)]
+
+    def test_ingredient_searchable_after_commit(self):
+        self.assertEqual(self.search("шафран"), [])
+        with transaction.atomic():
+            Ingredient.objects.create(name="Шафран", measurement_unit="г")
+            self.assertEqual(self.search("шафран"), [])
+        self.assertEqual(self.search("шафран"), ["Шафран"])
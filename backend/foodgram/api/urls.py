@@ -1,7 +1,9 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
-from api.views import UserViewSet, RecipeViewSet, IngredientViewSet, TagViewSet
+from api.views import (
+    UserViewSet, RecipeViewSet, IngredientViewSet, TagViewSet, MetricsView
+)
 
 app_name = "api"
 
@@ -12,6 +14,7 @@ router.register("users", UserViewSet, "users")
 router.register("recipes", RecipeViewSet, "recipes")
 
 urlpatterns = (
+    path("metrics", MetricsView.as_view(), name="metrics"),
     path("", include(router.urls)),
     path("auth/", include("djoser.urls.authtoken")),
 )
@@ -1,6 +1,12 @@
+from api.filters import RecipeOrderingFilter
 from api.permissions import AuthorStaffOrReadOnly, AdminOrReadOnly
-from api.mixins import CreateDelViewMixin
-from api.paginations import PageLimitPagination
+from api.mixins import (
+    ConditionalGetMixin, CreateDelViewMixin, VersionedCacheMixin
+)
+from api.negotiation import IgnoreFormatNegotiation
+from api.paginations import (
+    FeedPagination, ListPagination, PageLimitPagination, UserPagination
+)
 from api.serializers import (
     TagSerializer,
     IngredientSerializer,
@@ -8,26 +14,58 @@ from api.serializers import (
     RecipeSerializer,
     CropRecipeSerializer,
 )
-from recipes.models import Tag, Ingredient, Recipe, Favorit, Cart
+from recipes.models import (
+    Tag,
+    Ingredient,
+    Recipe,
+    Favorit,
+    Cart,
+    AmountIngredient,
+    ShoppingListItem,
+    SimilarRecipe,
+)
 from users.models import Follow
 from users.models import CustomUser
-from core.enums import Tuples, UrlRequests
+from core import fulltext, metrics, popular
+from core.enums import DataVersions, Limits, Tuples, UrlRequests
+from core.search import ingredient_index
+from core.services import (
+    amounts_delta,
+    get_recipes_state_stamp,
+    limited_recipes_prefetch,
+    recipes_amounts,
+    shopping_list_apply,
+)
+from core.writers import SHOPPING_LIST_WRITERS, pdf_font_error
 
 from djoser.views import UserViewSet as DjoserUserViewSet
+from functools import partial
+from typing import Sequence
+
 from django.shortcuts import get_object_or_404
 from django.core.handlers.wsgi import WSGIRequest
-from django.db.models import F, Q, Sum
-from django.http.response import HttpResponse
+from django.db.models import (
+    Exists,
+    OuterRef,
+    Prefetch,
+    QuerySet,
+    prefetch_related_objects,
+)
+from django.http.response import HttpResponse, StreamingHttpResponse
 from rest_framework.response import Response
-from rest_framework import filters
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
-from rest_framework.permissions import DjangoModelPermissions, IsAuthenticated
+from rest_framework.permissions import (
+    DjangoModelPermissions, IsAdminUser, IsAuthenticated
+)
 from rest_framework.status import (
     HTTP_400_BAD_REQUEST,
     HTTP_401_UNAUTHORIZED,
     HTTP_201_CREATED,
     HTTP_204_NO_CONTENT,
+    HTTP_503_SERVICE_UNAVAILABLE,
 )
 
 
@@ -40,7 +78,7 @@ class UserViewSet(DjoserUserViewSet, CreateDelViewMixin):
     - Вывод списка подписок (метод subscriptions).
     """
     add_serializer = UserSubscribeSerializer
-    pagination_class = PageLimitPagination
+    pagination_class = UserPagination
     permission_classes = [DjangoModelPermissions]
 
     @action(
@@ -71,76 +109,258 @@ class UserViewSet(DjoserUserViewSet, CreateDelViewMixin):
         if self.request.user.is_anonymous:
             return Response(status=HTTP_401_UNAUTHORIZED)
 
-        page = self.paginate_queryset(
-            CustomUser.objects.filter(subscribers__user=self.request.user)
+        recipes_limit = self.get_recipes_limit()
+        queryset = CustomUser.objects.filter(
+            subscribers__user=self.request.user
         )
+        page = self.paginate_queryset(queryset)
+        authors = list(queryset) if page is None else page
+        if authors:
+            prefetch_related_objects(
+                authors,
+                limited_recipes_prefetch(
+                    [author.id for author in authors], recipes_limit
+                ),
+            )
         serializer = UserSubscribeSerializer(
-            page,
+            authors,
             many=True,
-            context={'recipes_limit': request.query_params.get('recipes_limit', 3)}
+            context={'recipes_limit': recipes_limit}
         )
+        if page is None:
+            return Response(serializer.data)
         return self.get_paginated_response(serializer.data)
 
+    def get_recipes_limit(self) -> int:
+        """Проверяет параметр recipes_limit.
+        Допустимо целое число от 0 до Limits.MAX_RECIPES_LIMIT.
+        """
+        recipes_limit = self.request.query_params.get(
+            UrlRequests.RECIPES_LIMIT.value,
+            Limits.DEFAULT_RECIPES_LIMIT.value
+        )
+        try:
+            recipes_limit = int(recipes_limit)
+        except (TypeError, ValueError):
+            raise ValidationError(
+                {UrlRequests.RECIPES_LIMIT.value: 'Введите целое число.'}
+            )
+        if not 0 <= recipes_limit <= Limits.MAX_RECIPES_LIMIT.value:
+            raise ValidationError({
+                UrlRequests.RECIPES_LIMIT.value:
+                    f'Допустимо значение от 0 до {Limits.MAX_RECIPES_LIMIT.value}.'
+            })
+        return recipes_limit
+
 
-class TagViewSet(ReadOnlyModelViewSet): 
+class TagViewSet(VersionedCacheMixin, ReadOnlyModelViewSet): 
     """Для работы с моделью Tag. 
     Изменения доступны только администратору. 
+    Список кэшируется до изменения тэгов.
     """ 
     queryset = Tag.objects.all() 
     serializer_class = TagSerializer 
     permission_classes = [AdminOrReadOnly] 
+    data_version = DataVersions.TAGS
  
  
-class IngredientViewSet(ReadOnlyModelViewSet): 
+class IngredientViewSet(VersionedCacheMixin, ReadOnlyModelViewSet): 
     """Для работы с моделью Ingredient. 
     Изменения доступны только администратору. 
+    Полный список кэшируется до изменения ингредиентов,
+    поиск по name идёт по индексу в памяти без кэша.
     """ 
     queryset = Ingredient.objects.all() 
     serializer_class = IngredientSerializer 
     permission_classes = [AdminOrReadOnly] 
+    data_version = DataVersions.INGREDIENTS
+
+    def get_list_data(self, request: WSGIRequest, *args, **kwargs):
+        """Список ингредиентов.
+        С параметром name поиск выполняется по индексу в памяти:
+        сначала названия, начинающиеся с name, затем содержащие его.
+        """
+        name = request.query_params.get(UrlRequests.NAME.value)
+        if name is None:
+            return super().get_list_data(request, *args, **kwargs)
+        return ingredient_index.search(name)
 
 
-class RecipeViewSet(ModelViewSet, CreateDelViewMixin):
+class RecipeViewSet(ModelViewSet, CreateDelViewMixin, ConditionalGetMixin):
     queryset = Recipe.objects.select_related('author')
     serializer_class = RecipeSerializer
     permission_classes = [AuthorStaffOrReadOnly]
     add_serializer = CropRecipeSerializer
     pagination_class = PageLimitPagination
-    filter_backends = (filters.OrderingFilter,)
+    filter_backends = (RecipeOrderingFilter,)
     ordering_fields = ('pub_date',)
     ordering = ('-pub_date',)
 
+    def list(self, request: WSGIRequest, *args, **kwargs) -> Response:
+        """Список рецептов с поддержкой ETag и Last-Modified.
+        Валидатор строится по отметке изменения рецептов в кэше,
+        без запроса к БД. Порядок ordering=popular меняется
+        при расчёте популярности, время расчёта учитывается.
+        """
+        modified = get_recipes_state_stamp()
+        if request.query_params.get(
+            RecipeOrderingFilter.ordering_param, ''
+        ).strip() in RecipeOrderingFilter.named_orderings:
+            modified = max(modified, popular.computed_at())
+        return self.conditional_response(
+            request, modified, partial(self.list_recipes, request)
+        )
+
+    def list_recipes(self, request: WSGIRequest) -> Response:
+        """Список рецептов с флагами пользователя.
+        Флаги проставляются и странице, и списку без постраничного
+        вывода, поэтому сериализатор не обращается к БД для каждой
+        строки.
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        recipes = list(queryset)
+        self.set_user_flags(recipes)
+        return Response(self.get_serializer(recipes, many=True).data)
+
+    def retrieve(self, request: WSGIRequest, *args, **kwargs) -> Response:
+        """Рецепт с поддержкой ETag и Last-Modified."""
+        pk = str(kwargs.get('pk'))
+        last_modified = None
+        if pk.isdigit():
+            last_modified = Recipe.objects.filter(pk=pk).values_list(
+                'updated_at', flat=True
+            ).first()
+        if last_modified is None:
+            return super().retrieve(request, *args, **kwargs)
+        return self.conditional_response(
+            request,
+            last_modified.timestamp(),
+            partial(super().retrieve, request, *args, **kwargs),
+        )
+
+    def filter_queryset(self, queryset):
+        """Полнотекстовый поиск по параметру search.
+        Без явного параметра ordering результаты сортируются
+        по релевантности.
+        """
+        queryset = super().filter_queryset(queryset)
+        query = self.request.query_params.get(UrlRequests.SEARCH.value, '')
+        if not fulltext.query_words(query):
+            return queryset
+        queryset = fulltext.search(queryset, query)
+        if RecipeOrderingFilter.ordering_param in self.request.query_params:
+            return queryset
+        return queryset.order_by('-search_rank', '-pub_date', '-id')
+
+    def m2m_changed(
+        self, model, recipe_ids: Sequence[int], added: bool
+    ) -> None:
+        """Обновляет список покупок при изменении корзины."""
+        if model is not Cart:
+            return
+        amounts = recipes_amounts(recipe_ids)
+        if not added:
+            amounts = amounts_delta(amounts, {})
+        shopping_list_apply([self.request.user.id], amounts)
+
+    def annotate_user_flags(self, queryset):
+        """Добавляет флаги избранного и корзины подзапросами.
+        Используется для выборки одного рецепта.
+        """
+        user = self.request.user
+        if user.is_anonymous:
+            return queryset
+        return queryset.annotate(
+            is_favorited=Exists(Favorit.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            )),
+            is_in_shopping_cart=Exists(Cart.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            )),
+        )
+
+    def set_user_flags(self, recipes: Sequence[Recipe]) -> None:
+        """Проставляет флаги избранного и корзины рецептам страницы.
+        Флаги читаются двумя запросами по id рецептов страницы,
+        а не подзапросами для каждой строки всей выборки.
+        """
+        user = self.request.user
+        if user.is_anonymous or not recipes:
+            return
+        recipe_ids = [recipe.id for recipe in recipes]
+        favorites = set(Favorit.objects.filter(
+            user=user, recipe_id__in=recipe_ids
+        ).values_list('recipe_id', flat=True))
+        carts = set(Cart.objects.filter(
+            user=user, recipe_id__in=recipe_ids
+        ).values_list('recipe_id', flat=True))
+        for recipe in recipes:
+            recipe.is_favorited = recipe.id in favorites
+            recipe.is_in_shopping_cart = recipe.id in carts
+
+    def paginate_queryset(self, queryset):
+        """Страница рецептов с флагами пользователя."""
+        page = super().paginate_queryset(queryset)
+        if page is not None and isinstance(queryset, QuerySet):
+            self.set_user_flags(page)
+        return page
+
+    def recipes_queryset(self):
+        """Рецепты со связанными объектами."""
+        return Recipe.objects.select_related('author').prefetch_related(
+            'tags',
+            Prefetch(
+                'ingredient',
+                queryset=AmountIngredient.objects.select_related(
+                    'ingredients'
+                ).order_by('ingredients__name'),
+            ),
+        ).order_by('-pub_date',)
+
     def get_queryset(self):
         """Получает queryset в соответствии с запросом.
+        Фильтры по тэгам, избранному и корзине - подзапросы IN
+        без аннотаций: COUNT(*) страницы остаётся простым запросом,
+        а флаги пользователя вычисляются только для рецептов
+        страницы (set_user_flags).
         """
-        queryset = Recipe.objects.select_related('author').order_by('-pub_date',)
+        queryset = self.recipes_queryset()
+        if self.detail:
+            return self.annotate_user_flags(queryset)
 
         tags = self.request.query_params.getlist(UrlRequests.TAGS.value)
         if tags:
-            queryset = queryset.filter(tags__slug__in=tags).distinct()
+            queryset = queryset.filter(
+                id__in=Recipe.tags.through.objects.filter(
+                    tag__slug__in=tags
+                ).values('recipe_id')
+            )
 
         author = self.request.query_params.get(UrlRequests.AUTHOR.value)
         if author:
             queryset = queryset.filter(author=author)
 
         if self.request.user.is_anonymous:
-            return queryset.order_by('-pub_date',)
+            return queryset
 
-        is_in_cart = self.request.query_params.get(UrlRequests.SHOP_CART)
-        if is_in_cart in Tuples.SYMBOL_TRUE_SEARCH.value:
-            queryset = queryset.filter(
-                in_shopping_cart__user=self.request.user
-            )
-        elif is_in_cart in Tuples.SYMBOL_FALSE_SEARCH.value:
-            queryset = queryset.exclude(
-                in_shopping_cart__user=self.request.user
-            )
-        is_favorit = self.request.query_params.get(UrlRequests.FAVORIT)
-        if is_favorit in Tuples.SYMBOL_TRUE_SEARCH.value:
-            queryset = queryset.filter(in_favorites__user=self.request.user)
-        if is_favorit in Tuples.SYMBOL_FALSE_SEARCH.value:
-            queryset = queryset.exclude(in_favorites__user=self.request.user)
-        return queryset.order_by('-pub_date',)
+        user_filters = (
+            (UrlRequests.SHOP_CART.value, Cart),
+            (UrlRequests.FAVORIT.value, Favorit),
+        )
+        for param, model in user_filters:
+            value = self.request.query_params.get(param)
+            marked = model.objects.filter(
+                user=self.request.user
+            ).values('recipe_id')
+            if value in Tuples.SYMBOL_TRUE_SEARCH.value:
+                queryset = queryset.filter(id__in=marked)
+            elif value in Tuples.SYMBOL_FALSE_SEARCH.value:
+                queryset = queryset.exclude(id__in=marked)
+        return queryset
 
     @action(
         methods=["get", "post", "delete"],
@@ -151,7 +371,17 @@ class RecipeViewSet(ModelViewSet, CreateDelViewMixin):
         """Вывод списка 'избранное'.
         Удаление и добавление в избранное.
         """
-        return self.create_del_obj(pk, Favorit, Q(recipe__id=pk))
+        return self.create_del_obj(pk, Favorit)
+
+    @action(
+        methods=["post", "delete"],
+        detail=False,
+        url_path="favorite",
+        permission_classes=[IsAuthenticated]
+    )
+    def favorite_list(self, request: WSGIRequest) -> Response:
+        """Добавление и удаление в избранное списка рецептов."""
+        return self.create_del_list(Favorit)
 
     @action(
         methods=["get", "post", "delete"],
@@ -162,33 +392,125 @@ class RecipeViewSet(ModelViewSet, CreateDelViewMixin):
         """Вывод списка из корзины.
         Удаление и добавление из корзины.
         """
-        return self.create_del_obj(pk, Cart, Q(recipe__id=pk))
+        return self.create_del_obj(pk, Cart)
+
+    @action(
+        methods=["post", "delete"],
+        detail=False,
+        url_path="shopping_cart",
+        permission_classes=[IsAuthenticated]
+    )
+    def shopping_cart_list(self, request: WSGIRequest) -> Response:
+        """Добавление и удаление в корзину списка рецептов,
+        например меню на неделю.
+        """
+        return self.create_del_list(Cart)
+
+    @action(methods=("get",), detail=True)
+    def similar(self, request: WSGIRequest, pk: int | str) -> Response:
+        """Похожие рецепты по ингредиентам.
+        Списки рассчитываются заранее командой similar
+        и читаются одним запросом по индексу.
+        """
+        rows = SimilarRecipe.objects.filter(recipe_id=pk).select_related(
+            'similar'
+        ).order_by('-score', '-similar_id')[:Limits.SIMILAR_TOP_K.value]
+        recipes = [row.similar for row in rows]
+        if not recipes:
+            get_object_or_404(Recipe, id=pk)
+        serializer = CropRecipeSerializer(
+            recipes, many=True, context=self.get_serializer_context()
+        )
+        return Response(serializer.data)
+
+    @action(
+        methods=("get",), detail=False, pagination_class=ListPagination
+    )
+    def popular(self, request: WSGIRequest) -> Response:
+        """Популярные рецепты, фильтр по тэгам параметром tags.
+        Списки id берутся из памяти процесса (core.popular.leaderboard),
+        из БД читаются только рецепты страницы.
+        """
+        recipe_ids = popular.leaderboard.recipe_ids(
+            request.query_params.getlist(UrlRequests.TAGS.value)
+        )
+        page = self.paginate_queryset(recipe_ids)
+        recipes = self.recipes_queryset().in_bulk(page)
+        recipes = [recipes[pk] for pk in page if pk in recipes]
+        self.set_user_flags(recipes)
+        serializer = self.get_serializer(recipes, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(
+        methods=("get",),
+        detail=False,
+        permission_classes=[IsAuthenticated],
+        pagination_class=FeedPagination,
+    )
+    def feed(self, request: WSGIRequest) -> Response:
+        """Новые рецепты авторов, на которых подписан пользователь.
+        Выводится по курсору (параметры cursor и limit),
+        фильтры списка рецептов к ленте не применяются.
+        """
+        page = self.paginate_queryset(self.recipes_queryset())
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
-    @action(methods=("get",), detail=False)
+    @action(
+        methods=("get",),
+        detail=False,
+        permission_classes=[IsAuthenticated],
+        content_negotiation_class=IgnoreFormatNegotiation,
+    )
     def download_shopping_cart(self, request: WSGIRequest) -> Response:
-        """Загрузка списка ингридиентов."""
+        """Загрузка списка ингридиентов.
+        Формат файла задаётся параметром format: txt, csv или pdf.
+        Строки читаются из ShoppingListItem через курсор БД
+        и пишутся в ответ по мере чтения.
+        Без шрифта PDF_FONT_PATH формат pdf отвечает 503.
+        """
         user = self.request.user
+        file_format = request.query_params.get(UrlRequests.FORMAT.value, 'txt')
+        if file_format not in SHOPPING_LIST_WRITERS:
+            return Response(
+                {UrlRequests.FORMAT.value: 'Допустимые форматы: '
+                 f'{", ".join(SHOPPING_LIST_WRITERS)}.'},
+                status=HTTP_400_BAD_REQUEST
+            )
         if not user.carts.exists():
             return Response(status=HTTP_400_BAD_REQUEST)
-
-        filename = f"{user.username}_shopping_list.txt"
-        shopping_list = [f"Ваш список покупок:\n\n{user.first_name}\n"]
-        ingredients = Ingredient.objects.filter(
-            recipe__recipe__in_shopping_cart__user=user
-        ).values(
-            'name',
-            measurement=F('measurement_unit')
-        ).annotate(amount=Sum('recipe__amount'))
-
-        for ing in ingredients:
-            shopping_list.append(
-                f'{ing["name"]}: {ing["amount"]} {ing["measurement"]}'
+        font_error = pdf_font_error() if file_format == 'pdf' else None
+        if font_error:
+            return Response(
+                {UrlRequests.FORMAT.value: font_error},
+                status=HTTP_503_SERVICE_UNAVAILABLE
             )
-        shopping_list = '\n'.join(shopping_list)
-        response = HttpResponse(
-            shopping_list,
-            content_type="text.txt; charset=utf-8"
+
+        writer, content_type = SHOPPING_LIST_WRITERS[file_format]
+        filename = f"{user.username}_shopping_list.{file_format}"
+        title = ["Ваш список покупок:", "", user.first_name, ""]
+        ingredients = ShoppingListItem.objects.filter(user=user).values_list(
+            'ingredient__name', 'total_amount', 'ingredient__measurement_unit'
+        ).order_by('ingredient__name').iterator(
+            chunk_size=Limits.STREAM_CHUNK_SIZE.value
         )
 
+        response = StreamingHttpResponse(
+            writer(title, ingredients),
+            content_type=content_type
+        )
         response["Content-Disposition"] = f"attachment; filename={filename}"
         return response
+
+
+class MetricsView(APIView):
+    """Метрики запросов всех воркеров в формате Prometheus.
+    Доступно только администраторам.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request: WSGIRequest) -> HttpResponse:
+        return HttpResponse(
+            metrics.render(),
+            content_type="text/plain; version=0.0.4; charset=utf-8",
+        )
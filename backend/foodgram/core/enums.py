@@ -23,6 +23,45 @@ class Limits(IntEnum):
     MAX_LEN_MEASUREMENT = 256
     # Максимальная длина текстовых полей в моделях
     MAX_LEN_TEXT = 5000
+    # Максимальное количество ингредиента в рецепте
+    MAX_INGREDIENT_AMOUNT = 1000
+    # Количество рецептов автора в списке подписок по умолчанию
+    DEFAULT_RECIPES_LIMIT = 3
+    # Максимальное количество рецептов автора в списке подписок
+    MAX_RECIPES_LIMIT = 100
+    # Время кэширования справочников на клиенте в секундах
+    REFERENCE_CACHE_MAX_AGE = 60
+    # Количество строк, читаемых из курсора БД за раз при выгрузке
+    STREAM_CHUNK_SIZE = 500
+    # Размер страницы по умолчанию, если параметр limit не передан
+    DEFAULT_PAGE_SIZE = 6
+    # Максимальный размер страницы (параметр limit)
+    MAX_PAGE_SIZE = 100
+    # Копий изображений в очереди пула потоков на один поток,
+    # при заполненной очереди копии создаются в потоке запроса
+    RENDITION_QUEUE_PER_WORKER = 4
+    # Количество строк CSV, загружаемых в БД за раз
+    LOADER_CHUNK_SIZE = 5000
+    # Максимальное количество рецептов в одном запросе к избранному
+    # или корзине списком
+    MAX_BATCH_RECIPES = 100
+    # Подписчиков автора, до которого рецепт рассылается в ленты сразу
+    FEED_SYNC_FOLLOWERS = 200
+    # Подписчиков автора, после которого рецепты не рассылаются,
+    # а читаются при выводе ленты
+    FEED_PUSH_FOLLOWERS = 10000
+    # Количество подписчиков в одной части фоновой рассылки
+    FEED_FANOUT_CHUNK = 1000
+    # Количество похожих рецептов, рассчитываемых для рецепта
+    SIMILAR_TOP_K = 10
+    # Время в часах, за которое вклад отметки в популярность
+    # рецепта уменьшается вдвое
+    POPULAR_HALF_LIFE_HOURS = 72
+    # Отметки старше этого количества периодов полураспада
+    # (вклад меньше 0.1%) не учитываются в популярности
+    POPULAR_HORIZON_HALF_LIVES = 10
+    # Количество рецептов в списке популярных для тэга
+    POPULAR_TOP_N = 100
 
 
 class UrlRequests(str, Enum):
@@ -34,3 +73,20 @@ class UrlRequests(str, Enum):
     AUTHOR = "author"
     # Параметр для поиска объектов по тэгам
     TAGS = "tags"
+    # Параметр для поиска ингредиентов по названию
+    NAME = "name"
+    # Параметр для выбора формата файла списка покупок
+    FORMAT = "format"
+    # Параметр для ограничения рецептов в списке подписок
+    RECIPES_LIMIT = "recipes_limit"
+    # Параметр полнотекстового поиска рецептов
+    SEARCH = "search"
+    # Параметр курсора для постраничного вывода по ключу
+    CURSOR = "cursor"
+
+
+class DataVersions(str, Enum):
+    # Версия справочника ингредиентов
+    INGREDIENTS = "ingredients"
+    # Версия справочника тэгов
+    TAGS = "tags"
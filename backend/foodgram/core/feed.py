@@ -0,0 +1,208 @@
+"""Лента рецептов авторов, на которых подписан пользователь.
+   Лента хранится в FeedEntry и заполняется при записи (fan-out):
+        - у автора не больше FEED_SYNC_FOLLOWERS подписчиков -
+          строки добавляются сразу после публикации рецепта;
+        - не больше FEED_PUSH_FOLLOWERS - частями по
+          FEED_FANOUT_CHUNK подписчиков в пуле потоков;
+        - больше - рецепты автора в ленты не пишутся и читаются
+          при выводе ленты (см. api.paginations.FeedPagination),
+          поэтому публикация не создаёт миллионы строк.
+   Когда после отписки у автора остаётся FEED_PUSH_FOLLOWERS
+   подписчиков, его рецепты перестают читаться при выводе
+   и дописываются в ленты оставшихся подписчиков.
+   Методы модуля:
+        pull_authors:
+            Авторы пользователя, рецепты которых читаются при выводе.
+        publish:
+            Рассылает новый рецепт подписчикам автора.
+        fan_out_recipes:
+            Рассылает рецепты одним запросом, используется при
+            загрузке рецептов в обход сигналов.
+        follow, unfollow:
+            Добавляют рецепты автора в ленту нового подписчика
+            и удаляют их при отписке. Отписка, после которой автор
+            перестаёт читаться при выводе, запускает fan_out всех
+            его рецептов.
+        rebuild:
+            Пересобирает ленты пользователей из диапазона id,
+            используется командой feed.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+
+from core.enums import Limits
+from recipes.models import FeedEntry, Recipe
+from users.models import CustomUser, Follow
+
+logger = logging.getLogger(__name__)
+
+_executor: ThreadPoolExecutor | None = None
+_executor_lock = Lock()
+
+
+def tables() -> dict[str, str]:
+    return {
+        "feed": FeedEntry._meta.db_table,
+        "follow": Follow._meta.db_table,
+        "recipe": Recipe._meta.db_table,
+        "user": CustomUser._meta.db_table,
+    }
+
+
+def _insert(condition: str, params: tuple) -> None:
+    """Добавляет в ленты пары (подписка f, рецепт автора r)
+    по условию condition. Уже записанные строки пропускаются.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO {feed} (user_id, recipe_id, author_id, pub_date) "
+            "SELECT f.user_id, r.id, r.author_id, r.pub_date "
+            "FROM {follow} f JOIN {recipe} r ON r.author_id = f.author_id "
+            "WHERE {condition} ON CONFLICT DO NOTHING".format(
+                condition=condition, **tables()
+            ),
+            params,
+        )
+
+
+def pull_authors(user_id: int) -> list[int]:
+    return list(Follow.objects.filter(
+        user_id=user_id,
+        author__followers_count__gt=Limits.FEED_PUSH_FOLLOWERS.value,
+    ).values_list("author_id", flat=True))
+
+
+def fan_out(recipe_id: int | None, author_id: int) -> None:
+    """Записывает рецепт в ленты подписчиков частями.
+    При recipe_id None записываются все рецепты автора.
+    Граница части - id подписчика, поэтому каждая часть
+    выбирается по индексу подписок автора.
+    """
+    if recipe_id is None:
+        condition, params = "f.author_id = %s", (author_id,)
+    else:
+        condition, params = (
+            "r.id = %s AND f.author_id = %s", (recipe_id, author_id)
+        )
+    last_user_id = 0
+    while True:
+        followers = list(Follow.objects.filter(
+            author_id=author_id, user_id__gt=last_user_id
+        ).order_by("user_id").values_list(
+            "user_id", flat=True
+        )[:Limits.FEED_FANOUT_CHUNK.value])
+        if not followers:
+            return
+        _insert(
+            f"{condition} AND f.user_id BETWEEN %s AND %s",
+            (*params, followers[0], followers[-1]),
+        )
+        if len(followers) < Limits.FEED_FANOUT_CHUNK.value:
+            return
+        last_user_id = followers[-1]
+
+
+def _fan_out_logged(recipe_id: int | None, author_id: int) -> None:
+    try:
+        fan_out(recipe_id, author_id)
+    except Exception:
+        logger.exception(
+            "Не удалось разослать рецепт %s автора %s", recipe_id, author_id
+        )
+    finally:
+        close_old_connections()
+
+
+def _submit_fan_out(recipe_id: int | None, author_id: int) -> None:
+    """Запускает fan_out в пуле потоков.
+    При FEED_FANOUT_WORKERS = 0 рассылка выполняется сразу.
+    """
+    global _executor
+    workers = settings.FEED_FANOUT_WORKERS
+    if not workers:
+        fan_out(recipe_id, author_id)
+        return
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix="feed"
+            )
+    _executor.submit(_fan_out_logged, recipe_id, author_id)
+
+
+def publish(recipe_id: int, author_id: int) -> None:
+    """Рассылает рецепт подписчикам в зависимости от их числа.
+    Вызывается после фиксации транзакции с новым рецептом.
+    Небольшая рассылка - один запрос INSERT ... SELECT по подпискам.
+    """
+    followers = CustomUser.objects.filter(pk=author_id).values_list(
+        "followers_count", flat=True
+    ).first() or 0
+    if not followers or followers > Limits.FEED_PUSH_FOLLOWERS.value:
+        return
+    if followers <= Limits.FEED_SYNC_FOLLOWERS.value:
+        _insert("r.id = %s", (recipe_id,))
+        return
+    _submit_fan_out(recipe_id, author_id)
+
+
+def fan_out_recipes(recipe_ids: list[int]) -> None:
+    if not recipe_ids:
+        return
+    placeholders = ", ".join(["%s"] * len(recipe_ids))
+    _insert(
+        f"r.id IN ({placeholders}) AND f.author_id IN "
+        "(SELECT id FROM {user} WHERE followers_count <= %s)".format(
+            **tables()
+        ),
+        (*recipe_ids, Limits.FEED_PUSH_FOLLOWERS.value),
+    )
+
+
+def follow(user_id: int, author_id: int) -> None:
+    """Добавляет в ленту все рецепты автора одним запросом.
+    Рецепты авторов, читаемых при выводе, не добавляются.
+    """
+    _insert(
+        "f.user_id = %s AND f.author_id = %s AND f.author_id IN "
+        "(SELECT id FROM {user} WHERE followers_count <= %s)".format(
+            **tables()
+        ),
+        (user_id, author_id, Limits.FEED_PUSH_FOLLOWERS.value),
+    )
+
+
+def unfollow(user_id: int, author_id: int) -> None:
+    """Удаляет рецепты автора из ленты пользователя.
+    Вызывается после уменьшения счётчика подписчиков автора.
+    Если подписчиков стало ровно FEED_PUSH_FOLLOWERS, автор
+    перестал читаться при выводе ленты: его рецепты
+    дописываются в ленты подписчиков после фиксации транзакции.
+    """
+    FeedEntry.objects.filter(user_id=user_id, author_id=author_id).delete()
+    followers = CustomUser.objects.filter(pk=author_id).values_list(
+        "followers_count", flat=True
+    ).first()
+    if followers == Limits.FEED_PUSH_FOLLOWERS.value:
+        transaction.on_commit(lambda: _submit_fan_out(None, author_id))
+
+
+def rebuild(first_user_id: int, last_user_id: int) -> None:
+    """Пересобирает ленты пользователей first_user_id..last_user_id.
+    Нужна после загрузки данных в обход сигналов.
+    """
+    with transaction.atomic():
+        FeedEntry.objects.filter(
+            user_id__gte=first_user_id, user_id__lte=last_user_id
+        ).delete()
+        _insert(
+            "f.user_id BETWEEN %s AND %s AND f.author_id IN "
+            "(SELECT id FROM {user} WHERE followers_count <= %s)".format(
+                **tables()
+            ),
+            (first_user_id, last_user_id, Limits.FEED_PUSH_FOLLOWERS.value),
+        )
@@ -0,0 +1,226 @@
+"""Полнотекстовый поиск рецептов.
+   Документ рецепта - название (вес A), названия ингредиентов (вес B)
+   и описание (вес C).
+   На PostgreSQL документ хранится в Recipe.search_vector
+   (tsvector, конфигурация russian) с GIN-индексом, объявленным
+   в Recipe.Meta.indexes, на SQLite - в виртуальной таблице FTS5
+   с тем же rowid, что и рецепт.
+   Методы модуля:
+        setup:
+            Создаёт таблицу FTS5 на SQLite, вызывается
+            после миграций.
+        update_documents:
+            Пересчитывает документы рецептов по их id.
+        update_documents_on_commit:
+            Откладывает пересчёт документа рецепта до фиксации
+            транзакции, один пересчёт на транзакцию.
+        update_documents_for_ingredient:
+            Пересчитывает документы рецептов с ингредиентом.
+        delete_documents:
+            Удаляет документы удалённых рецептов (только SQLite).
+        search:
+            Фильтрует queryset рецептов по запросу и добавляет
+            аннотацию search_rank. Слова запроса ищутся как
+            префиксы и на PostgreSQL, и на SQLite.
+"""
+import re
+from threading import local
+
+from django.db import connection, transaction
+from django.db.models import F, FloatField, QuerySet, Value
+
+# Конфигурация полнотекстового поиска PostgreSQL
+SEARCH_CONFIG = "russian"
+FTS_TABLE = "recipes_recipe_fts"
+# Слово запроса поиска
+WORD_RE = re.compile(r"\w+")
+# Функция ранга FTS5 с весами колонок (name, ingredients, text)
+FTS_RANK = "bm25(10.0, 5.0, 1.0)"
+
+
+def tables() -> dict[str, str]:
+    from recipes.models import AmountIngredient, Ingredient, Recipe
+
+    return {
+        "recipe": Recipe._meta.db_table,
+        "amount": AmountIngredient._meta.db_table,
+        "ingredient": Ingredient._meta.db_table,
+        "fts": FTS_TABLE,
+        "config": SEARCH_CONFIG,
+    }
+
+
+# Названия ингредиентов рецепта r.id одной строкой
+INGREDIENT_NAMES = {
+    "postgresql": (
+        "SELECT string_agg(i.name, ' ') FROM {amount} a "
+        "JOIN {ingredient} i ON i.id = a.ingredients_id "
+        "WHERE a.recipe_id = r.id"
+    ),
+    "sqlite": (
+        "SELECT group_concat(i.name, ' ') FROM {amount} a "
+        "JOIN {ingredient} i ON i.id = a.ingredients_id "
+        "WHERE a.recipe_id = r.id"
+    ),
+}
+
+
+def setup(using=connection) -> None:
+    # Виртуальную таблицу нельзя объявить моделью, GIN-индекс
+    # PostgreSQL объявлен в Recipe.Meta.indexes
+    if using.vendor != "sqlite":
+        return
+    with using.cursor() as cursor:
+        cursor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING "
+            "fts5(name, ingredients, text, tokenize='unicode61')"
+            .format(**tables())
+        )
+        # Скрытая колонка rank, в отличие от вызова bm25(),
+        # доступна и во вложенных запросах с GROUP BY
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rank) VALUES "
+            f"('rank', '{FTS_RANK}')"
+        )
+
+
+def _update(condition: str, params: tuple) -> None:
+    """Пересчитывает документы рецептов r, подходящих под condition."""
+    names = tables()
+    vendor = connection.vendor
+    if vendor not in INGREDIENT_NAMES:
+        return
+    ingredients = INGREDIENT_NAMES[vendor].format(**names)
+    with connection.cursor() as cursor:
+        if vendor == "postgresql":
+            cursor.execute(
+                "UPDATE {recipe} r SET search_vector = "
+                "setweight(to_tsvector('{config}', r.name), 'A') || "
+                "setweight(to_tsvector('{config}', "
+                "coalesce(({ingredients}), '')), 'B') || "
+                "setweight(to_tsvector('{config}', r.text), 'C') "
+                "WHERE {condition}".format(
+                    ingredients=ingredients, condition=condition, **names
+                ),
+                params,
+            )
+            return
+        cursor.execute(
+            "DELETE FROM {fts} WHERE rowid IN "
+            "(SELECT r.id FROM {recipe} r WHERE {condition})".format(
+                condition=condition, **names
+            ),
+            params,
+        )
+        cursor.execute(
+            "INSERT INTO {fts} (rowid, name, ingredients, text) "
+            "SELECT r.id, r.name, coalesce(({ingredients}), ''), r.text "
+            "FROM {recipe} r WHERE {condition}".format(
+                ingredients=ingredients, condition=condition, **names
+            ),
+            params,
+        )
+
+
+def update_documents(recipe_ids: list[int]) -> None:
+    if recipe_ids:
+        placeholders = ", ".join(["%s"] * len(recipe_ids))
+        _update(f"r.id IN ({placeholders})", tuple(recipe_ids))
+
+
+_pending = local()
+
+
+def _flush_pending() -> None:
+    recipe_ids = getattr(_pending, "recipe_ids", None)
+    if recipe_ids:
+        _pending.recipe_ids = set()
+        update_documents(sorted(recipe_ids))
+
+
+def update_documents_on_commit(recipe_id: int) -> None:
+    """Пересчитывает документ рецепта после фиксации транзакции.
+    id рецептов копятся в наборе потока, пересчёт всех накопленных
+    рецептов выполняет первый сработавший обработчик on_commit,
+    остальные обработчики транзакции находят набор пустым.
+    Обработчик ставится на каждый вызов: после отката транзакции
+    её обработчики отбрасываются, и накопленные id пересчитает
+    обработчик следующей транзакции.
+    """
+    _pending.__dict__.setdefault("recipe_ids", set()).add(recipe_id)
+    transaction.on_commit(_flush_pending)
+
+
+def update_documents_for_ingredient(ingredient_id: int) -> None:
+    _update(
+        "r.id IN (SELECT recipe_id FROM {amount} "
+        "WHERE ingredients_id = %s)".format(**tables()),
+        (ingredient_id,),
+    )
+
+
+def delete_documents(recipe_ids: list[int]) -> None:
+    if connection.vendor != "sqlite" or not recipe_ids:
+        return
+    placeholders = ", ".join(["%s"] * len(recipe_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})",
+            recipe_ids,
+        )
+
+
+def query_words(query: str) -> list[str]:
+    """Слова запроса: последовательности букв и цифр.
+    Остальные символы, в том числе синтаксис FTS5 и tsquery,
+    отбрасываются, как и при разборе документа.
+    """
+    return WORD_RE.findall(query)
+
+
+def fts_query(query: str) -> str:
+    """Запрос FTS5: все слова запроса как префиксы."""
+    return " ".join(f'"{word}"*' for word in query_words(query))
+
+
+def tsquery(query: str) -> str:
+    """Запрос tsquery PostgreSQL: все слова запроса как префиксы,
+    как и fts_query на SQLite.
+    """
+    return " & ".join(f"{word}:*" for word in query_words(query))
+
+
+def search(queryset: QuerySet, query: str) -> QuerySet:
+    """Рецепты queryset, подходящие под query, с рангом search_rank.
+    Отбор идёт по индексу (GIN или FTS5), а не перебором строк.
+    """
+    if not query_words(query):
+        return queryset
+    if connection.vendor == "postgresql":
+        from django.contrib.postgres.search import SearchQuery, SearchRank
+
+        search_query = SearchQuery(
+            tsquery(query), config=SEARCH_CONFIG, search_type="raw"
+        )
+        return queryset.filter(search_vector=search_query).annotate(
+            search_rank=SearchRank(F("search_vector"), search_query)
+        )
+    if connection.vendor == "sqlite":
+        # Таблица FTS5 присоединяется к выборке, чтобы MATCH выполнялся
+        # один раз: ранг в коррелированном подзапросе повторял бы
+        # MATCH для каждой найденной строки
+        table = queryset.model._meta.db_table
+        return queryset.extra(
+            select={
+                "search_rank": f"-{FTS_TABLE}.rank",
+            },
+            tables=[FTS_TABLE],
+            where=[
+                f"{FTS_TABLE}.rowid = {table}.id",
+                f"{FTS_TABLE} MATCH %s",
+            ],
+            params=[fts_query(query)],
+        )
+    return queryset.filter(name__icontains=query.strip()).annotate(
+        search_rank=Value(0.0, output_field=FloatField())
+    )
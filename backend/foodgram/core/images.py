@@ -0,0 +1,198 @@
+"""Уменьшенные копии изображений рецептов.
+   Для каждого изображения создаются копии шириной RENDITION_WIDTHS
+   в форматах RENDITION_FORMATS. Копии создаются в пуле потоков
+   после сохранения рецепта и не задерживают ответ. Очередь пула
+   ограничена, копии прежнего изображения удаляются из хранилища.
+   Методы модуля:
+        rendition_name:
+            Имя файла копии изображения.
+        write_renditions:
+            Создаёт копии изображения в хранилище.
+        store_image:
+            Сохраняет изображение и его копии, используется
+            в пуле процессов команды importrecipes.
+        generate_renditions:
+            Создаёт копии изображения рецепта в хранилище.
+        schedule_renditions:
+            Ставит создание копий в очередь пула потоков.
+        delete_renditions:
+            Удаляет копии изображения, которое больше
+            не используется рецептами.
+        image_srcset:
+            Строки srcset по форматам для сериализаторов.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from threading import BoundedSemaphore, Lock
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+from django.utils import timezone
+from PIL import Image
+
+from core.enums import Limits
+
+logger = logging.getLogger(__name__)
+
+# Ширина копий в пикселях
+RENDITION_WIDTHS = (160, 320, 640)
+# Формат копии: (формат Pillow, расширение файла)
+RENDITION_FORMATS = {
+    "webp": ("WEBP", "webp"),
+    "jpeg": ("JPEG", "jpg"),
+}
+RENDITION_QUALITY = 80
+
+_executor: ThreadPoolExecutor | None = None
+_executor_lock = Lock()
+# Места в очереди пула: задача занимает место до своего завершения
+_executor_slots: BoundedSemaphore | None = None
+
+
+def rendition_name(image_name: str, width: int, file_format: str) -> str:
+    """Имя копии повторяет полное имя изображения в хранилище.
+    Имена в хранилище уникальны, а файлы с одной основой
+    (temp.png и temp.jpeg) различаются расширением.
+    """
+    extension = RENDITION_FORMATS[file_format][1]
+    return f"recipes/renditions/{image_name}_{width}.{extension}"
+
+
+def write_renditions(image_name: str, original: Image.Image) -> None:
+    if original.mode not in ("RGB", "RGBA"):
+        original = original.convert("RGBA")
+
+    for width in RENDITION_WIDTHS:
+        image = original.copy()
+        image.thumbnail((width, image.height))
+        for file_format, (pillow_format, _) in RENDITION_FORMATS.items():
+            name = rendition_name(image_name, width, file_format)
+            output = image
+            if pillow_format == "JPEG":
+                output = image.convert("RGB")
+            buffer = BytesIO()
+            output.save(buffer, pillow_format, quality=RENDITION_QUALITY)
+            if default_storage.exists(name):
+                default_storage.delete(name)
+            default_storage.save(name, ContentFile(buffer.getvalue()))
+
+
+def store_image(image_name: str, data: bytes) -> str | None:
+    """Проверяет и сохраняет изображение вместе с копиями.
+    Возвращает имя файла или None, если файл не изображение.
+    Не обращается к БД.
+    """
+    try:
+        original = Image.open(BytesIO(data))
+        original.load()
+    except Exception:
+        logger.exception("Не удалось прочитать %s", image_name)
+        return None
+    if not default_storage.exists(image_name):
+        default_storage.save(image_name, ContentFile(data))
+    write_renditions(image_name, original)
+    return image_name
+
+
+def generate_renditions(recipe_id: int, image_name: str) -> None:
+    """Создаёт копии изображения и отмечает их в рецепте.
+    Отметка ставится, только если изображение рецепта
+    не изменилось за время обработки.
+    """
+    from core.services import touch_recipes_state
+    from recipes.models import Recipe
+
+    with default_storage.open(image_name) as source:
+        original = Image.open(source)
+        original.load()
+    write_renditions(image_name, original)
+    if Recipe.objects.filter(pk=recipe_id, image=image_name).update(
+        image_renditions_for=image_name, updated_at=timezone.now()
+    ):
+        touch_recipes_state()
+    else:
+        # Изображение сменилось или рецепт удалён за время обработки
+        delete_renditions(image_name)
+
+
+def _generate_logged(recipe_id: int, image_name: str) -> None:
+    try:
+        generate_renditions(recipe_id, image_name)
+    except Exception:
+        logger.exception("Не удалось создать копии %s", image_name)
+
+
+def _run_in_worker(recipe_id: int, image_name: str) -> None:
+    try:
+        _generate_logged(recipe_id, image_name)
+    finally:
+        close_old_connections()
+        _executor_slots.release()
+
+
+def schedule_renditions(recipe_id: int, image_name: str) -> None:
+    """Ставит создание копий в пул из IMAGE_RENDITION_WORKERS потоков.
+    В очереди пула держится не больше
+    IMAGE_RENDITION_WORKERS * RENDITION_QUEUE_PER_WORKER задач,
+    при заполненной очереди и при IMAGE_RENDITION_WORKERS = 0
+    копии создаются сразу в вызывающем потоке.
+    """
+    global _executor, _executor_slots
+    workers = settings.IMAGE_RENDITION_WORKERS
+    if not workers:
+        _generate_logged(recipe_id, image_name)
+        return
+    with _executor_lock:
+        if _executor is None:
+            _executor_slots = BoundedSemaphore(
+                workers * Limits.RENDITION_QUEUE_PER_WORKER.value
+            )
+            _executor = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix="renditions"
+            )
+    if not _executor_slots.acquire(blocking=False):
+        _generate_logged(recipe_id, image_name)
+        return
+    _executor.submit(_run_in_worker, recipe_id, image_name)
+
+
+def delete_renditions(image_name: str) -> None:
+    """Удаляет копии изображения, если ни один рецепт
+    не использует его: импорт может назначить один файл
+    нескольким рецептам.
+    """
+    from recipes.models import Recipe
+
+    if not image_name or Recipe.objects.filter(image=image_name).exists():
+        return
+    for width in RENDITION_WIDTHS:
+        for file_format in RENDITION_FORMATS:
+            name = rendition_name(image_name, width, file_format)
+            try:
+                default_storage.delete(name)
+            except OSError:
+                logger.exception("Не удалось удалить %s", name)
+
+
+def image_srcset(recipe, request=None) -> dict[str, str]:
+    """Строки srcset копий изображения по форматам.
+    Пустой словарь, если копии ещё не готовы.
+    """
+    image_name = recipe.image.name
+    if not image_name or recipe.image_renditions_for != image_name:
+        return {}
+    srcset = {}
+    for file_format in RENDITION_FORMATS:
+        variants = []
+        for width in RENDITION_WIDTHS:
+            url = default_storage.url(
+                rendition_name(image_name, width, file_format)
+            )
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            variants.append(f"{url} {width}w")
+        srcset[file_format] = ", ".join(variants)
+    return srcset
@@ -0,0 +1,210 @@
+"""Потоковая загрузка CSV в модели.
+   Файл читается частями по chunk_size строк, в памяти держится
+   только текущая часть. Загрузка повторяемая: строки, которые уже
+   есть в БД (по уникальным ограничениям или ключу Mapping.key),
+   пропускаются.
+   Объекты модуля:
+        Mapping:
+            Описание соответствия колонок CSV полям модели.
+        CSVLoader:
+            Загрузка файла. На PostgreSQL часть копируется командой
+            COPY во временную таблицу и переносится одним INSERT,
+            на других БД используется bulk_create(ignore_conflicts).
+"""
+import csv
+import io
+from itertools import islice
+from time import monotonic
+from typing import Callable, Iterable, Iterator
+
+from django.db import connection, transaction
+from django.db.models import Model
+
+from core.enums import Limits
+from core.services import bump_data_version
+
+
+class Mapping:
+    """Соответствие колонок CSV полям модели.
+    Аргументы:
+        model:
+            Модель для загрузки.
+        fields:
+            Имена полей в порядке колонок CSV.
+        key:
+            Поля, по которым строка считается уже загруженной.
+        resolvers:
+            Функции для полей, значения которых нужно найти в БД
+            (например, автор по email). Функция получает множество
+            значений из части файла и возвращает словарь
+            {значение из CSV: значение поля}.
+        version:
+            Версия справочника, которая меняется после загрузки.
+    """
+
+    def __init__(
+        self,
+        model: type[Model],
+        fields: tuple[str, ...],
+        key: tuple[str, ...],
+        resolvers: dict[str, Callable[[set], dict]] | None = None,
+        version: str | None = None,
+    ):
+        self.model = model
+        self.fields = fields
+        self.key = key
+        self.resolvers = resolvers or {}
+        self.version = version
+
+
+class CSVLoader:
+    """Загрузка CSV-файла по описанию Mapping."""
+
+    def __init__(
+        self,
+        mapping: Mapping,
+        chunk_size: int = Limits.LOADER_CHUNK_SIZE.value,
+    ):
+        self.mapping = mapping
+        self.chunk_size = chunk_size
+        self.read = self.created = self.skipped = 0
+        self.elapsed = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.read / self.elapsed if self.elapsed else 0.0
+
+    def chunks(self, rows: Iterable[list[str]]) -> Iterator[list[list]]:
+        rows = iter(rows)
+        while chunk := list(islice(rows, self.chunk_size)):
+            yield chunk
+
+    def load(self, rows: Iterable[list[str]]) -> "CSVLoader":
+        started = monotonic()
+        postgresql = connection.vendor == "postgresql"
+        # bulk_create не возвращает число добавленных строк, поэтому
+        # вне PostgreSQL строки считаются до и после всей загрузки
+        before = 0 if postgresql else self.mapping.model.objects.count()
+        for chunk in self.chunks(rows):
+            self.read += len(chunk)
+            objects = self.build_objects(chunk)
+            with transaction.atomic():
+                if postgresql:
+                    self.created += self.copy_merge(objects)
+                else:
+                    self.bulk_insert(objects)
+            self.elapsed = monotonic() - started
+        if not postgresql:
+            self.created = self.mapping.model.objects.count() - before
+            self.elapsed = monotonic() - started
+        self.skipped = self.read - self.created
+        if self.mapping.version:
+            bump_data_version(self.mapping.version)
+        return self
+
+    def build_objects(self, chunk: list[list[str]]) -> list[Model]:
+        """Объекты модели из строк части без повторов по ключу."""
+        mapping = self.mapping
+        values = [dict(zip(mapping.fields, row)) for row in chunk]
+        for field, resolver in mapping.resolvers.items():
+            resolved = resolver({row[field] for row in values})
+            for row in values:
+                row[field] = resolved.get(row[field])
+        objects, keys = [], set()
+        for row in values:
+            if any(row[field] is None for field in mapping.resolvers):
+                continue
+            obj = mapping.model(**row)
+            key = self.object_key(obj)
+            if key not in keys:
+                keys.add(key)
+                objects.append(obj)
+        return objects
+
+    def object_key(self, obj: Model) -> tuple:
+        return tuple(
+            getattr(obj, obj._meta.get_field(field).attname)
+            for field in self.mapping.key
+        )
+
+    def existing_keys(self, objects: list[Model]) -> set[tuple]:
+        """Ключи объектов части, которые уже есть в БД.
+        Кандидаты выбираются по первому полю ключа одним запросом,
+        полное совпадение ключа проверяется в памяти.
+        """
+        model = self.mapping.model
+        attnames = [
+            model._meta.get_field(field).attname for field in self.mapping.key
+        ]
+        keys = {self.object_key(obj) for obj in objects}
+        candidates = model.objects.filter(**{
+            f"{attnames[0]}__in": {key[0] for key in keys}
+        }).values_list(*attnames)
+        return keys.intersection(map(tuple, candidates))
+
+    def bulk_insert(self, objects: list[Model]) -> None:
+        if not objects:
+            return
+        existing = self.existing_keys(objects)
+        self.mapping.model.objects.bulk_create(
+            [obj for obj in objects if self.object_key(obj) not in existing],
+            ignore_conflicts=True,
+        )
+
+    def copy_merge(self, objects: list[Model]) -> int:
+        """COPY части во временную таблицу и перенос новых строк.
+        Строки с уже существующим ключом отсекаются NOT EXISTS,
+        нарушения уникальных ограничений - ON CONFLICT DO NOTHING.
+        """
+        if not objects:
+            return 0
+        meta = self.mapping.model._meta
+        fields = [
+            field for field in meta.concrete_fields if not field.primary_key
+        ]
+        columns = ", ".join(
+            connection.ops.quote_name(field.column) for field in fields
+        )
+        table = connection.ops.quote_name(meta.db_table)
+        key_match = " AND ".join(
+            "t.{0} = s.{0}".format(
+                connection.ops.quote_name(meta.get_field(field).column)
+            )
+            for field in self.mapping.key
+        )
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for obj in objects:
+            writer.writerow([
+                "\\N" if value is None else value
+                for value in (
+                    field.get_db_prep_save(
+                        field.pre_save(obj, add=True), connection
+                    )
+                    for field in fields
+                )
+            ])
+        buffer.seek(0)
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE TEMP TABLE loader_staging "
+                f"(LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP"
+            )
+            cursor.copy_expert(
+                f"COPY loader_staging ({columns}) FROM STDIN "
+                "WITH (FORMAT csv, NULL '\\N')",
+                buffer,
+            )
+            cursor.execute(
+                f"INSERT INTO {table} ({columns}) "
+                f"SELECT {columns} FROM loader_staging s "
+                f"WHERE NOT EXISTS (SELECT 1 FROM {table} t "
+                f"WHERE {key_match}) "
+                "ON CONFLICT DO NOTHING"
+            )
+            created = cursor.rowcount
+            # ON COMMIT DROP не срабатывает внутри внешней транзакции
+            cursor.execute("DROP TABLE loader_staging")
+        return created
@@ -0,0 +1,360 @@
+"""Метрики запросов в текстовом формате Prometheus.
+   Каждый процесс (воркер gunicorn) пишет значения в свой файл
+   METRICS_DIR/<pid>.db через mmap, страница метрик суммирует файлы
+   всех процессов. Счётчики и гистограммы завершённых воркеров
+   переносятся в общий файл METRICS_DIR/merged.db, а их файлы
+   удаляются, поэтому число файлов не растёт с перезапусками
+   воркеров. Число запросов в обработке берётся только у живых
+   процессов и обнуляется при открытии файла: новый воркер
+   с тем же pid не наследует его от завершённого.
+   Открытие файла процессом и перенос файлов завершённых процессов
+   выполняются под блокировкой METRICS_DIR/.lock.
+   Объекты модуля:
+        MmapValues:
+            Значения метрик одного процесса в файле.
+        merge_dead:
+            Переносит значения завершённых процессов в merged.db.
+        view_labels:
+            Метки view и action для представления DRF.
+        observe_request, track_in_flight:
+            Запись метрик запроса, вызываются из MetricsMiddleware.
+        render:
+            Текст метрик всех процессов для /api/metrics.
+"""
+import fcntl
+import json
+import mmap
+import os
+import struct
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from threading import Lock
+
+from django.conf import settings
+
+# Границы корзин гистограмм
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+# Имя метрики: (тип, описание, границы корзин гистограммы)
+METRICS = {
+    "foodgram_http_requests_total": (
+        "counter", "Количество обработанных запросов", None
+    ),
+    "foodgram_http_request_duration_seconds": (
+        "histogram", "Время обработки запроса", LATENCY_BUCKETS
+    ),
+    "foodgram_http_request_queries": (
+        "histogram", "Количество SQL-запросов на запрос", QUERY_BUCKETS
+    ),
+    "foodgram_http_requests_in_flight": (
+        "gauge", "Запросы в обработке", None
+    ),
+}
+
+# Метки запросов, не дошедших до представления (404, редиректы)
+UNMATCHED = (("view", "unmatched"), ("action", ""))
+# Файл значений завершённых процессов
+MERGED_FILE = "merged.db"
+LOCK_FILE = ".lock"
+
+
+class MmapValues:
+    """Значения метрик процесса в файле, отображённом в память.
+    Формат файла: 8 байт - занятый размер, далее записи
+    [длина ключа (4 байта)][ключ][выравнивание до 8][значение double].
+    Запись добавляется до увеличения занятого размера, поэтому
+    читатель видит только полностью записанные ключи.
+    """
+
+    INITIAL_SIZE = 64 * 1024
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = Lock()
+        self._file = open(path, "a+b")
+        size = os.fstat(self._file.fileno()).st_size
+        if size < self.INITIAL_SIZE:
+            self._file.truncate(self.INITIAL_SIZE)
+            size = self.INITIAL_SIZE
+        self._mmap = mmap.mmap(self._file.fileno(), size)
+        self._used = struct.unpack_from("<Q", self._mmap, 0)[0] or 8
+        self._positions = {
+            key: offset
+            for key, _, offset in self.entries(self._mmap, self._used)
+        }
+
+    @staticmethod
+    def entries(data, used: int):
+        offset = 8
+        while offset < used:
+            length = struct.unpack_from("<I", data, offset)[0]
+            key = bytes(data[offset + 4:offset + 4 + length]).decode()
+            offset += 4 + length + (-(4 + length) % 8)
+            yield key, struct.unpack_from("<d", data, offset)[0], offset
+            offset += 8
+
+    @classmethod
+    def read(cls, path: str) -> dict[str, float]:
+        """Значения из файла другого процесса."""
+        with open(path, "rb") as source:
+            data = source.read()
+        if len(data) < 8:
+            return {}
+        used = struct.unpack_from("<Q", data, 0)[0]
+        return {key: value for key, value, _ in cls.entries(data, used)}
+
+    def _position(self, key: str) -> int:
+        offset = self._positions.get(key)
+        if offset is not None:
+            return offset
+        encoded = key.encode()
+        length = 4 + len(encoded)
+        length += -length % 8
+        if self._used + length + 8 > len(self._mmap):
+            self._grow(self._used + length + 8)
+        struct.pack_into(
+            f"<I{len(encoded)}s", self._mmap, self._used,
+            len(encoded), encoded,
+        )
+        offset = self._used + length
+        struct.pack_into("<d", self._mmap, offset, 0.0)
+        self._used = offset + 8
+        struct.pack_into("<Q", self._mmap, 0, self._used)
+        self._positions[key] = offset
+        return offset
+
+    def _grow(self, needed: int) -> None:
+        size = len(self._mmap)
+        while size < needed:
+            size *= 2
+        self._mmap.close()
+        self._file.truncate(size)
+        self._mmap = mmap.mmap(self._file.fileno(), size)
+
+    def add(self, key: str, amount: float) -> None:
+        with self._lock:
+            offset = self._position(key)
+            value = struct.unpack_from("<d", self._mmap, offset)[0]
+            struct.pack_into("<d", self._mmap, offset, value + amount)
+
+    def reset_gauges(self) -> None:
+        """Обнуляет значения метрик типа gauge."""
+        with self._lock:
+            for key, offset in self._positions.items():
+                if is_gauge(key):
+                    struct.pack_into("<d", self._mmap, offset, 0.0)
+
+    def close(self) -> None:
+        self._mmap.close()
+        self._file.close()
+
+
+def is_gauge(key: str) -> bool:
+    return METRICS.get(json.loads(key)[0], ("",))[0] == "gauge"
+
+
+@contextmanager
+def directory_lock():
+    """Блокировка METRICS_DIR между процессами."""
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    with open(os.path.join(settings.METRICS_DIR, LOCK_FILE), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+_values: MmapValues | None = None
+_values_pid: int | None = None
+_values_lock = Lock()
+
+
+def values() -> MmapValues:
+    """Файл значений текущего процесса.
+    Открывается заново после fork, чтобы воркеры не писали
+    в файл родительского процесса. Файл завершённого процесса
+    с тем же pid продолжается: его счётчики остаются в сумме,
+    а gauge обнуляются.
+    """
+    global _values, _values_pid
+    pid = os.getpid()
+    if _values_pid != pid:
+        with _values_lock:
+            if _values_pid != pid:
+                with directory_lock():
+                    _values = MmapValues(
+                        os.path.join(settings.METRICS_DIR, f"{pid}.db")
+                    )
+                    _values.reset_gauges()
+                _values_pid = pid
+    return _values
+
+
+def sample_key(name: str, labels: tuple) -> str:
+    return json.dumps([name, labels], ensure_ascii=False)
+
+
+def view_labels(view_func, method: str) -> tuple:
+    """Метки представления: класс и действие ViewSet.
+    Для обычных представлений Django action пустой.
+    """
+    cls = getattr(view_func, "cls", None)
+    if cls is None:
+        return (
+            ("view", f"{view_func.__module__}.{view_func.__name__}"),
+            ("action", ""),
+        )
+    actions = getattr(view_func, "actions", None) or {}
+    return (
+        ("view", cls.__name__),
+        ("action", actions.get(method.lower(), method.lower())),
+    )
+
+
+def observe(name: str, labels: tuple, value: float) -> None:
+    buckets = METRICS[name][2]
+    index = bisect_left(buckets, value)
+    le = str(buckets[index]) if index < len(buckets) else "+Inf"
+    store = values()
+    store.add(sample_key(f"{name}_bucket", labels + (("le", le),)), 1)
+    store.add(sample_key(f"{name}_sum", labels), value)
+    store.add(sample_key(f"{name}_count", labels), 1)
+
+
+def observe_request(
+    labels: tuple, method: str, status: int, duration: float, queries: int
+) -> None:
+    labels = labels + (("method", method),)
+    values().add(
+        sample_key(
+            "foodgram_http_requests_total",
+            labels + (("status", str(status)),),
+        ),
+        1,
+    )
+    observe("foodgram_http_request_duration_seconds", labels, duration)
+    observe("foodgram_http_request_queries", labels, queries)
+
+
+def track_in_flight(labels: tuple, amount: int) -> None:
+    values().add(sample_key("foodgram_http_requests_in_flight", labels), amount)
+
+
+def pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def pid_files(directory: str) -> dict[int, str]:
+    """Файлы процессов в directory по pid."""
+    files = {}
+    for filename in os.listdir(directory):
+        stem, extension = os.path.splitext(filename)
+        if extension == ".db" and stem.isdigit():
+            files[int(stem)] = os.path.join(directory, filename)
+    return files
+
+
+def merge_dead(directory: str) -> None:
+    """Переносит счётчики и гистограммы завершённых процессов
+    в merged.db и удаляет их файлы, gauge отбрасываются.
+    Вызывается под directory_lock: файл не удаляется, пока его
+    открывает новый процесс с тем же pid, и два процесса
+    не переносят один файл дважды.
+    """
+    dead = [
+        path for pid, path in pid_files(directory).items()
+        if not pid_alive(pid)
+    ]
+    if not dead:
+        return
+    merged = MmapValues(os.path.join(directory, MERGED_FILE))
+    try:
+        for path in dead:
+            for key, value in MmapValues.read(path).items():
+                if not is_gauge(key):
+                    merged.add(key, value)
+            os.remove(path)
+    finally:
+        merged.close()
+
+
+def collect() -> dict[str, float]:
+    """Сумма значений по файлам живых процессов и merged.db.
+    Файлы читаются под блокировкой, чтобы перенос в merged.db
+    другим процессом не учёл значения дважды.
+    """
+    totals = defaultdict(float)
+    directory = settings.METRICS_DIR
+    if not os.path.isdir(directory):
+        return totals
+    with directory_lock():
+        merge_dead(directory)
+        paths = list(pid_files(directory).values())
+        merged = os.path.join(directory, MERGED_FILE)
+        if os.path.exists(merged):
+            paths.append(merged)
+        for path in paths:
+            for key, value in MmapValues.read(path).items():
+                totals[key] += value
+    return totals
+
+
+def format_labels(labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(
+        '{}="{}"'.format(
+            name,
+            value.replace("\\", "\\\\").replace('"', '\\"')
+            .replace("\n", "\\n"),
+        )
+        for name, value in labels
+    ) + "}"
+
+
+def render() -> str:
+    """Текст метрик в формате Prometheus 0.0.4.
+    Корзины гистограмм хранятся по отдельности и суммируются
+    в накопительные значения le здесь.
+    """
+    samples = defaultdict(list)
+    for key, value in collect().items():
+        name, labels = json.loads(key)
+        samples[name].append((tuple(map(tuple, labels)), value))
+
+    lines = []
+    for name, (kind, description, buckets) in METRICS.items():
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind != "histogram":
+            for labels, value in sorted(samples[name]):
+                lines.append(f"{name}{format_labels(labels)} {value:g}")
+            continue
+        bucket_counts = defaultdict(dict)
+        for labels, value in samples[f"{name}_bucket"]:
+            bucket_counts[labels[:-1]][labels[-1][1]] = value
+        sums = dict(samples[f"{name}_sum"])
+        for labels, count in sorted(samples[f"{name}_count"]):
+            cumulative = 0.0
+            for le in [str(bound) for bound in buckets] + ["+Inf"]:
+                cumulative += bucket_counts[labels].get(le, 0.0)
+                lines.append(
+                    f"{name}_bucket{format_labels(labels + (('le', le),))} "
+                    f"{cumulative:g}"
+                )
+            lines.append(
+                f"{name}_sum{format_labels(labels)} {sums.get(labels, 0):g}"
+            )
+            lines.append(f"{name}_count{format_labels(labels)} {count:g}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,187 @@
+"""Замер времени обработки запроса.
+   Объекты модуля:
+        QueryStats:
+            Счётчик SQL-запросов одного запроса: количество, суммарное
+            время и повторы одинаковых запросов (признак N+1).
+        fingerprint:
+            Текст запроса без значений для поиска повторов.
+        RequestTimingMiddleware:
+            Добавляет заголовок Server-Timing (db, view, render, total)
+            и пишет в лог запросы дольше SLOW_REQUEST_MS.
+            При REQUEST_TIMING = False исключается из цепочки
+            middleware при запуске и ничего не стоит.
+        MetricsMiddleware:
+            Записывает метрики запроса по представлению и действию
+            DRF (см. core.metrics). Отключается настройкой METRICS.
+"""
+import json
+import logging
+import re
+from collections import Counter
+from contextlib import ExitStack
+from time import perf_counter
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from core import metrics
+
+logger = logging.getLogger(__name__)
+
+# Количество повторяющихся запросов в строке лога
+LOGGED_DUPLICATES = 5
+
+_STRINGS = re.compile(r"'(?:[^']|'')*'")
+_NUMBERS = re.compile(r"\b\d+(?:\.\d+)?\b")
+_LISTS = re.compile(r"\((?:\s*(?:%s|\?)\s*,)+\s*(?:%s|\?)\s*\)")
+
+
+def fingerprint(sql: str) -> str:
+    """Текст запроса без значений.
+    Строки и числа заменяются на ?, списки IN (...) любой
+    длины сворачиваются в (...).
+    """
+    sql = _STRINGS.sub("?", sql)
+    sql = _NUMBERS.sub("?", sql)
+    return _LISTS.sub("(...)", sql)
+
+
+class QueryStats:
+    """Обёртка выполнения запросов для connection.execute_wrapper."""
+
+    def __init__(self, fingerprints: bool = True):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter() if fingerprints else None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += perf_counter() - started
+            self.count += 1
+            if self.fingerprints is not None:
+                self.fingerprints[fingerprint(sql)] += 1
+
+    def watch(self, stack: ExitStack) -> None:
+        """Подключает счётчик ко всем соединениям с БД."""
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(self))
+
+    @property
+    def duplicates(self) -> list[tuple[str, int]]:
+        return [
+            (sql, count)
+            for sql, count in self.fingerprints.most_common()
+            if count > 1
+        ]
+
+
+class RequestTimingMiddleware:
+    """Время SQL, представления и отрисовки ответа.
+    view - время представления без SQL (в DRF включает работу
+    сериализаторов), render - перевод ответа в JSON или файл.
+    """
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_TIMING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = QueryStats()
+        request._timing = {"started": perf_counter()}
+        with ExitStack() as stack:
+            stats.watch(stack)
+            response = self.get_response(request)
+        self.finish(request, response, stats)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._timing["view"] = perf_counter()
+
+    def process_template_response(self, request, response):
+        request._timing["render"] = perf_counter()
+        return response
+
+    def finish(self, request, response, stats: QueryStats) -> None:
+        marks = request._timing
+        finished = perf_counter()
+        total = finished - marks["started"]
+        view_started = marks.get("view", marks["started"])
+        render_started = marks.get("render", finished)
+        timings = {
+            "db": stats.duration,
+            "view": max(render_started - view_started - stats.duration, 0),
+            "render": finished - render_started,
+            "total": total,
+        }
+        duplicates = stats.duplicates
+        response["Server-Timing"] = ", ".join(
+            [
+                f'db;dur={timings["db"] * 1000:.1f};'
+                f'desc="{stats.count} queries, '
+                f'{sum(count for _, count in duplicates)} duplicated"'
+            ] + [
+                f"{name};dur={timings[name] * 1000:.1f}"
+                for name in ("view", "render", "total")
+            ]
+        )
+        if total * 1000 < settings.SLOW_REQUEST_MS:
+            return
+        logger.warning(json.dumps({
+            "event": "slow_request",
+            "method": request.method,
+            "path": request.get_full_path(),
+            "status": response.status_code,
+            "queries": stats.count,
+            **{
+                f"{name}_ms": round(value * 1000, 1)
+                for name, value in timings.items()
+            },
+            "duplicates": [
+                {"sql": sql, "count": count}
+                for sql, count in duplicates[:LOGGED_DUPLICATES]
+            ],
+        }, ensure_ascii=False))
+
+
+class MetricsMiddleware:
+    """Время, статус и количество SQL-запросов по представлениям.
+    Метки view и action определяются в process_view, запросы,
+    не дошедшие до представления, учитываются как unmatched.
+    Для потоковых ответов время считается до начала передачи.
+    """
+
+    def __init__(self, get_response):
+        if not settings.METRICS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = perf_counter()
+        stats = QueryStats(fingerprints=False)
+        try:
+            with ExitStack() as stack:
+                stats.watch(stack)
+                response = self.get_response(request)
+        finally:
+            labels = getattr(request, "_metrics_labels", None)
+            if labels is not None:
+                metrics.track_in_flight(labels, -1)
+        metrics.observe_request(
+            labels or metrics.UNMATCHED,
+            request.method,
+            response.status_code,
+            perf_counter() - started,
+            stats.count,
+        )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._metrics_labels = metrics.view_labels(
+            view_func, request.method
+        )
+        metrics.track_in_flight(request._metrics_labels, 1)
@@ -0,0 +1,47 @@
+"""Общие части моделей.
+   Объекты модуля:
+        CounterFieldsMixin:
+            Защищает поля-счётчики от перезаписи при save().
+        SearchVectorIndex:
+            GIN-индекс поля полнотекстового поиска.
+"""
+from django.contrib.postgres.indexes import GinIndex
+from django.db.models import Index
+
+
+class CounterFieldsMixin:
+    """Модель с полями-счётчиками counter_fields.
+    Счётчики меняются только запросами UPDATE с F() (см. сигналы
+    recipes.signals), а объект в памяти может хранить устаревшее
+    значение. Поэтому save() существующего объекта без update_fields
+    сохраняет все поля, кроме счётчиков.
+    """
+    counter_fields: tuple[str, ...] = ()
+
+    def save(self, *args, **kwargs) -> None:
+        if (
+            not self._state.adding
+            and not args
+            and kwargs.get("update_fields") is None
+            and not kwargs.get("force_insert")
+        ):
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields
+            ]
+        super().save(*args, **kwargs)
+
+
+class SearchVectorIndex(GinIndex):
+    """GIN-индекс на PostgreSQL.
+    На других БД создаётся обычный индекс: схема из миграций
+    остаётся одинаковой, а поиск там идёт не по этому полю
+    (см. core.fulltext).
+    """
+
+    def create_sql(self, model, schema_editor, using=""):
+        if schema_editor.connection.vendor != "postgresql":
+            return Index.create_sql(self, model, schema_editor, using=using)
+        return super().create_sql(model, schema_editor, using=using)
@@ -0,0 +1,166 @@
+"""Популярность рецептов с затуханием по времени.
+   Каждая отметка рецепта (избранное, корзина) добавляет к его
+   популярности свой вес, который уменьшается вдвое каждые
+   POPULAR_HALF_LIFE_HOURS часов:
+        popularity = sum(weight * 0.5 ** (age / half_life))
+   Отметки группируются в БД по рецепту и часу добавления,
+   поэтому затухание считается с точностью до часа. Популярность
+   пересчитывается командой popularity и хранится в Recipe.
+   Объекты модуля:
+        compute:
+            Популярность рецептов по отметкам за последние
+            POPULAR_HORIZON_HALF_LIVES периодов полураспада.
+        write:
+            Сохраняет популярность в Recipe частями.
+        computed_at:
+            Время последнего расчёта, входит в ETag списков.
+        Leaderboard:
+            Списки популярных рецептов по тэгам в памяти процесса.
+        leaderboard:
+            Общие списки процесса, используются в RecipeViewSet.
+"""
+import heapq
+from collections import defaultdict
+from datetime import datetime, timedelta
+from threading import Lock
+from time import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from core.enums import DataVersions, Limits
+from core.services import get_data_version
+from recipes.models import Cart, Favorit, Recipe, Tag
+
+# Модель отметки: вес отметки в популярности
+MARK_WEIGHTS = {
+    Favorit: 1.0,
+    Cart: 1.0,
+}
+
+COMPUTED_AT_KEY = "popular:computed_at"
+
+
+def compute(now: datetime | None = None) -> dict[int, float]:
+    """Популярность рецептов, у которых есть недавние отметки."""
+    now = now or timezone.now()
+    half_life = Limits.POPULAR_HALF_LIFE_HOURS.value
+    since = now - timedelta(
+        hours=half_life * Limits.POPULAR_HORIZON_HALF_LIVES.value
+    )
+    scores = defaultdict(float)
+    for model, weight in MARK_WEIGHTS.items():
+        rows = model.objects.filter(date_added__gte=since).annotate(
+            hour=TruncHour("date_added")
+        ).order_by().values("recipe_id", "hour").annotate(
+            marks=Count("pk")
+        ).values_list("recipe_id", "hour", "marks")
+        for recipe_id, hour, marks in rows.iterator(
+            chunk_size=Limits.LOADER_CHUNK_SIZE.value
+        ):
+            age = max((now - hour).total_seconds() / 3600, 0.0)
+            scores[recipe_id] += weight * marks * 0.5 ** (age / half_life)
+    return scores
+
+
+def write(scores: dict[int, float]) -> int:
+    """Сохраняет популярность рецептов.
+    Рецептам с ненулевой популярностью, которых нет в scores,
+    ставится 0: они выбираются по индексу recipe_popularity_idx,
+    остальные рецепты не читаются. Рассчитанные значения
+    записываются частями по STREAM_CHUNK_SIZE рецептов.
+    """
+    chunk_size = Limits.STREAM_CHUNK_SIZE.value
+    stale = [
+        pk for pk in Recipe.objects.filter(popularity__gt=0).values_list(
+            "pk", flat=True
+        ).iterator(chunk_size=Limits.LOADER_CHUNK_SIZE.value)
+        if pk not in scores
+    ]
+    for start in range(0, len(stale), chunk_size):
+        Recipe.objects.filter(
+            pk__in=stale[start:start + chunk_size]
+        ).update(popularity=0.0)
+    items = sorted(scores.items())
+    for start in range(0, len(items), chunk_size):
+        with transaction.atomic():
+            Recipe.objects.bulk_update(
+                [
+                    Recipe(pk=pk, popularity=popularity)
+                    for pk, popularity in items[start:start + chunk_size]
+                ],
+                ["popularity"],
+            )
+    cache.set(COMPUTED_AT_KEY, time(), None)
+    return len(stale) + len(items)
+
+
+def computed_at() -> float:
+    return cache.get(COMPUTED_AT_KEY, 0.0)
+
+
+class Leaderboard:
+    """Популярные рецепты по тэгам.
+    Для каждого тэга хранится POPULAR_TOP_N пар (популярность, id)
+    по убыванию, список строится при первом запросе тэга одним
+    запросом по индексу recipe_popularity_idx. Списки нескольких
+    тэгов сливаются без обращения к БД. Списки сбрасываются после
+    нового расчёта популярности и при изменении тэгов.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._version = None
+        self._slugs: frozenset[str] = frozenset()
+        self._lists: dict[str, list[tuple[float, int]]] = {}
+
+    def refresh(self) -> None:
+        version = (computed_at(), get_data_version(DataVersions.TAGS.value))
+        if version == self._version:
+            return
+        with self._lock:
+            if version != self._version:
+                self._slugs = frozenset(
+                    Tag.objects.values_list("slug", flat=True)
+                )
+                self._lists = {}
+                self._version = version
+
+    def top(self, slug: str = "") -> list[tuple[float, int]]:
+        """Популярные рецепты тэга slug, пустой slug - всех рецептов."""
+        lists = self._lists
+        if slug not in lists:
+            queryset = Recipe.objects.filter(popularity__gt=0)
+            if slug:
+                queryset = queryset.filter(tags__slug=slug)
+            lists[slug] = list(queryset.order_by(
+                "-popularity", "-id"
+            ).values_list(
+                "popularity", "id"
+            )[:Limits.POPULAR_TOP_N.value])
+        return lists[slug]
+
+    def recipe_ids(self, slugs: list[str]) -> list[int]:
+        """id популярных рецептов с любым из тэгов slugs.
+        Несуществующие тэги пропускаются и не попадают в кэш.
+        """
+        self.refresh()
+        if not slugs:
+            return [recipe_id for _, recipe_id in self.top()]
+        lists = [self.top(slug) for slug in dict.fromkeys(slugs)
+                 if slug in self._slugs]
+        result, seen = [], set()
+        for _, recipe_id in heapq.merge(*lists, reverse=True):
+            if recipe_id in seen:
+                continue
+            seen.add(recipe_id)
+            result.append(recipe_id)
+            if len(result) == Limits.POPULAR_TOP_N.value:
+                break
+        return result
+
+
+leaderboard = Leaderboard()
@@ -0,0 +1,112 @@
+"""Поиск ингредиентов по названию в памяти процесса.
+   Объекты модуля:
+        IngredientIndex:
+            Индекс ингредиентов: отсортированный список для поиска
+            по началу слова и словарь n-грамм для поиска по подстроке.
+        ingredient_index:
+            Общий индекс процесса, используется в IngredientViewSet.
+   Индекс строится один раз и перестраивается, когда меняется
+   версия данных ингредиентов (см. core.services.get_data_version).
+"""
+from bisect import bisect_left
+from threading import Lock
+
+from core.enums import DataVersions
+from core.services import get_data_version
+
+# Максимальная длина n-граммы в индексе подстрок
+NGRAM_SIZE = 3
+
+
+def ngrams(text: str, size: int = NGRAM_SIZE) -> set[str]:
+    """Все подстроки text длиной от 1 до size символов."""
+    return {
+        text[start:start + length]
+        for length in range(1, size + 1)
+        for start in range(len(text) - length + 1)
+    }
+
+
+class IngredientIndex:
+    """Индекс ингредиентов для автодополнения.
+    Поиск выполняется без обращения к БД:
+        - совпадения по началу названия через bisect;
+        - совпадения по подстроке через словарь n-грамм.
+    Совпадения по началу названия выводятся первыми.
+    Ключи, строки и n-граммы хранятся одним кортежем _data
+    и заменяются одним присваиванием, поэтому поиск
+    во время перестройки видит целиком старый или новый индекс.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._version = None
+        self._data: tuple[list[str], list[dict], dict[str, set[int]]] = (
+            [], [], {}
+        )
+
+    def build(self, version: str | None = None) -> None:
+        """Загружает ингредиенты из БД и пересобирает индекс."""
+        from recipes.models import Ingredient
+
+        if version is None:
+            version = get_data_version(DataVersions.INGREDIENTS.value)
+        rows = sorted(
+            Ingredient.objects.values("id", "name", "measurement_unit"),
+            key=lambda row: (row["name"].casefold(), row["id"]),
+        )
+        keys = [row["name"].casefold() for row in rows]
+        grams: dict[str, set[int]] = {}
+        for position, key in enumerate(keys):
+            for gram in ngrams(key):
+                grams.setdefault(gram, set()).add(position)
+        self._data = (keys, rows, grams)
+        self._version = version
+
+    def refresh(self) -> None:
+        """Пересобирает индекс, если изменилась версия данных."""
+        version = get_data_version(DataVersions.INGREDIENTS.value)
+        if version == self._version:
+            return
+        with self._lock:
+            if version != self._version:
+                self.build(version)
+
+    def search(self, query: str, limit: int | None = None) -> list[dict]:
+        """Ингредиенты, в названии которых есть query.
+        Сначала идут названия, начинающиеся с query, затем остальные
+        совпадения в порядке позиции вхождения и алфавита.
+        """
+        self.refresh()
+        keys, items, grams = self._data
+        query = query.strip().casefold()
+        if not query:
+            return items[:limit]
+
+        start = bisect_left(keys, query)
+        end = start
+        while end < len(keys) and keys[end].startswith(query):
+            end += 1
+        result = items[start:end]
+        if limit is not None and len(result) >= limit:
+            return result[:limit]
+
+        if len(query) <= NGRAM_SIZE:
+            candidates = grams.get(query, set())
+        else:
+            candidates = set.intersection(*(
+                grams.get(query[pos:pos + NGRAM_SIZE], set())
+                for pos in range(len(query) - NGRAM_SIZE + 1)
+            ))
+        contains = sorted(
+            (keys[position].find(query), position)
+            for position in candidates
+            if not start <= position < end
+        )
+        result += [
+            items[position] for found, position in contains if found > 0
+        ]
+        return result[:limit]
+
+
+ingredient_index = IngredientIndex()
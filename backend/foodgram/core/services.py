@@ -1,25 +1,343 @@
 """Модуль для дополнительных методов сериализаторов.
    Методы модуля:
         recipe_amount_ingredients_set:
-            Создаёт объект AmountIngredient, связывающий Recipe и
-            Ingredient.
+            Создаёт, изменяет и удаляет объекты AmountIngredient,
+            связывающие Recipe и Ingredient, по разнице со списком.
+        suppress_amount_signals, amount_signals_suppressed:
+            Отключают построчные обработчики сигналов AmountIngredient
+            рецепта на время пакетной записи его ингредиентов.
+        limited_recipes_prefetch:
+            Загружает первые N рецептов каждого автора одним запросом.
+        get_data_version, bump_data_version:
+            Версии справочников в кэше. Версия меняется при
+            изменении данных и используется для сброса кэшей.
+        recipe_amounts, recipes_amounts, amounts_delta,
+        shopping_list_apply:
+            Поддержка списка покупок ShoppingListItem в актуальном
+            состоянии при изменении корзины и рецептов.
+        toggle_recipe_marks:
+            Добавляет или удаляет рецепты в избранном или корзине
+            пользователя одним запросом.
+        get_user_state_stamp, touch_user_state:
+            Время последнего изменения избранного, корзины
+            и подписок пользователя.
+        get_recipes_state_stamp, touch_recipes_state:
+            Время последнего изменения выводимых данных рецептов.
         Base64ImageField:
             Работа с изображением. Дешифровка изображдения.
 """
-from recipes.models import Recipe, AmountIngredient
+from recipes.models import (
+    AmountIngredient, Cart, Favorit, Recipe, ShoppingListItem
+)
+from users.models import CustomUser
 
 import base64
+from contextlib import contextmanager
+from threading import local
+from time import time
+from uuid import uuid4
+
+from django.core.cache import cache
 from django.core.files.base import ContentFile
+from django.utils import timezone
+from django.db import connection, transaction
+from django.db.models import F, Prefetch, Sum
+from django.db.models.expressions import RawSQL, Window
+from django.db.models.functions import RowNumber
 from rest_framework import serializers
 
 
-def recipe_amount_ingredients_set(recipe: Recipe, ingredients: list[dict]):
-    for ingredient in ingredients:
-        AmountIngredient.objects.get_or_create(
-            recipe=recipe,
-            ingredients=ingredient["ingredient"],
-            amount=ingredient["amount"],
+_amount_signals = local()
+
+
+@contextmanager
+def suppress_amount_signals(recipe_id: int):
+    """Построчные обработчики AmountIngredient рецепта пропускают
+    сигналы внутри блока. Остальные обработчики вызываются.
+    """
+    suppressed = _amount_signals.__dict__.setdefault("recipe_ids", set())
+    suppressed.add(recipe_id)
+    try:
+        yield
+    finally:
+        suppressed.discard(recipe_id)
+
+
+def amount_signals_suppressed(recipe_id: int) -> bool:
+    return recipe_id in getattr(_amount_signals, "recipe_ids", ())
+
+
+def recipe_amount_ingredients_set(
+    recipe: Recipe, ingredients: list[dict], created: bool = False
+) -> dict[int, int]:
+    """Приводит ингредиенты рецепта к переданному списку.
+    Сохранённые и переданные ингредиенты сравниваются, изменения
+    применяются одним bulk_create, одним bulk_update и одним delete.
+    Для нового рецепта (created=True) чтение сохранённых строк
+    пропускается.
+    Возвращает разницу количеств {id ингредиента: новое - старое}.
+    """
+    current = {} if created else {
+        row.ingredients_id: row
+        for row in AmountIngredient.objects.filter(recipe=recipe)
+    }
+    submitted = {
+        ingredient["ingredient"].id: ingredient["amount"]
+        for ingredient in ingredients
+    }
+    delta = amounts_delta(
+        {ingredient: row.amount for ingredient, row in current.items()},
+        submitted,
+    )
+
+    to_create = [
+        AmountIngredient(
+            recipe=recipe, ingredients_id=ingredient, amount=amount
         )
+        for ingredient, amount in submitted.items()
+        if ingredient not in current
+    ]
+    to_update, to_delete = [], []
+    for ingredient, row in current.items():
+        if ingredient not in submitted:
+            to_delete.append(row.id)
+        elif row.amount != submitted[ingredient]:
+            row.amount = submitted[ingredient]
+            to_update.append(row)
+
+    # Построчные обработчики пропускают удаление:
+    # updated_at и поисковый документ обновляет сохранение рецепта
+    if to_delete:
+        with suppress_amount_signals(recipe.pk):
+            AmountIngredient.objects.filter(id__in=to_delete).delete()
+    if to_update:
+        AmountIngredient.objects.bulk_update(to_update, ["amount"])
+    if to_create:
+        AmountIngredient.objects.bulk_create(to_create)
+    return delta
+
+
+def user_state_key(user_id: int) -> str:
+    return f"user_state:{user_id}"
+
+
+def get_user_state_stamp(user_id: int) -> float:
+    """Время изменения избранного, корзины и подписок пользователя.
+    Если отметки нет в кэше, считается, что состояние изменено сейчас.
+    """
+    return cache.get_or_set(user_state_key(user_id), time, None)
+
+
+def touch_user_state(user_id: int) -> None:
+    """Отмечает изменение состояния пользователя после фиксации
+    транзакции, как и touch_recipes_state.
+    """
+    transaction.on_commit(
+        lambda: cache.set(user_state_key(user_id), time(), None)
+    )
+
+
+RECIPES_STATE_KEY = "recipes_state"
+
+
+def get_recipes_state_stamp() -> float:
+    """Время изменения рецептов, их тэгов, ингредиентов и авторов.
+    Если отметки нет в кэше, считается, что рецепты изменены сейчас.
+    """
+    return cache.get_or_set(RECIPES_STATE_KEY, time, None)
+
+
+def touch_recipes_state() -> None:
+    """Отмечает изменение рецептов после фиксации транзакции,
+    иначе параллельный запрос сохранил бы старые данные
+    под новой отметкой.
+    """
+    transaction.on_commit(
+        lambda: cache.set(RECIPES_STATE_KEY, time(), None)
+    )
+
+
+class SubquerySQL(RawSQL):
+    """Сырой подзапрос для правой части __in.
+    Lookup сам оборачивает подзапрос в скобки, RawSQL добавляет
+    вторые, и IN ((SELECT ...)) читается как скалярный подзапрос.
+    """
+
+    def as_sql(self, compiler, connection):
+        return self.sql, self.params
+
+
+def limited_recipes_prefetch(
+    authors: list[int], limit: int, to_attr: str = "limited_recipes"
+) -> Prefetch:
+    """Prefetch последних `limit` рецептов для каждого автора.
+    Рецепты нумеруются ROW_NUMBER() в разрезе автора,
+    в выборку попадают строки с номером не больше `limit`.
+    """
+    numbered = Recipe.objects.filter(author__in=authors).annotate(
+        row_number=Window(
+            expression=RowNumber(),
+            partition_by=[F("author")],
+            order_by=[F("pub_date").desc(), F("id").desc()],
+        )
+    ).order_by().values("id", "row_number")
+    sql, params = numbered.query.sql_with_params()
+    return Prefetch(
+        "recipes",
+        queryset=Recipe.objects.filter(id__in=SubquerySQL(
+            f"SELECT numbered.id FROM ({sql}) numbered "
+            "WHERE numbered.row_number <= %s",
+            (*params, limit),
+        )).order_by("-pub_date", "-id"),
+        to_attr=to_attr,
+    )
+
+
+def recipe_amounts(recipe: Recipe) -> dict[int, int]:
+    """Количество каждого ингредиента рецепта: {id ингредиента: amount}."""
+    return dict(AmountIngredient.objects.filter(recipe=recipe).values_list(
+        "ingredients_id", "amount"
+    ))
+
+
+def recipes_amounts(recipe_ids: list[int]) -> dict[int, int]:
+    """Сумма ингредиентов нескольких рецептов: {id ингредиента: amount}."""
+    return dict(AmountIngredient.objects.filter(
+        recipe_id__in=recipe_ids
+    ).values("ingredients_id").annotate(
+        total=Sum("amount")
+    ).order_by().values_list("ingredients_id", "total"))
+
+
+def amounts_delta(
+    old: dict[int, int], new: dict[int, int]
+) -> dict[int, int]:
+    """Разница количеств ингредиентов new - old без нулевых значений."""
+    delta = {
+        ingredient: new.get(ingredient, 0) - old.get(ingredient, 0)
+        for ingredient in old.keys() | new.keys()
+    }
+    return {ingredient: diff for ingredient, diff in delta.items() if diff}
+
+
+def shopping_list_apply(user_ids: list[int], delta: dict[int, int]) -> None:
+    """Прибавляет delta к спискам покупок пользователей.
+    Строки пользователей блокируются на время изменения, поэтому
+    параллельные изменения корзины одного пользователя выполняются
+    по очереди. Строки с нулевым количеством удаляются.
+    """
+    if not user_ids or not delta:
+        return
+    with transaction.atomic():
+        list(CustomUser.objects.select_for_update().filter(
+            id__in=user_ids
+        ).values_list("id", flat=True))
+        items = {
+            (item.user_id, item.ingredient_id): item
+            for item in ShoppingListItem.objects.filter(
+                user_id__in=user_ids, ingredient_id__in=delta
+            )
+        }
+        to_create, to_update, to_delete = [], [], []
+        for user_id in user_ids:
+            for ingredient_id, diff in delta.items():
+                item = items.get((user_id, ingredient_id))
+                if item is None:
+                    if diff > 0:
+                        to_create.append(ShoppingListItem(
+                            user_id=user_id,
+                            ingredient_id=ingredient_id,
+                            total_amount=diff,
+                        ))
+                    continue
+                item.total_amount += diff
+                if item.total_amount > 0:
+                    to_update.append(item)
+                else:
+                    to_delete.append(item.id)
+        ShoppingListItem.objects.bulk_create(to_create)
+        ShoppingListItem.objects.bulk_update(to_update, ["total_amount"])
+        ShoppingListItem.objects.filter(id__in=to_delete).delete()
+
+
+# Модель отметки рецепта: счётчик Recipe
+MARK_COUNTERS = {
+    Favorit: "favorites_count",
+    Cart: "carts_count",
+}
+
+
+def toggle_recipe_marks(
+    model: type[Favorit | Cart],
+    user_id: int,
+    recipe_ids: list[int],
+    add: bool,
+) -> list[int]:
+    """Добавляет или удаляет отметки пользователя на рецептах.
+    Отметки меняются одним запросом INSERT ... ON CONFLICT DO NOTHING
+    (повтор отсекает уникальное ограничение) или DELETE ... RETURNING.
+    Возвращает id рецептов, отметка которых действительно изменилась.
+    Запрос не отправляет сигналы модели, поэтому счётчики рецептов
+    и отметка состояния пользователя обновляются здесь.
+    """
+    if not recipe_ids:
+        return []
+    table = model._meta.db_table
+    placeholders = ", ".join(["%s"] * len(recipe_ids))
+    with connection.cursor() as cursor:
+        if add:
+            cursor.execute(
+                f"INSERT INTO {table} (recipe_id, user_id, date_added) "
+                f"SELECT id, %s, %s FROM {Recipe._meta.db_table} "
+                f"WHERE id IN ({placeholders}) "
+                "ON CONFLICT DO NOTHING RETURNING recipe_id",
+                [
+                    user_id,
+                    connection.ops.adapt_datetimefield_value(timezone.now()),
+                    *recipe_ids,
+                ],
+            )
+        else:
+            cursor.execute(
+                f"DELETE FROM {table} WHERE user_id = %s "
+                f"AND recipe_id IN ({placeholders}) RETURNING recipe_id",
+                [user_id, *recipe_ids],
+            )
+        changed = [row[0] for row in cursor.fetchall()]
+    if changed:
+        counter = MARK_COUNTERS[model]
+        recipes = Recipe.objects.filter(pk__in=changed)
+        if add:
+            recipes.update(**{counter: F(counter) + 1})
+        else:
+            recipes.filter(**{f"{counter}__gt": 0}).update(
+                **{counter: F(counter) - 1}
+            )
+        touch_user_state(user_id)
+    return changed
+
+
+def data_version_key(name: str) -> str:
+    return f"data_version:{name}"
+
+
+def get_data_version(name: str) -> str:
+    """Текущая версия справочника.
+    Если версии нет в кэше, создаётся новая.
+    """
+    return cache.get_or_set(data_version_key(name), uuid4().hex, None)
+
+
+def bump_data_version(name: str) -> str:
+    """Назначает справочнику новую версию после фиксации транзакции.
+    Иначе параллельный запрос мог бы прочитать новую версию
+    и сохранить под ней данные, ещё не изменённые транзакцией.
+    """
+    version = uuid4().hex
+    transaction.on_commit(
+        lambda: cache.set(data_version_key(name), version, None)
+    )
+    return version
 
 
 class Base64ImageField(serializers.ImageField):
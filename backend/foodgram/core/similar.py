@@ -0,0 +1,239 @@
+"""Похожие рецепты по совпадению ингредиентов.
+   Рецепты - строки разреженной матрицы X рецепт x ингредиент
+   (scipy.sparse, формат CSR) из AmountIngredient. Значения
+   матрицы - 0 и 1, поэтому X[chunk] @ X.T - размеры пересечений
+   множеств ингредиентов рецептов chunk со всеми рецептами.
+   Произведение считается частями по STREAM_CHUNK_SIZE строк,
+   пары рецептов без общих ингредиентов в него не попадают.
+   Меры сходства по множествам ингредиентов A и B:
+        cosine:  |A & B| / sqrt(|A| * |B|)
+        jaccard: |A & B| / |A | B|
+   Объекты модуля:
+        IngredientMatrix:
+            Матрица и расчёт похожих рецептов.
+        changed_recipes:
+            Рецепты, изменённые после прошлого расчёта.
+        affected_recipes:
+            Рецепты, списки которых нужно пересчитать
+            после изменения рецептов.
+        incomplete_recipes:
+            Рецепты, списки которых стали короче возможного
+            после удаления рецептов.
+        write_similar:
+            Пересчитывает и сохраняет списки рецептов частями.
+"""
+from datetime import datetime
+from itertools import chain
+from typing import Iterable, Sequence
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Count, Max, Min
+from scipy import sparse
+
+from core.enums import Limits
+from recipes.models import AmountIngredient, Recipe, SimilarRecipe
+
+METRICS = ("cosine", "jaccard")
+
+
+class IngredientMatrix:
+    """Разреженная матрица рецепт x ингредиент.
+    recipe_ids - id рецептов по номерам строк (по возрастанию),
+    sizes - число ингредиентов рецепта каждой строки.
+    """
+
+    def __init__(self, metric: str = "cosine"):
+        self.metric = metric
+        self.recipe_ids = np.empty(0, dtype=np.int64)
+        self.sizes = np.empty(0, dtype=np.int64)
+        self.matrix = sparse.csr_matrix((0, 0))
+        self.transposed = sparse.csr_matrix((0, 0))
+
+    def load(self) -> "IngredientMatrix":
+        rows = AmountIngredient.objects.order_by().values_list(
+            "recipe_id", "ingredients_id"
+        ).iterator(chunk_size=Limits.LOADER_CHUNK_SIZE.value)
+        pairs = np.fromiter(
+            chain.from_iterable(rows), dtype=np.int64
+        ).reshape(-1, 2)
+        self.recipe_ids, row = np.unique(pairs[:, 0], return_inverse=True)
+        ingredient_ids, column = np.unique(pairs[:, 1], return_inverse=True)
+        # Ингредиенты в рецепте не повторяются (unique_ingredient),
+        # поэтому значения матрицы - 0 и 1
+        self.matrix = sparse.csr_matrix(
+            (np.ones(len(pairs)), (row, column)),
+            shape=(len(self.recipe_ids), len(ingredient_ids)),
+        )
+        self.transposed = self.matrix.T.tocsr()
+        self.sizes = np.diff(self.matrix.indptr)
+        return self
+
+    def positions(self, recipe_ids: Sequence[int]) -> np.ndarray:
+        """Номера строк рецептов, -1 для рецептов без ингредиентов."""
+        ids = np.asarray(recipe_ids, dtype=np.int64)
+        positions = np.searchsorted(self.recipe_ids, ids)
+        positions[positions >= len(self.recipe_ids)] = 0
+        found = (
+            self.recipe_ids[positions] == ids
+            if len(self.recipe_ids) else np.zeros(len(ids), dtype=bool)
+        )
+        return np.where(found, positions, -1)
+
+    def similarity(self, recipe_ids: Sequence[int]) -> sparse.csr_matrix:
+        """Ненулевое сходство рецептов recipe_ids с остальными.
+        Строки - рецепты recipe_ids по порядку, столбцы - строки
+        матрицы; сходство рецепта с самим собой не включается.
+        """
+        positions = self.positions(recipe_ids)
+        selected = sparse.csr_matrix(
+            (
+                np.ones(int((positions >= 0).sum())),
+                (np.flatnonzero(positions >= 0), positions[positions >= 0]),
+            ),
+            shape=(len(positions), len(self.recipe_ids)),
+        )
+        overlap = (selected @ self.matrix @ self.transposed).tocsr()
+        row = np.repeat(positions, np.diff(overlap.indptr))
+        size, other_size = self.sizes[row], self.sizes[overlap.indices]
+        if self.metric == "jaccard":
+            overlap.data = overlap.data / (size + other_size - overlap.data)
+        else:
+            overlap.data = overlap.data / np.sqrt(size * other_size)
+        overlap.data[overlap.indices == row] = 0
+        overlap.eliminate_zeros()
+        return overlap
+
+    def top(
+        self, recipe_ids: Sequence[int], k: int
+    ) -> dict[int, list[tuple[int, float]]]:
+        """k самых похожих рецептов для каждого рецепта recipe_ids,
+        при равном сходстве - новые.
+        """
+        scores = self.similarity(recipe_ids)
+        top = {}
+        for number, recipe_id in enumerate(recipe_ids):
+            start, end = scores.indptr[number], scores.indptr[number + 1]
+            other_ids = self.recipe_ids[scores.indices[start:end]]
+            values = scores.data[start:end]
+            order = np.lexsort((-other_ids, -values))[:k]
+            top[recipe_id] = [
+                (int(other_id), float(value))
+                for other_id, value in zip(other_ids[order], values[order])
+            ]
+        return top
+
+
+def last_computed_at() -> datetime | None:
+    return SimilarRecipe.objects.aggregate(last=Max("computed_at"))["last"]
+
+
+def changed_recipes(since: datetime) -> list[int]:
+    """Рецепты, изменённые после since.
+    updated_at рецепта меняется и при изменении его ингредиентов
+    (см. recipes.signals.recipe_ingredients_changed).
+    """
+    return list(Recipe.objects.filter(updated_at__gt=since).order_by(
+        "pk"
+    ).values_list("pk", flat=True))
+
+
+def affected_recipes(
+    matrix: IngredientMatrix, changed: list[int], k: int
+) -> set[int]:
+    """Рецепты, списки которых меняются вместе с changed.
+    Пересчитываются сами изменённые рецепты, рецепты, в списках
+    которых они уже есть, и рецепты, в списки которых изменённый
+    рецепт теперь попадает: сходство с ним выше наименьшего
+    в списке или список неполный.
+    """
+    affected = set(changed)
+    chunk_size = Limits.STREAM_CHUNK_SIZE.value
+    for start in range(0, len(changed), chunk_size):
+        chunk = changed[start:start + chunk_size]
+        affected.update(SimilarRecipe.objects.filter(
+            similar_id__in=chunk
+        ).values_list("recipe_id", flat=True))
+        best = matrix.similarity(chunk).max(axis=0).toarray().ravel()
+        positions = np.flatnonzero(best)
+        candidates = [
+            (int(recipe_id), score)
+            for recipe_id, score in zip(
+                matrix.recipe_ids[positions], best[positions]
+            )
+            if recipe_id not in affected
+        ]
+        for part in range(0, len(candidates), chunk_size):
+            scores = dict(candidates[part:part + chunk_size])
+            lists = {
+                recipe_id: (size, lowest)
+                for recipe_id, size, lowest in SimilarRecipe.objects.filter(
+                    recipe_id__in=scores
+                ).values("recipe_id").annotate(
+                    size=Count("pk"), lowest=Min("score")
+                ).order_by().values_list("recipe_id", "size", "lowest")
+            }
+            for recipe_id, score in scores.items():
+                size, lowest = lists.get(recipe_id, (0, 0.0))
+                if size < k or score > lowest:
+                    affected.add(recipe_id)
+    return affected
+
+
+def incomplete_recipes(
+    matrix: IngredientMatrix, k: int, exclude: set[int]
+) -> set[int]:
+    """Рецепты, в списках которых меньше рецептов, чем возможно.
+    Строки удалённого рецепта удаляются из чужих списков каскадно,
+    и список становится короче min(k, число похожих рецептов).
+    Проверяются только рецепты со списком короче k.
+    """
+    sizes = dict(SimilarRecipe.objects.values("recipe_id").annotate(
+        size=Count("pk")
+    ).order_by().values_list("recipe_id", "size"))
+    short = [
+        int(recipe_id) for recipe_id in matrix.recipe_ids
+        if recipe_id not in exclude and sizes.get(recipe_id, 0) < k
+    ]
+    incomplete = set()
+    chunk_size = Limits.STREAM_CHUNK_SIZE.value
+    for start in range(0, len(short), chunk_size):
+        chunk = short[start:start + chunk_size]
+        possible = np.minimum(matrix.similarity(chunk).getnnz(axis=1), k)
+        incomplete.update(
+            recipe_id for recipe_id, size in zip(chunk, possible)
+            if size > sizes.get(recipe_id, 0)
+        )
+    return incomplete
+
+
+def write_similar(
+    matrix: IngredientMatrix,
+    recipe_ids: Iterable[int],
+    k: int,
+    computed_at: datetime,
+) -> int:
+    """Пересчитывает списки рецептов и заменяет их в БД.
+    Списки пишутся частями по STREAM_CHUNK_SIZE рецептов,
+    в памяти держатся только списки текущей части.
+    """
+    recipe_ids = sorted(recipe_ids)
+    chunk_size = Limits.STREAM_CHUNK_SIZE.value
+    written = 0
+    for start in range(0, len(recipe_ids), chunk_size):
+        chunk = recipe_ids[start:start + chunk_size]
+        rows = [
+            SimilarRecipe(
+                recipe_id=recipe_id,
+                similar_id=other_id,
+                score=score,
+                computed_at=computed_at,
+            )
+            for recipe_id, top in matrix.top(chunk, k).items()
+            for other_id, score in top
+        ]
+        with transaction.atomic():
+            SimilarRecipe.objects.filter(recipe_id__in=chunk).delete()
+            SimilarRecipe.objects.bulk_create(rows)
+        written += len(rows)
+    return written
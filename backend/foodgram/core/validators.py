@@ -9,15 +9,20 @@
             Проверка поля slug.
             Длина от 2-х до 50-ти символов.
             Используются только цифры и буквы.
+        related_validator:
+            Проверка списка id: один запрос in_bulk и поиск повторов.
         tags_validator:
-            Проверка объекта tags в БД.
+            Проверка тэгов, возвращает объекты Tag.
         ingredients_validator:
-            Проверка объекта ingredient в БД и уникальности.
+            Проверка ингредиентов и количеств, возвращает
+            объекты Ingredient с количеством.
 """
 from django.core.exceptions import ValidationError
 from django.core.validators import RegexValidator
 from django.utils.text import slugify
 
+from core.enums import Limits
+
 
 def hex_validator_code(color: str) -> str:
     hex_validator = RegexValidator(
@@ -57,29 +62,78 @@ def validate_field_slug(slug: str) -> str:
     return slug_valid.capitalize().strip()
 
 
-def tags_validator(tags_obj: list, Tag) -> None:
-    exists_tags = Tag.objects.filter(id__in=tags_obj)
-
-    if len(exists_tags) != len(tags_obj):
-        raise ValidationError('Указан несуществующий тэг')
+def related_validator(
+    items: list, Model, label: str
+) -> tuple[list[int], dict[int, object], list[str]]:
+    """Проверка списка id объектов модели Model.
+    Все объекты загружаются одним запросом in_bulk, повторы
+    находятся за один проход по списку.
+    Возвращает id в порядке списка, найденные объекты
+    и сообщения обо всех ошибках.
+    """
+    errors, ids, seen = [], [], set()
+    for position, item in enumerate(items, 1):
+        try:
+            obj_id = int(item)
+        except (TypeError, ValueError):
+            errors.append(f"{label} №{position}: неверный id {item!r}")
+            continue
+        if obj_id in seen:
+            errors.append(f"{label} №{position}: id={obj_id} повторяется")
+            continue
+        seen.add(obj_id)
+        ids.append(obj_id)
 
+    objects = Model.objects.in_bulk(ids)
+    errors += [
+        f"{label} id={obj_id} не существует"
+        for obj_id in ids if obj_id not in objects
+    ]
+    return ids, objects, errors
 
-def ingredients_validator(ingredients: list, Ingredient) -> list:
-    ings_obj = [None] * len(ingredients)
 
-    for idx, ing in enumerate(ingredients):
-        ingredients[idx]['amount'] = int(ingredients[idx]['amount'])
-        if ingredients[idx]['amount'] < 1:
-            raise ValidationError('Неправильное количество ингидиента')
-        ings_obj[idx] = ing.pop('id', 0)
+def tags_validator(tags_obj: list, Tag) -> list:
+    """Возвращает объекты тэгов в порядке списка."""
+    if not isinstance(tags_obj, list):
+        raise ValidationError({"tags": ["Ожидается список id тэгов"]})
+    ids, tags, errors = related_validator(tags_obj, Tag, "Тэг")
+    if errors:
+        raise ValidationError({"tags": errors})
+    return [tags[tag_id] for tag_id in ids]
 
-    ings_in_db = Ingredient.objects.filter(id__in=ings_obj).order_by('pk')
-    ings_obj.sort()
 
-    for idx, id in enumerate(ings_obj):
-        ingredient: 'Ingredient' = ings_in_db[idx]
-        if ingredient.id != id:
-            raise ValidationError('Ингридент не существует')
+def ingredients_validator(ingredients: list, Ingredient) -> list[dict]:
+    """Возвращает [{"ingredient": объект, "amount": количество}]
+    в порядке списка. Сообщения обо всех неверных позициях
+    собираются в одну ошибку.
+    """
+    if not isinstance(ingredients, list) or not all(
+        isinstance(ing, dict) for ing in ingredients
+    ):
+        raise ValidationError({
+            "ingredients": ["Ожидается список объектов {id, amount}"]
+        })
+    errors, amounts = [], []
+    for position, ing in enumerate(ingredients, 1):
+        try:
+            amount = int(ing.get("amount"))
+        except (TypeError, ValueError):
+            amount = None
+        max_amount = Limits.MAX_INGREDIENT_AMOUNT.value
+        if amount is None or not 1 <= amount <= max_amount:
+            errors.append(
+                f"Ингредиент №{position}: количество должно быть "
+                f"от 1 до {max_amount}"
+            )
+        amounts.append(amount)
 
-        ingredients[idx]['ingredient'] = ingredient
-    return ingredients
+    ids, objects, id_errors = related_validator(
+        [ing.get("id") for ing in ingredients], Ingredient, "Ингредиент"
+    )
+    errors += id_errors
+    if errors:
+        raise ValidationError({"ingredients": errors})
+    return [
+        {"ingredient": objects[ing_id], "amount": amount}
+        for ing_id, amount in zip(ids, amounts)
+    ]
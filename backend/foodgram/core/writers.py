@@ -0,0 +1,141 @@
+"""Потоковая выгрузка списка покупок.
+   Функции модуля принимают заголовок и итератор строк
+   (name, amount, measurement) и возвращают генератор байтов,
+   который отдаётся в StreamingHttpResponse.
+   Методы модуля:
+        txt_writer:
+            Текстовый список.
+        csv_writer:
+            Таблица CSV с заголовком.
+        pdf_writer:
+            Документ PDF с текстом (reportlab): текст можно
+            выделять и искать. Строки читаются из итератора
+            по мере вывода страниц, документ отдаётся целиком
+            после последней строки.
+        pdf_font:
+            Шрифт документа PDF.
+        pdf_font_error:
+            Причина, по которой шрифт PDF не загружается.
+        check_pdf_font:
+            Проверка шрифта PDF при запуске (manage.py check).
+        SHOPPING_LIST_WRITERS:
+            Функция записи и Content-Type для каждого формата.
+"""
+import csv
+from io import BytesIO
+from itertools import chain
+from typing import Callable, Iterable, Iterator
+
+from django.conf import settings
+from django.core.checks import Warning
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFError, TTFont
+from reportlab.pdfgen import canvas
+
+Row = tuple[str, int, str]
+
+
+def txt_writer(title: list[str], rows: Iterable[Row]) -> Iterator[bytes]:
+    for line in title:
+        yield f"{line}\n".encode()
+    for name, amount, measurement in rows:
+        yield f"{name}: {amount} {measurement}\n".encode()
+
+
+class Echo:
+    """Объект с методом write для csv.writer.
+    Возвращает строку вместо записи в буфер.
+    """
+
+    def write(self, value: str) -> str:
+        return value
+
+
+def csv_writer(title: list[str], rows: Iterable[Row]) -> Iterator[bytes]:
+    writer = csv.writer(Echo())
+    # BOM нужен, чтобы Excel открыл файл в UTF-8
+    yield "\ufeff".encode()
+    yield writer.writerow(
+        ("Ингредиент", "Количество", "Единица измерения")
+    ).encode()
+    for row in rows:
+        yield writer.writerow(row).encode()
+
+
+# Размеры в пунктах
+PDF_MARGIN = 40
+PDF_FONT_SIZE = 12
+PDF_LINE_HEIGHT = 18
+PDF_FONT_NAME = "ShoppingList"
+
+
+def pdf_font() -> str:
+    """Регистрирует шрифт PDF_FONT_PATH один раз на процесс.
+    Шрифт нужен для кириллицы, в документ встраивается
+    только подмножество использованных символов.
+    """
+    if PDF_FONT_NAME not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(
+            TTFont(PDF_FONT_NAME, settings.PDF_FONT_PATH)
+        )
+    return PDF_FONT_NAME
+
+
+def pdf_font_error() -> str | None:
+    """Текст ошибки, если шрифт PDF_FONT_PATH не загружается,
+    иначе None. Без шрифта выгрузка в PDF недоступна,
+    остальные форматы работают.
+    """
+    try:
+        pdf_font()
+    except TTFError as error:
+        return f"Шрифт PDF_FONT_PATH не загружается: {error}"
+    return None
+
+
+def check_pdf_font(app_configs, **kwargs) -> list[Warning]:
+    error = pdf_font_error()
+    if error is None:
+        return []
+    return [Warning(
+        error,
+        hint="Установите шрифт DejaVu (fonts-dejavu-core) или укажите "
+             "путь к шрифту TrueType с кириллицей в PDF_FONT_PATH.",
+        id="api.W001",
+    )]
+
+
+def pdf_writer(title: list[str], rows: Iterable[Row]) -> Iterator[bytes]:
+    buffer = BytesIO()
+    document = canvas.Canvas(buffer, pagesize=A4, pageCompression=1)
+    height = A4[1]
+    lines_per_page = int((height - 2 * PDF_MARGIN) // PDF_LINE_HEIGHT)
+    font = pdf_font()
+    lines = chain(title, (
+        f"{name}: {amount} {measurement}"
+        for name, amount, measurement in rows
+    ))
+    text = None
+    for number, line in enumerate(lines):
+        if number % lines_per_page == 0:
+            if text is not None:
+                document.drawText(text)
+                document.showPage()
+            text = document.beginText(
+                PDF_MARGIN, height - PDF_MARGIN - PDF_FONT_SIZE
+            )
+            text.setFont(font, PDF_FONT_SIZE, PDF_LINE_HEIGHT)
+        text.textLine(line)
+    if text is not None:
+        document.drawText(text)
+    document.save()
+    yield buffer.getvalue()
+
+
+# Формат выгрузки: функция записи, Content-Type
+SHOPPING_LIST_WRITERS: dict[str, tuple[Callable, str]] = {
+    "txt": (txt_writer, "text/plain; charset=utf-8"),
+    "csv": (csv_writer, "text/csv; charset=utf-8"),
+    "pdf": (pdf_writer, "application/pdf"),
+}
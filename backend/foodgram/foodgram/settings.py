@@ -46,6 +46,8 @@ INSTALLED_APPS = [
 AUTH_USER_MODEL = "users.CustomUser"
 
 MIDDLEWARE = [
+    "core.middleware.MetricsMiddleware",
+    "core.middleware.RequestTimingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -91,6 +93,22 @@ DATABASES = {
 }
 
 
+# Cache
+# Файловый кэш общий для всех воркеров gunicorn на сервере.
+
+CACHES = {
+    "default": {
+        "BACKEND": os.getenv(
+            "CACHE_BACKEND",
+            default="django.core.cache.backends.filebased.FileBasedCache"
+        ),
+        "LOCATION": os.getenv(
+            "CACHE_LOCATION", default="/var/tmp/foodgram_cache"
+        ),
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
 
@@ -127,6 +145,34 @@ USE_L10N = True
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 
+# Шрифт с кириллицей для выгрузки списка покупок в PDF
+PDF_FONT_PATH = os.getenv(
+    "PDF_FONT_PATH",
+    default="/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+)
+
+# Количество потоков для создания копий изображений рецептов.
+# При значении 0 копии создаются в потоке запроса.
+IMAGE_RENDITION_WORKERS = int(os.getenv("IMAGE_RENDITION_WORKERS", default=2))
+
+# Количество потоков для рассылки рецептов в ленты подписчиков
+# авторов с большим числом подписчиков (см. core.feed).
+# При значении 0 рассылка выполняется в потоке запроса.
+FEED_FANOUT_WORKERS = int(os.getenv("FEED_FANOUT_WORKERS", default=1))
+
+# Заголовок Server-Timing и лог медленных запросов.
+# При выключенном замере middleware не участвует в обработке.
+REQUEST_TIMING = os.getenv(
+    "REQUEST_TIMING", default="false"
+).lower() in ("1", "true")
+# Запросы дольше этого времени в миллисекундах пишутся в лог
+SLOW_REQUEST_MS = int(os.getenv("SLOW_REQUEST_MS", default=500))
+
+# Метрики запросов для /api/metrics. Каждый воркер пишет значения
+# в свой файл в METRICS_DIR, страница метрик их суммирует.
+METRICS = os.getenv("METRICS", default="true").lower() in ("1", "true")
+METRICS_DIR = os.getenv("METRICS_DIR", default="/var/tmp/foodgram_metrics")
+
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media') 
 
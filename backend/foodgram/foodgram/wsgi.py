@@ -10,7 +10,16 @@ https://docs.djangoproject.com/en/2.2/howto/deployment/wsgi/
 import os
 
 from django.core.wsgi import get_wsgi_application
+from django.db import DatabaseError
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "foodgram.settings")
 
 application = get_wsgi_application()
+
+from core.search import ingredient_index  # noqa: E402
+
+try:
+    ingredient_index.build()
+except DatabaseError:
+    # База ещё не готова, индекс соберётся при первом запросе.
+    pass
@@ -1,10 +1,13 @@
-from django.contrib.admin import ModelAdmin
+from django.contrib.admin import ModelAdmin, TabularInline
 from django.utils.safestring import SafeString, mark_safe
 from django.contrib import admin
+from django.core.files.storage import default_storage
 
 from .forms import TagForm
 from .models import AmountIngredient, Cart, Favorit, Ingredient, Recipe, Tag
 from core.enums import Tuples
+from core.images import RENDITION_WIDTHS, rendition_name
+from core.services import amounts_delta, recipe_amounts, shopping_list_apply
 
 
 class TagAdmin(ModelAdmin):
@@ -29,20 +32,34 @@ class IngredientAdmin(ModelAdmin):
         "measurement_unit",
     )
     search_fields = ("name",)
-    list_filter = ("name",)
+    list_filter = ("measurement_unit",)
 
     save_on_top = True
     empty_value_display = Tuples.EMPTY_VALUE_DISPLAY.value
 
 
+class AmountIngredientInline(TabularInline):
+    model = AmountIngredient
+    autocomplete_fields = ("ingredients",)
+    extra = 1
+
+
 class RecipeAdmin(ModelAdmin):
+    """Рецепты.
+    Связанные объекты выбираются через автодополнение, фильтры
+    построены по небольшим таблицам (тэги), поэтому количество
+    запросов страницы не зависит от числа рецептов и авторов.
+    """
     list_display = (
         "name",
         "author",
         "get_image",
         "count_favorites",
+        "carts_count",
+        "popularity",
         "image",
     )
+    list_select_related = ("author",)
     fields = (
         (
             "name",
@@ -55,30 +72,47 @@ class RecipeAdmin(ModelAdmin):
         ("text",),
         ("image",),
     )
-    raw_id_fields = ("author",)
-    filter_horizontal = ["tags"]
+    autocomplete_fields = ("author", "tags")
+    inlines = (AmountIngredientInline,)
     search_fields = (
         "name",
         "author__username",
-        "tags__name",
-    )
-    list_filter = (
-        "name",
-        "author__username",
-        "tags__name",
     )
+    list_filter = ("tags",)
+    show_full_result_count = False
 
     save_on_top = True
     empty_value_display = Tuples.EMPTY_VALUE_DISPLAY.value
 
     def get_image(self, obj: Recipe) -> SafeString:
         if obj.image:
+            url = obj.image.url
+            if obj.image_renditions_for == obj.image.name:
+                url = default_storage.url(rendition_name(
+                    obj.image.name, RENDITION_WIDTHS[0], "webp"
+                ))
             return mark_safe(
-                f'<img src={obj.image.url} width="50" hieght="20"'
+                f'<img src={url} width="50" hieght="20"'
             )
 
     def count_favorites(self, obj: Recipe) -> int:
-        return obj.in_favorites.count()
+        return obj.favorites_count
+
+    count_favorites.admin_order_field = "favorites_count"
+
+    def save_related(self, request, form, formsets, change) -> None:
+        """Переносит изменение ингредиентов в списки покупок."""
+        recipe = form.instance
+        old = recipe_amounts(recipe) if change else {}
+        super().save_related(request, form, formsets, change)
+        delta = amounts_delta(old, recipe_amounts(recipe))
+        if delta:
+            shopping_list_apply(
+                list(recipe.in_shopping_cart.values_list(
+                    "user_id", flat=True
+                )),
+                delta,
+            )
 
 
 class FavoriteAdmin(ModelAdmin):
@@ -87,6 +121,8 @@ class FavoriteAdmin(ModelAdmin):
         "recipe",
         "date_added",
     )
+    list_select_related = ("user", "recipe")
+    autocomplete_fields = ("user", "recipe")
     search_fields = (
         "user__username",
         "recipe__name",
@@ -100,6 +136,8 @@ class CartAdmin(ModelAdmin):
         "recipe",
         "date_added",
     )
+    list_select_related = ("user", "recipe")
+    autocomplete_fields = ("user", "recipe")
     search_fields = (
         "user__username",
         "recipe__name",
@@ -113,10 +151,11 @@ class AmountIngredientAdmin(ModelAdmin):
         "ingredients",
         "amount",
     )
+    list_select_related = ("recipe", "ingredients")
+    autocomplete_fields = ("recipe", "ingredients")
     search_fields = (
-        "recipe",
-        "amount",
-        "ingredients",
+        "recipe__name",
+        "ingredients__name",
     )
     empty_value_display = Tuples.EMPTY_VALUE_DISPLAY.value
 
@@ -0,0 +1,96 @@
+"""Менеджмент команда для сверки счётчиков.
+Счётчики Recipe (favorites_count, carts_count) и CustomUser
+(recipes_count, followers_count) пересчитываются по связанным
+записям частями по Limits.STREAM_CHUNK_SIZE объектов.
+Для применения команды в консоли прописываем:
+  python manage.py counters          - исправить расхождения;
+  python manage.py counters --check  - только найти расхождения.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from core.enums import Limits
+from recipes.models import Cart, Favorit, Recipe
+from users.models import CustomUser, Follow
+
+# Модель счётчика: {поле счётчика: (модель записи, поле со ссылкой)}
+COUNTERS = {
+    Recipe: {
+        "favorites_count": (Favorit, "recipe"),
+        "carts_count": (Cart, "recipe"),
+    },
+    CustomUser: {
+        "recipes_count": (Recipe, "author"),
+        "followers_count": (Follow, "author"),
+    },
+}
+
+
+def actual_count(model, field: str) -> Coalesce:
+    """Подзапрос с количеством записей model, ссылающихся на объект."""
+    return Coalesce(
+        Subquery(
+            model.objects.filter(**{field: OuterRef("pk")}).order_by()
+            .values(field).annotate(total=Count("pk")).values("total"),
+            output_field=IntegerField(),
+        ),
+        0,
+    )
+
+
+class Command(BaseCommand):
+    help = "Сверка и исправление счётчиков рецептов и пользователей"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Только проверить расхождения, не изменяя данные",
+        )
+
+    def handle(self, *args, **options):
+        drift = 0
+        for model, counters in COUNTERS.items():
+            for counter, (source, field) in counters.items():
+                drift += self.reconcile(
+                    model, counter, source, field, options["check"]
+                )
+        if options["check"] and drift:
+            raise CommandError(f"Найдено расхождений: {drift}")
+        if options["check"]:
+            self.stdout.write(self.style.SUCCESS("Расхождений нет"))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f"Исправлено расхождений: {drift}"
+            ))
+
+    def reconcile(self, model, counter, source, field, check) -> int:
+        """Сверяет counter частями по возрастанию pk.
+        Расхождения исправляются одним UPDATE на часть, значение
+        пересчитывается подзапросом в том же запросе, поэтому
+        параллельные изменения счётчика не теряются.
+        """
+        drift, last_pk = 0, 0
+        chunk_size = Limits.STREAM_CHUNK_SIZE.value
+        while True:
+            pks = list(model.objects.filter(pk__gt=last_pk).order_by(
+                "pk"
+            ).values_list("pk", flat=True)[:chunk_size])
+            if not pks:
+                return drift
+            last_pk = pks[-1]
+            wrong = list(model.objects.filter(pk__in=pks).annotate(
+                actual=actual_count(source, field)
+            ).filter(~Q(**{counter: F("actual")})).values_list(
+                "pk", counter, "actual"
+            ))
+            for pk, stored, actual in wrong:
+                self.stdout.write(
+                    f"{model.__name__} {pk}: {counter} {stored} -> {actual}"
+                )
+            drift += len(wrong)
+            if wrong and not check:
+                model.objects.filter(pk__in=[row[0] for row in wrong]).update(
+                    **{counter: actual_count(source, field)}
+                )
@@ -0,0 +1,110 @@
+"""Менеджмент команда для выгрузки рецептов.
+Рецепты записываются в NDJSON (один JSON-объект рецепта в строке)
+вместе с тэгами и ингредиентами, изображения - в tar-архив.
+Рецепты читаются из БД частями, в памяти держится только текущая часть.
+Для применения команды в консоли прописываем:
+  python manage.py exportrecipes recipes.ndjson --media media.tar
+Выгрузка загружается обратно командой importrecipes.
+"""
+import json
+import tarfile
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db.models import Prefetch
+
+from core.enums import Limits
+from recipes.models import AmountIngredient, Recipe
+
+
+def recipe_chunks(chunk_size: int):
+    """Рецепты частями по возрастанию pk.
+    Каждая часть загружается с тэгами и ингредиентами
+    фиксированным числом запросов.
+    """
+    queryset = Recipe.objects.select_related("author").prefetch_related(
+        "tags",
+        Prefetch(
+            "ingredient",
+            AmountIngredient.objects.select_related("ingredients"),
+        ),
+    ).order_by("pk")
+    last_pk = 0
+    while chunk := list(queryset.filter(pk__gt=last_pk)[:chunk_size]):
+        yield chunk
+        last_pk = chunk[-1].pk
+
+
+def recipe_record(recipe: Recipe) -> dict:
+    return {
+        "author": recipe.author.email,
+        "name": recipe.name,
+        "text": recipe.text,
+        "cooking_time": recipe.cooking_time,
+        "pub_date": recipe.pub_date.isoformat(),
+        "image": recipe.image.name,
+        "tags": [tag.slug for tag in recipe.tags.all()],
+        "ingredients": [
+            {
+                "name": item.ingredients.name,
+                "measurement_unit": item.ingredients.measurement_unit,
+                "amount": item.amount,
+            }
+            for item in recipe.ingredient.all()
+        ],
+    }
+
+
+class Command(BaseCommand):
+    help = "Выгрузка рецептов в NDJSON и архив изображений"
+
+    def add_arguments(self, parser):
+        parser.add_argument("output", type=str, help="Путь к NDJSON-файлу")
+        parser.add_argument(
+            "--media", type=str, help="Путь к tar-архиву изображений"
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=Limits.STREAM_CHUNK_SIZE.value,
+            help="Количество рецептов, читаемых из БД за раз",
+        )
+
+    def handle(self, *args, **options):
+        exported = images = 0
+        archive = None
+        self.archived: set[str] = set()
+        if options["media"]:
+            archive = tarfile.open(options["media"], "w")
+        try:
+            with open(options["output"], "w", encoding="utf-8") as output:
+                for chunk in recipe_chunks(options["chunk_size"]):
+                    for recipe in chunk:
+                        output.write(json.dumps(
+                            recipe_record(recipe), ensure_ascii=False
+                        ) + "\n")
+                        if archive is not None and self.add_image(
+                            archive, recipe.image.name
+                        ):
+                            images += 1
+                    exported += len(chunk)
+        finally:
+            if archive is not None:
+                archive.close()
+        self.stdout.write(self.style.SUCCESS(
+            f"Выгружено рецептов: {exported}, изображений: {images}"
+        ))
+
+    def add_image(self, archive: tarfile.TarFile, name: str) -> bool:
+        """Добавляет изображение в архив один раз."""
+        if name in self.archived:
+            return False
+        self.archived.add(name)
+        if not name or not default_storage.exists(name):
+            self.stderr.write(f"Нет файла изображения: {name}")
+            return False
+        info = tarfile.TarInfo(name)
+        info.size = default_storage.size(name)
+        with default_storage.open(name) as image:
+            archive.addfile(info, image)
+        return True
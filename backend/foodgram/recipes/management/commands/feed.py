@@ -0,0 +1,36 @@
+"""Менеджмент команда для пересборки лент подписок.
+Нужна после загрузки рецептов и подписок в обход сигналов, при первом
+включении лент на существующей БД и после того, как у автора стало
+меньше FEED_PUSH_FOLLOWERS подписчиков и его рецепты снова
+рассылаются в ленты.
+Ленты пересобираются частями по Limits.STREAM_CHUNK_SIZE пользователей.
+Для применения команды в консоли прописываем:
+  python manage.py feed
+"""
+from django.core.management.base import BaseCommand
+
+from core import feed
+from core.enums import Limits
+from recipes.models import FeedEntry
+from users.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = "Пересборка лент подписок пользователей"
+
+    def handle(self, *args, **options):
+        users, last_pk = 0, 0
+        while True:
+            pks = list(CustomUser.objects.filter(
+                pk__gt=last_pk, subscriptions__isnull=False
+            ).distinct().order_by("pk").values_list(
+                "pk", flat=True
+            )[:Limits.STREAM_CHUNK_SIZE.value])
+            if not pks:
+                break
+            feed.rebuild(pks[0], pks[-1])
+            users += len(pks)
+            last_pk = pks[-1]
+        self.stdout.write(self.style.SUCCESS(
+            f"Лент пересобрано: {users}, строк: {FeedEntry.objects.count()}"
+        ))
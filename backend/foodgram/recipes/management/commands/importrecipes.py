@@ -0,0 +1,272 @@
+"""Менеджмент команда для загрузки рецептов из выгрузки exportrecipes.
+Рецепты читаются из NDJSON частями и записываются пакетными
+запросами: рецепты, ингредиенты рецептов и тэги - по одному
+bulk_create на часть. Каждый рецепт запоминает хэш своей записи
+(Recipe.import_key): уже загруженные записи и повторы внутри выгрузки
+пропускаются, поэтому загрузку можно повторять. Рецепты автора
+с одинаковым названием, но разным содержимым загружаются все.
+Пропущенные записи подсчитываются по причинам, с параметром -v 2
+выводится каждая.
+Изображения из архива проверяются и сохраняются вместе с копиями
+(core.images.store_image) в пуле процессов.
+Авторы, тэги и ингредиенты должны быть в БД заранее.
+Для применения команды в консоли прописываем:
+  python manage.py importrecipes recipes.ndjson --media media.tar
+"""
+import json
+import os
+from hashlib import sha256
+import posixpath
+import tarfile
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from core import feed, fulltext
+from core.enums import Limits
+from core.images import store_image
+from core.services import touch_recipes_state
+from recipes.models import AmountIngredient, Ingredient, Recipe, Tag
+from users.models import CustomUser
+
+# Каталог изображений рецептов в хранилище
+IMAGES_PREFIX = "recipes/images/"
+
+
+def read_batches(path: str, size: int):
+    with open(path, "r", encoding="utf-8") as source:
+        records = (json.loads(line) for line in source if line.strip())
+        while batch := list(islice(records, size)):
+            yield batch
+
+
+def record_key(record: dict) -> str:
+    """Хэш содержимого записи выгрузки.
+    Тэги и ингредиенты сортируются, поэтому ключ
+    не зависит от их порядка в записи.
+    """
+    content = {
+        **record,
+        "tags": sorted(record["tags"]),
+        "ingredients": sorted(
+            record["ingredients"],
+            key=lambda item: (
+                item["name"], item["measurement_unit"], item["amount"]
+            ),
+        ),
+    }
+    return sha256(json.dumps(
+        content, sort_keys=True, ensure_ascii=False
+    ).encode()).hexdigest()
+
+
+def image_members(path: str):
+    """Имена и содержимое изображений из архива.
+    Файлы вне каталога изображений рецептов пропускаются.
+    """
+    with tarfile.open(path, "r") as archive:
+        for member in archive:
+            name = member.name
+            if (
+                not member.isfile()
+                or not name.startswith(IMAGES_PREFIX)
+                or posixpath.normpath(name) != name
+            ):
+                continue
+            yield name, archive.extractfile(member).read()
+
+
+class Command(BaseCommand):
+    help = "Загрузка рецептов из NDJSON и архива изображений"
+
+    def add_arguments(self, parser):
+        parser.add_argument("input", type=str, help="Путь к NDJSON-файлу")
+        parser.add_argument(
+            "--media", type=str, help="Путь к tar-архиву изображений"
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=Limits.STREAM_CHUNK_SIZE.value,
+            help="Количество рецептов в одной транзакции",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count(),
+            help="Количество процессов для изображений, 0 - без пула",
+        )
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size должен быть больше нуля")
+        self.tags = dict(Tag.objects.values_list("slug", "pk"))
+        self.verbosity = options["verbosity"]
+        self.skipped = Counter()
+        created = 0
+        try:
+            for batch in read_batches(options["input"], options["batch_size"]):
+                with transaction.atomic():
+                    created += self.import_batch(batch)
+        except (OSError, KeyError, ValueError) as error:
+            raise CommandError(f"Не удалось прочитать выгрузку: {error}")
+        reasons = ", ".join(
+            f"{reason}: {count}" for reason, count in self.skipped.items()
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Рецептов добавлено: {created}, "
+            f"пропущено: {sum(self.skipped.values())}"
+            + (f" ({reasons})" if reasons else "")
+        ))
+        if options["media"]:
+            stored = self.import_images(options["media"], options["workers"])
+            self.stdout.write(self.style.SUCCESS(
+                f"Изображений сохранено: {stored}"
+            ))
+        # Рецепты записаны в обход сигналов
+        touch_recipes_state()
+
+    def import_batch(self, records: list[dict]) -> int:
+        authors = {
+            email: user.pk
+            for email, user in CustomUser.objects.in_bulk(
+                {record["author"] for record in records},
+                field_name="email",
+            ).items()
+        }
+        keyed = {}
+        for record in records:
+            key = record_key(record)
+            if record["author"] not in authors:
+                self.skip("нет автора", record, always=True)
+            elif key in keyed:
+                self.skip("повтор в выгрузке", record)
+            else:
+                keyed[key] = record
+        existing = set(Recipe.objects.filter(
+            import_key__in=keyed
+        ).values_list("import_key", flat=True))
+        new = {}
+        for key, record in keyed.items():
+            if key in existing:
+                self.skip("уже загружены", record)
+            else:
+                new[key] = record
+        if not new:
+            return 0
+
+        Recipe.objects.bulk_create(
+            Recipe(
+                author_id=authors[record["author"]],
+                name=record["name"],
+                text=record["text"],
+                cooking_time=record["cooking_time"],
+                image=record["image"],
+                import_key=key,
+            )
+            for key, record in new.items()
+        )
+        # bulk_create возвращает pk не на всех БД, поэтому
+        # созданные рецепты выбираются повторно по ключу
+        recipes = {
+            recipe.import_key: recipe
+            for recipe in Recipe.objects.filter(import_key__in=new).only(
+                "pk", "author_id", "import_key", "pub_date"
+            )
+        }
+
+        dated = []
+        for key, recipe in recipes.items():
+            pub_date = parse_datetime(new[key].get("pub_date") or "")
+            if pub_date is not None:
+                recipe.pub_date = pub_date
+                dated.append(recipe)
+        Recipe.objects.bulk_update(dated, ["pub_date"])
+
+        # bulk_create не вызывает сигналы, счётчики рецептов
+        # авторов увеличиваются здесь
+        authors = Counter(recipe.author_id for recipe in recipes.values())
+        for author_id, count in authors.items():
+            CustomUser.objects.filter(pk=author_id).update(
+                recipes_count=F("recipes_count") + count
+            )
+
+        AmountIngredient.objects.bulk_create(self.amounts(new, recipes))
+        fulltext.update_documents([recipe.pk for recipe in recipes.values()])
+        feed.fan_out_recipes([recipe.pk for recipe in recipes.values()])
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe_id=recipe.pk, tag_id=self.tags[slug])
+            for key, recipe in recipes.items()
+            for slug in set(new[key]["tags"])
+            if slug in self.tags
+        )
+        return len(recipes)
+
+    def skip(self, reason: str, record: dict, always: bool = False) -> None:
+        self.skipped[reason] += 1
+        if always or self.verbosity > 1:
+            self.stderr.write(
+                f"Пропущен ({reason}): {record['author']} {record['name']}"
+            )
+
+    def amounts(self, new: dict, recipes: dict) -> list[AmountIngredient]:
+        items = [
+            (key, item) for key, record in new.items()
+            for item in record["ingredients"]
+        ]
+        ingredients = {
+            (name, unit): pk
+            for pk, name, unit in Ingredient.objects.filter(
+                name__in={item["name"] for _, item in items}
+            ).values_list("pk", "name", "measurement_unit")
+        }
+        amounts = {}
+        for key, item in items:
+            ingredient_id = ingredients.get(
+                (item["name"], item["measurement_unit"])
+            )
+            if ingredient_id is None:
+                self.stderr.write(f"Нет ингредиента: {item['name']}")
+                continue
+            amounts[recipes[key].pk, ingredient_id] = AmountIngredient(
+                recipe_id=recipes[key].pk,
+                ingredients_id=ingredient_id,
+                amount=item["amount"],
+            )
+        return list(amounts.values())
+
+    def import_images(self, path: str, workers: int) -> int:
+        """Сохраняет изображения из архива и отмечает готовые копии.
+        В очереди пула держится не больше workers * 4 файлов.
+        """
+        stored = []
+        if not workers:
+            stored = [store_image(*member) for member in image_members(path)]
+        else:
+            # Дочерние процессы не должны наследовать соединения с БД
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                pending = set()
+                for member in image_members(path):
+                    pending.add(pool.submit(store_image, *member))
+                    if len(pending) >= workers * 4:
+                        done, pending = wait(
+                            pending, return_when=FIRST_COMPLETED
+                        )
+                        stored += [future.result() for future in done]
+                stored += [future.result() for future in pending]
+        stored = [name for name in stored if name]
+
+        for start in range(0, len(stored), Limits.STREAM_CHUNK_SIZE.value):
+            Recipe.objects.filter(
+                image__in=stored[start:start + Limits.STREAM_CHUNK_SIZE.value]
+            ).update(
+                image_renditions_for=F("image"), updated_at=timezone.now()
+            )
+        return len(stored)
@@ -0,0 +1,26 @@
+"""Менеджмент команда для расчёта популярности рецептов.
+Популярность считается по отметкам избранного и корзины
+с затуханием по времени (см. core.popular) и сохраняется
+в Recipe.popularity. Команду нужно запускать периодически,
+например, раз в час из cron.
+Для применения команды в консоли прописываем:
+  python manage.py popularity
+"""
+from time import monotonic
+
+from django.core.management.base import BaseCommand
+
+from core import popular
+
+
+class Command(BaseCommand):
+    help = "Расчёт популярности рецептов"
+
+    def handle(self, *args, **options):
+        started = monotonic()
+        scores = popular.compute()
+        changed = popular.write(scores)
+        self.stdout.write(self.style.SUCCESS(
+            f"Рецептов с отметками: {len(scores)}, записано: {changed}, "
+            f"за {monotonic() - started:.1f} с"
+        ))
@@ -0,0 +1,39 @@
+"""Менеджмент команда для пересоздания копий изображений рецептов.
+Нужна после изменения имён или размеров копий (см. core.images):
+копии создаются заново для всех рецептов с изображением.
+Рецепты читаются частями по Limits.STREAM_CHUNK_SIZE.
+Для применения команды в консоли прописываем:
+  python manage.py renditions
+"""
+from django.core.management.base import BaseCommand
+
+from core.enums import Limits
+from core.images import generate_renditions
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = "Пересоздание копий изображений рецептов"
+
+    def handle(self, *args, **options):
+        created = failed = last_pk = 0
+        while True:
+            rows = list(Recipe.objects.filter(pk__gt=last_pk).exclude(
+                image=""
+            ).order_by("pk").values_list(
+                "pk", "image"
+            )[:Limits.STREAM_CHUNK_SIZE.value])
+            if not rows:
+                break
+            for recipe_id, image_name in rows:
+                try:
+                    generate_renditions(recipe_id, image_name)
+                except Exception as error:
+                    self.stderr.write(f"Рецепт {recipe_id}: {error}")
+                    failed += 1
+                else:
+                    created += 1
+            last_pk = rows[-1][0]
+        self.stdout.write(self.style.SUCCESS(
+            f"Копии созданы: {created}, ошибок: {failed}"
+        ))
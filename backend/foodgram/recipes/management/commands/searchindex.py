@@ -0,0 +1,40 @@
+"""Менеджмент команда для пересборки индекса полнотекстового поиска.
+Нужна после загрузки рецептов в обход сигналов (upmodels --model
+recipes) и при первом включении поиска на существующей БД.
+Документы пересчитываются частями по Limits.STREAM_CHUNK_SIZE рецептов.
+Для применения команды в консоли прописываем:
+  python manage.py searchindex
+"""
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from core import fulltext
+from core.enums import Limits
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = "Пересборка индекса полнотекстового поиска рецептов"
+
+    def handle(self, *args, **options):
+        fulltext.setup(connection)
+        if connection.vendor == "sqlite":
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"DELETE FROM {fulltext.FTS_TABLE} WHERE rowid NOT IN "
+                    f"(SELECT id FROM {Recipe._meta.db_table})"
+                )
+        updated, last_pk = 0, 0
+        while True:
+            pks = list(Recipe.objects.filter(pk__gt=last_pk).order_by(
+                "pk"
+            ).values_list("pk", flat=True)[:Limits.STREAM_CHUNK_SIZE.value])
+            if not pks:
+                break
+            with transaction.atomic():
+                fulltext.update_documents(pks)
+            updated += len(pks)
+            last_pk = pks[-1]
+        self.stdout.write(self.style.SUCCESS(
+            f"Документов пересчитано: {updated}"
+        ))
@@ -0,0 +1,99 @@
+"""Менеджмент команда для списков покупок ShoppingListItem.
+Списки пересчитываются из корзин (Cart) и ингредиентов рецептов
+(AmountIngredient).
+Для применения команды в консоли прописываем:
+  python manage.py shoppinglist          - пересобрать списки;
+  python manage.py shoppinglist --check  - только найти расхождения.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F, Sum
+
+from core.enums import Limits
+from recipes.models import AmountIngredient, ShoppingListItem
+
+
+def expected_items():
+    """Суммы ингредиентов по корзинам: (user_id, ingredient_id, amount).
+    Отсортированы по пользователю и ингредиенту.
+    """
+    return AmountIngredient.objects.values(
+        user_id=F("recipe__in_shopping_cart__user"),
+        ingredient_id=F("ingredients"),
+    ).filter(user_id__isnull=False).annotate(
+        amount=Sum("amount")
+    ).values_list("user_id", "ingredient_id", "amount").order_by(
+        "user_id", "ingredient_id"
+    ).iterator(chunk_size=Limits.STREAM_CHUNK_SIZE.value)
+
+
+def stored_items():
+    return ShoppingListItem.objects.values_list(
+        "user_id", "ingredient_id", "total_amount"
+    ).order_by("user_id", "ingredient_id").iterator(
+        chunk_size=Limits.STREAM_CHUNK_SIZE.value
+    )
+
+
+class Command(BaseCommand):
+    help = "Пересборка и проверка списков покупок"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Только проверить расхождения, не изменяя данные",
+        )
+
+    def handle(self, *args, **options):
+        if options["check"]:
+            drift = self.check_drift()
+            if drift:
+                raise CommandError(f"Найдено расхождений: {drift}")
+            self.stdout.write(self.style.SUCCESS("Расхождений нет"))
+            return
+        created = self.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"Списки покупок пересобраны, строк: {created}"
+        ))
+
+    def check_drift(self) -> int:
+        """Сравнивает сохранённые и рассчитанные строки.
+        Оба набора отсортированы одинаково и сравниваются слиянием,
+        поэтому в памяти держится только текущая пара строк.
+        """
+        drift = 0
+        expected, stored = expected_items(), stored_items()
+        left, right = next(expected, None), next(stored, None)
+        while left is not None or right is not None:
+            if right is None or (left is not None and left[:2] < right[:2]):
+                self.stdout.write(f"Нет строки: {left}")
+                drift += 1
+                left = next(expected, None)
+            elif left is None or right[:2] < left[:2]:
+                self.stdout.write(f"Лишняя строка: {right}")
+                drift += 1
+                right = next(stored, None)
+            else:
+                if left[2] != right[2]:
+                    self.stdout.write(f"Неверное количество: {right} {left}")
+                    drift += 1
+                left, right = next(expected, None), next(stored, None)
+        return drift
+
+    @transaction.atomic
+    def rebuild(self) -> int:
+        ShoppingListItem.objects.all().delete()
+        created, batch = 0, []
+        for user_id, ingredient_id, amount in expected_items():
+            batch.append(ShoppingListItem(
+                user_id=user_id,
+                ingredient_id=ingredient_id,
+                total_amount=amount,
+            ))
+            if len(batch) == Limits.STREAM_CHUNK_SIZE.value:
+                ShoppingListItem.objects.bulk_create(batch)
+                created += len(batch)
+                batch = []
+        ShoppingListItem.objects.bulk_create(batch)
+        return created + len(batch)
@@ -0,0 +1,62 @@
+"""Менеджмент команда для расчёта похожих рецептов.
+Для каждого рецепта сохраняются --top самых похожих рецептов
+по совпадению ингредиентов (см. core.similar). С параметром
+--incremental пересчитываются только рецепты, изменённые после
+прошлого запуска, рецепты, списки которых от них зависят,
+и рецепты, списки которых сократились после удаления рецептов.
+Для применения команды в консоли прописываем:
+  python manage.py similar                       - полный расчёт;
+  python manage.py similar --incremental         - только изменения;
+  python manage.py similar --metric jaccard      - мера Жаккара.
+"""
+from time import monotonic
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core import similar
+from core.enums import Limits
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = "Расчёт похожих рецептов по ингредиентам"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--incremental",
+            action="store_true",
+            help="Пересчитать только рецепты, изменённые после "
+                 "прошлого запуска",
+        )
+        parser.add_argument(
+            "--metric",
+            choices=similar.METRICS,
+            default=similar.METRICS[0],
+            help="Мера сходства",
+        )
+        parser.add_argument(
+            "--top",
+            type=int,
+            default=Limits.SIMILAR_TOP_K.value,
+            help="Количество похожих рецептов для рецепта",
+        )
+
+    def handle(self, *args, **options):
+        started = monotonic()
+        computed_at = timezone.now()
+        top = options["top"]
+        since = similar.last_computed_at() if options["incremental"] else None
+        matrix = similar.IngredientMatrix(options["metric"]).load()
+        if since is None:
+            recipe_ids = list(Recipe.objects.values_list("pk", flat=True))
+        else:
+            recipe_ids = similar.affected_recipes(
+                matrix, similar.changed_recipes(since), top
+            )
+            recipe_ids |= similar.incomplete_recipes(matrix, top, recipe_ids)
+        written = similar.write_similar(matrix, recipe_ids, top, computed_at)
+        self.stdout.write(self.style.SUCCESS(
+            f"Рецептов пересчитано: {len(recipe_ids)}, строк: {written}, "
+            f"за {monotonic() - started:.1f} с"
+        ))
@@ -1,16 +1,56 @@
 """Менеджмент команда для добавления данных в БД.
-Для добавления данных необходимо:
-- Импортировать модель;
-- Указать модель в переменной obj;
-- Указать поля модели в переменных obj.MyFields;
+Файл загружается частями, повторная загрузка того же файла
+не создаёт дубликатов. Для новой модели достаточно добавить
+описание core.loaders.Mapping в MAPPINGS:
+- модель;
+- поля модели в порядке колонок CSV;
+- поля ключа, по которым строка считается загруженной.
 Для применения команды в консоли прописываем:
-  python manage.py upmodels /path/csv.
+  python manage.py upmodels /path/csv
+  python manage.py upmodels /path/csv --model tags --header
 """
 import csv
-from django.core.management.base import BaseCommand
-from django.db import IntegrityError
 
-from recipes.models import Ingredient
+from django.core.management.base import BaseCommand, CommandError
+
+from core.enums import DataVersions, Limits
+from core.loaders import CSVLoader, Mapping
+from recipes.models import Ingredient, Recipe, Tag
+from users.models import CustomUser
+
+
+def authors_by_email(emails: set) -> dict:
+    return {
+        email: user.pk
+        for email, user in CustomUser.objects.in_bulk(
+            emails, field_name="email"
+        ).items()
+    }
+
+
+MAPPINGS = {
+    "ingredients": Mapping(
+        Ingredient,
+        fields=("name", "measurement_unit"),
+        key=("name", "measurement_unit"),
+        version=DataVersions.INGREDIENTS.value,
+    ),
+    "tags": Mapping(
+        Tag,
+        fields=("name", "color", "slug"),
+        key=("slug",),
+        version=DataVersions.TAGS.value,
+    ),
+    # Колонка author содержит email автора, изображение - путь
+    # к файлу в MEDIA_ROOT. Тэги и ингредиенты не загружаются.
+    # После загрузки нужны команды counters и searchindex.
+    "recipes": Mapping(
+        Recipe,
+        fields=("author_id", "name", "image", "text", "cooking_time"),
+        key=("author", "name"),
+        resolvers={"author_id": authors_by_email},
+    ),
+}
 
 
 class Command(BaseCommand):
@@ -18,21 +58,38 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument("csv_file", type=str, help="Путь к CSV-файлу")
+        parser.add_argument(
+            "--model",
+            choices=MAPPINGS,
+            default="ingredients",
+            help="Модель для загрузки",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=Limits.LOADER_CHUNK_SIZE.value,
+            help="Количество строк, загружаемых за раз",
+        )
+        parser.add_argument(
+            "--header",
+            action="store_true",
+            help="Первая строка файла - заголовок",
+        )
 
     def handle(self, *args, **options):
-        csv_file = options["csv_file"]
-        obj_list = []
-        with open(csv_file, "r") as f:
-            reader = csv.reader(f)
-            next(reader)
-            for row in reader:
-                obj = Ingredient(
-                    name = row[0],
-                    measurement_unit = row[1],
-                )
-                obj_list.append(obj)
+        if options["chunk_size"] < 1:
+            raise CommandError("--chunk-size должен быть больше нуля")
+        loader = CSVLoader(MAPPINGS[options["model"]], options["chunk_size"])
         try:
-            Ingredient.objects.bulk_create(obj_list)
-            self.stdout.write(self.style.SUCCESS('Данные добавлены в БД'))
-        except IntegrityError:
-            self.stderr.write(self.style.ERROR('Не получилось копировать данные в БД'))
+            with open(options["csv_file"], "r", encoding="utf-8") as f:
+                reader = csv.reader(f)
+                if options["header"]:
+                    next(reader, None)
+                loader.load(row for row in reader if row)
+        except OSError as error:
+            raise CommandError(f"Не удалось прочитать файл: {error}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Строк прочитано: {loader.read}, добавлено: {loader.created}, "
+            f"пропущено: {loader.skipped}, "
+            f"{loader.rows_per_second:.0f} строк/с"
+        ))
@@ -15,12 +15,20 @@ Models:
         Избранные пользователем рецепты.
     Cart:
         Рецепты в корзине покупок.
+    ShoppingListItem:
+        Итоговое количество ингредиента в списке покупок пользователя.
+    FeedEntry:
+        Рецепт в ленте подписчика автора.
+    SimilarRecipe:
+        Похожий рецепт, рассчитанный командой similar.
 """
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 from django.core.validators import MinValueValidator, MaxValueValidator
 
 from users.models import CustomUser
 from core.enums import Limits
+from core.models import CounterFieldsMixin, SearchVectorIndex
 from core.validators import (hex_validator_code,
                              validate_field_name,
                              validate_field_slug)
@@ -115,7 +123,7 @@ class Ingredient(models.Model):
         return f"Ингридиент: {self.name}"
 
 
-class Recipe(models.Model):
+class Recipe(CounterFieldsMixin, models.Model):
     """Основная модель с рецептами.
     Связана с моделью Recipe через М2М.
     В модели добавлен метод clean для валидации полей.
@@ -136,12 +144,32 @@ class Recipe(models.Model):
             Используется при добавлении рецепта в `покупки`.
         pub_date(datetime):
             Дата добавления рецепта.
+        updated_at(datetime):
+            Дата последнего изменения рецепта, его тэгов
+            и ингредиентов. Используется для Last-Modified и ETag.
         image:
             Изображение рецепта.
+        image_renditions_for:
+            Имя изображения, для которого созданы уменьшенные копии
+            (см. core.images).
         text:
             Описание рецепта.
         cooking_time:
             Время приготовления рецепта. Добавлена валидация.
+        favorites_count, carts_count:
+            Сколько пользователей добавили рецепт в избранное
+            и в корзину. Меняются сигналами recipes.signals,
+            сверяются командой counters.
+        popularity:
+            Популярность с затуханием по времени, рассчитывается
+            командой popularity (см. core.popular).
+        import_key:
+            Хэш записи выгрузки, из которой загружен рецепт
+            командой importrecipes. Повторная загрузка той же
+            записи пропускается.
+        search_vector:
+            Документ полнотекстового поиска на PostgreSQL
+            (см. core.fulltext).
     """
     author = models.ForeignKey(
         CustomUser,
@@ -164,6 +192,12 @@ class Recipe(models.Model):
         upload_to="recipes/images/",
         help_text="Добавьте изображение",
     )
+    image_renditions_for = models.CharField(
+        verbose_name="Копии изображения созданы для",
+        max_length=100,
+        blank=True,
+        editable=False,
+    )
     cooking_time = models.PositiveSmallIntegerField(
         verbose_name="Время приготовления",
         help_text="Укажите время в минутах",
@@ -180,16 +214,71 @@ class Recipe(models.Model):
         verbose_name='Дата публикации',
         auto_now_add=True,
     )
+    updated_at = models.DateTimeField(
+        verbose_name='Дата изменения',
+        auto_now=True,
+    )
     tags = models.ManyToManyField(
         Tag,
         verbose_name="Тег",
         related_name="recipes",
     )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name="В избранном",
+        default=0,
+        editable=False,
+    )
+    carts_count = models.PositiveIntegerField(
+        verbose_name="В корзинах",
+        default=0,
+        editable=False,
+    )
+
+    popularity = models.FloatField(
+        verbose_name="Популярность",
+        default=0.0,
+        editable=False,
+    )
+
+    import_key = models.CharField(
+        verbose_name="Ключ загрузки",
+        max_length=64,
+        null=True,
+        editable=False,
+    )
+
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    counter_fields = ("favorites_count", "carts_count")
 
     class Meta:
         verbose_name = "Рецепт"
         verbose_name_plural = "Рецепты"
         ordering = ('-pub_date',)
+        constraints = (
+            models.UniqueConstraint(
+                fields=('import_key',), name='unique_recipe_import_key'
+            ),
+        )
+        indexes = (
+            # Ключ постраничного вывода по курсору
+            models.Index(
+                fields=('-pub_date', '-id'), name='recipe_pub_date_id_idx'
+            ),
+            # Рецепты автора: фильтр author и рецепты в подписках
+            models.Index(
+                fields=('author', '-pub_date'),
+                name='recipe_author_pub_date_idx',
+            ),
+            # Сортировка ordering=popular и списки популярных рецептов
+            models.Index(
+                fields=('-popularity', '-id'), name='recipe_popularity_idx'
+            ),
+            # Полнотекстовый поиск на PostgreSQL (core.fulltext)
+            SearchVectorIndex(
+                fields=('search_vector',), name='recipe_search_vector_idx'
+            ),
+        )
 
     def clean(self) -> None:
         self.name = validate_field_name(self.name)
@@ -225,7 +314,10 @@ class AmountIngredient(models.Model):
     amount = models.PositiveSmallIntegerField(
         verbose_name="Количество",
         default=1,
-        validators=[MinValueValidator(1), MaxValueValidator(1000)],
+        validators=[
+            MinValueValidator(1),
+            MaxValueValidator(Limits.MAX_INGREDIENT_AMOUNT.value),
+        ],
     )
 
     class Meta:
@@ -278,6 +370,18 @@ class Favorit(models.Model):
                 name="unique_favorites"
             ),
         )
+        # Уникальное ограничение начинается с recipe и обслуживает
+        # поиск по рецепту, индексы ниже - выборку по пользователю
+        # и отметки за окно расчёта популярности (core.popular)
+        indexes = (
+            models.Index(
+                fields=("user", "recipe"), name="favorit_user_recipe_idx"
+            ),
+            models.Index(
+                fields=("date_added", "recipe"),
+                name="favorit_date_recipe_idx",
+            ),
+        )
 
     def __str__(self) -> str:
         return f"{self.user} добавил в избранное {self.recipe}"
@@ -319,6 +423,172 @@ class Cart(models.Model):
                 name="unique_cart"
             ),
         ]
+        indexes = (
+            models.Index(
+                fields=("user", "recipe"), name="cart_user_recipe_idx"
+            ),
+            models.Index(
+                fields=("date_added", "recipe"), name="cart_date_recipe_idx"
+            ),
+        )
 
     def __str__(self) -> str:
         return f"{self.user} добавил в корзину {self.recipe}"
+
+
+class ShoppingListItem(models.Model):
+    """Строка списка покупок пользователя.
+    Хранит сумму ингредиента по всем рецептам в корзине.
+    Обновляется при добавлении и удалении рецептов из корзины
+    и при изменении ингредиентов рецепта
+    (см. core.services.shopping_list_apply).
+    Поля модели:
+        user:
+            Владелец списка через ForeignKey.
+        ingredient:
+            Ингредиент через ForeignKey.
+        total_amount:
+            Суммарное количество ингредиента.
+    """
+    user = models.ForeignKey(
+        CustomUser,
+        verbose_name="Владелец списка",
+        related_name="shopping_list",
+        on_delete=models.CASCADE,
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        verbose_name="Ингредиент",
+        related_name="in_shopping_lists",
+        on_delete=models.CASCADE,
+    )
+    total_amount = models.PositiveIntegerField(
+        verbose_name="Количество",
+    )
+
+    class Meta:
+        verbose_name = "Строка списка покупок"
+        verbose_name_plural = "Список покупок"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "ingredient"],
+                name="unique_shopping_list_item"
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.user}: {self.ingredient} {self.total_amount}"
+
+
+class FeedEntry(models.Model):
+    """Рецепт в ленте подписчика.
+    Строки добавляются при публикации рецепта и при подписке
+    (см. core.feed). Рецепты авторов с большим числом подписчиков
+    в ленты не записываются и читаются при выводе ленты.
+    Поля модели:
+        user:
+            Владелец ленты.
+        recipe:
+            Рецепт через ForeignKey.
+        author:
+            Автор рецепта, для удаления строк при отписке.
+        pub_date:
+            Дата публикации рецепта, ключ сортировки ленты.
+    """
+    user = models.ForeignKey(
+        CustomUser,
+        verbose_name="Владелец ленты",
+        related_name="feed",
+        on_delete=models.CASCADE,
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        verbose_name="Рецепт",
+        related_name="feed_entries",
+        on_delete=models.CASCADE,
+    )
+    author = models.ForeignKey(
+        CustomUser,
+        verbose_name="Автор рецепта",
+        related_name="+",
+        on_delete=models.CASCADE,
+    )
+    pub_date = models.DateTimeField(
+        verbose_name="Дата публикации",
+    )
+
+    class Meta:
+        verbose_name = "Рецепт в ленте"
+        verbose_name_plural = "Ленты подписок"
+        constraints = (
+            models.UniqueConstraint(
+                fields=("user", "recipe"), name="unique_feed_entry"
+            ),
+        )
+        indexes = (
+            # Ключ постраничного вывода ленты
+            models.Index(
+                fields=("user", "-pub_date", "-recipe"),
+                name="feed_user_pub_date_idx",
+            ),
+            # Удаление строк автора при отписке
+            models.Index(
+                fields=("user", "author"), name="feed_user_author_idx"
+            ),
+        )
+
+    def __str__(self) -> str:
+        return f"{self.recipe} в ленте {self.user}"
+
+
+class SimilarRecipe(models.Model):
+    """Похожий рецепт по совпадению ингредиентов.
+    Строки рассчитываются командой similar (см. core.similar),
+    для каждого рецепта хранится не больше SIMILAR_TOP_K строк.
+    Поля модели:
+        recipe:
+            Рецепт, для которого подобраны похожие.
+        similar:
+            Похожий рецепт.
+        score:
+            Мера сходства от 0 до 1.
+        computed_at:
+            Время запуска расчёта, по нему выбираются рецепты
+            для пересчёта при следующем запуске.
+    """
+    recipe = models.ForeignKey(
+        Recipe,
+        verbose_name="Рецепт",
+        related_name="similar_recipes",
+        on_delete=models.CASCADE,
+    )
+    similar = models.ForeignKey(
+        Recipe,
+        verbose_name="Похожий рецепт",
+        related_name="+",
+        on_delete=models.CASCADE,
+    )
+    score = models.FloatField(
+        verbose_name="Сходство",
+    )
+    computed_at = models.DateTimeField(
+        verbose_name="Время расчёта",
+    )
+
+    class Meta:
+        verbose_name = "Похожий рецепт"
+        verbose_name_plural = "Похожие рецепты"
+        constraints = (
+            models.UniqueConstraint(
+                fields=("recipe", "similar"), name="unique_similar_recipe"
+            ),
+        )
+        indexes = (
+            # Вывод похожих рецептов одним чтением по индексу
+            models.Index(
+                fields=("recipe", "-score"), name="similar_recipe_score_idx"
+            ),
+        )
+
+    def __str__(self) -> str:
+        return f"{self.similar} похож на {self.recipe}"
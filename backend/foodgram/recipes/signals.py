@@ -0,0 +1,241 @@
+"""Сигналы приложения recipes.
+   Обработчики:
+        ingredients_changed:
+            Меняет версию справочника ингредиентов.
+        tags_changed:
+            Меняет версию справочника тэгов.
+            Изменение ингредиента или тэга обновляет updated_at
+            рецептов, в которых он используется.
+            Версии меняются после фиксации транзакции.
+        tag_recipes_changed:
+            Обновляет updated_at рецептов изменённого или
+            удаляемого тэга.
+        recipe_tags_changed, recipe_ingredients_changed:
+            Обновляют Recipe.updated_at при изменении связей.
+            Построчные обработчики AmountIngredient пропускают
+            пакетную запись ингредиентов (suppress_amount_signals).
+        author_changed:
+            Обновляет updated_at рецептов автора при изменении
+            его данных, которые выводятся в рецепте.
+        recipes_state_changed:
+            Отмечает изменение рецептов для ETag списка рецептов.
+            Отметку ставят и все обработчики, меняющие updated_at.
+        user_state_changed:
+            Отмечает изменение избранного, корзины и подписок.
+        counter_changed:
+            Меняет счётчики Recipe и CustomUser запросом UPDATE с F()
+            в той же транзакции, что и запись объекта.
+        recipe_deleted:
+            Вычитает удаляемый рецепт из списков покупок.
+        recipe_image_saved:
+            Ставит в очередь создание копий нового изображения
+            и удаляет копии прежнего.
+        recipe_image_deleted:
+            Удаляет копии изображения удалённого рецепта.
+        search_document_changed, ingredient_search_changed,
+        recipe_search_deleted:
+            Поддерживают документы полнотекстового поиска.
+            Документ рецепта пересчитывается один раз
+            при фиксации транзакции.
+        search_setup:
+            Создаёт таблицу поиска FTS5 (SQLite) после миграций.
+        recipe_published, feed_follow_changed:
+            Поддерживают ленты подписок FeedEntry.
+"""
+from functools import partial
+
+from django.db import connections
+from django.db.models.signals import (
+    m2m_changed, post_delete, post_migrate, post_save, pre_delete
+)
+from django.dispatch import receiver
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from core import feed, fulltext
+from core.enums import DataVersions
+from core.images import delete_renditions, schedule_renditions
+from core.services import (
+    amount_signals_suppressed,
+    amounts_delta,
+    bump_data_version,
+    recipe_amounts,
+    shopping_list_apply,
+    touch_recipes_state,
+    touch_user_state,
+)
+from recipes.models import (
+    AmountIngredient, Cart, Favorit, Ingredient, Recipe, Tag
+)
+from users.models import CustomUser, Follow
+
+# Модель записи: (поле со ссылкой, модель счётчика, поле счётчика)
+COUNTERS = {
+    Favorit: ("recipe_id", Recipe, "favorites_count"),
+    Cart: ("recipe_id", Recipe, "carts_count"),
+    Follow: ("author_id", CustomUser, "followers_count"),
+    Recipe: ("author_id", CustomUser, "recipes_count"),
+}
+
+# Поля пользователя, которые выводятся в рецептах (UserSerializer)
+AUTHOR_FIELDS = {"email", "username", "first_name", "last_name"}
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def ingredients_changed(instance, signal, **kwargs) -> None:
+    bump_data_version(DataVersions.INGREDIENTS.value)
+    if signal is post_save:
+        Recipe.objects.filter(ingredients=instance).update(
+            updated_at=timezone.now()
+        )
+        touch_recipes_state()
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def tags_changed(instance, signal, **kwargs) -> None:
+    bump_data_version(DataVersions.TAGS.value)
+    if signal is post_save:
+        tag_recipes_changed(instance)
+
+
+@receiver(pre_delete, sender=Tag)
+def tag_recipes_changed(instance, **kwargs) -> None:
+    # Связи удаляемого тэга с рецептами после удаления уже не найти
+    Recipe.objects.filter(tags=instance).update(updated_at=timezone.now())
+    touch_recipes_state()
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(instance, action, reverse, pk_set, **kwargs) -> None:
+    if reverse and action == "pre_clear":
+        recipes = Recipe.objects.filter(tags=instance)
+    elif reverse and action in ("post_add", "post_remove"):
+        recipes = Recipe.objects.filter(pk__in=pk_set)
+    elif not reverse and action.startswith("post_"):
+        recipes = Recipe.objects.filter(pk=instance.pk)
+    else:
+        return
+    recipes.update(updated_at=timezone.now())
+    touch_recipes_state()
+
+
+@receiver((post_save, post_delete), sender=AmountIngredient)
+def recipe_ingredients_changed(instance, **kwargs) -> None:
+    if amount_signals_suppressed(instance.recipe_id):
+        return
+    Recipe.objects.filter(pk=instance.recipe_id).update(
+        updated_at=timezone.now()
+    )
+    touch_recipes_state()
+
+
+@receiver(post_save, sender=CustomUser)
+def author_changed(instance, created, update_fields, **kwargs) -> None:
+    # Вход пользователя сохраняет только last_login
+    if created or (
+        update_fields is not None and not AUTHOR_FIELDS & set(update_fields)
+    ):
+        return
+    if Recipe.objects.filter(author=instance).update(
+        updated_at=timezone.now()
+    ):
+        touch_recipes_state()
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def recipes_state_changed(**kwargs) -> None:
+    touch_recipes_state()
+
+
+@receiver((post_save, post_delete), sender=Favorit)
+@receiver((post_save, post_delete), sender=Cart)
+@receiver((post_save, post_delete), sender=Follow)
+def user_state_changed(instance, **kwargs) -> None:
+    touch_user_state(instance.user_id)
+
+
+@receiver((post_save, post_delete), sender=Favorit)
+@receiver((post_save, post_delete), sender=Cart)
+@receiver((post_save, post_delete), sender=Follow)
+@receiver((post_save, post_delete), sender=Recipe)
+def counter_changed(sender, instance, signal, created=False, **kwargs):
+    field, model, counter = COUNTERS[sender]
+    objects = model.objects.filter(pk=getattr(instance, field))
+    if signal is post_delete:
+        objects.filter(**{f"{counter}__gt": 0}).update(
+            **{counter: F(counter) - 1}
+        )
+    elif created:
+        objects.update(**{counter: F(counter) + 1})
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_deleted(instance, **kwargs) -> None:
+    shopping_list_apply(
+        list(instance.in_shopping_cart.values_list("user_id", flat=True)),
+        amounts_delta(recipe_amounts(instance), {}),
+    )
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_image_saved(instance, **kwargs) -> None:
+    image_name = instance.image.name
+    previous = instance.image_renditions_for
+    if previous and previous != image_name:
+        transaction.on_commit(lambda: delete_renditions(previous))
+    if not image_name or previous == image_name:
+        return
+    transaction.on_commit(
+        lambda: schedule_renditions(instance.pk, image_name)
+    )
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_image_deleted(instance, **kwargs) -> None:
+    for image_name in {instance.image.name, instance.image_renditions_for}:
+        transaction.on_commit(partial(delete_renditions, image_name))
+
+
+@receiver(post_save, sender=Recipe)
+@receiver((post_save, post_delete), sender=AmountIngredient)
+def search_document_changed(sender, instance, **kwargs) -> None:
+    if sender is AmountIngredient and amount_signals_suppressed(
+        instance.recipe_id
+    ):
+        return
+    fulltext.update_documents_on_commit(
+        instance.pk if sender is Recipe else instance.recipe_id
+    )
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_search_changed(instance, **kwargs) -> None:
+    fulltext.update_documents_for_ingredient(instance.pk)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_search_deleted(instance, **kwargs) -> None:
+    fulltext.delete_documents([instance.pk])
+
+
+@receiver(post_migrate)
+def search_setup(sender, using, **kwargs) -> None:
+    if sender.name == "recipes":
+        fulltext.setup(connections[using])
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_published(instance, created, **kwargs) -> None:
+    if created:
+        transaction.on_commit(
+            lambda: feed.publish(instance.pk, instance.author_id)
+        )
+
+
+@receiver((post_save, post_delete), sender=Follow)
+def feed_follow_changed(instance, signal, created=False, **kwargs) -> None:
+    if signal is post_delete:
+        feed.unfollow(instance.user_id, instance.author_id)
+    elif created:
+        feed.follow(instance.user_id, instance.author_id)
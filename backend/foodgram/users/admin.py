@@ -11,10 +11,12 @@ class CustomUserAdmin(UserAdmin):
         "last_name",
         "email",
         "first_name",
+        "recipes_count",
+        "followers_count",
     )
     list_filter = (
-        "email",
-        "first_name",
+        "is_active",
+        "is_staff",
     )
     search_fields = (
         "email",
@@ -24,6 +26,7 @@ class CustomUserAdmin(UserAdmin):
         "email",
         "username",
     )
+    show_full_result_count = False
 
     empty_value_display = Tuples.EMPTY_VALUE_DISPLAY.value
 
@@ -33,13 +36,11 @@ class FollowAdmin(admin.ModelAdmin):
         "user",
         "author",
     )
+    list_select_related = ("user", "author")
+    autocomplete_fields = ("user", "author")
     search_fields = (
-        "user",
-        "author",
-    )
-    list_filter = (
-        "user",
-        "author",
+        "user__username",
+        "author__username",
     )
 
     empty_value_display = Tuples.EMPTY_VALUE_DISPLAY.value
@@ -13,9 +13,10 @@ from django.core.validators import validate_email
 from django.db.models import F, Q
 
 from core.enums import Limits
+from core.models import CounterFieldsMixin
 from core.validators import validate_field_name
 
-class CustomUser(AbstractUser):
+class CustomUser(CounterFieldsMixin, AbstractUser):
     """Модель для пользователей.
     В модели добавлен метод clean для валидации полей.
     Поля модели:
@@ -30,6 +31,10 @@ class CustomUser(AbstractUser):
             Добавлена стандартная валидация.
         is_active:
             Статус пользователя (bool).
+        recipes_count, followers_count:
+            Количество рецептов и подписчиков пользователя.
+            Меняются сигналами recipes.signals, сверяются
+            командой counters.
     """
     first_name = models.CharField(
         verbose_name="Имя пользователя",
@@ -60,6 +65,18 @@ class CustomUser(AbstractUser):
         verbose_name="Статус активирован",
         default=True,
     )
+    recipes_count = models.PositiveIntegerField(
+        verbose_name="Количество рецептов",
+        default=0,
+        editable=False,
+    )
+    followers_count = models.PositiveIntegerField(
+        verbose_name="Количество подписчиков",
+        default=0,
+        editable=False,
+    )
+
+    counter_fields = ("recipes_count", "followers_count")
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username']